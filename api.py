@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 import json
 
 from auth import initialize_session_for_course
+from config import LMS_URL, APPS_URL
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +21,7 @@ def get_course_structure(session, course_url):
     course_id = course_id_match.group(1).rstrip('/')  # убираем только слэш в конце, точку оставляем
     logger.info(f"Извлечен и очищен ID курса: {course_id}")
 
+    restored_course = course_id in getattr(session, 'initialized_courses', ())
     if not initialize_session_for_course(session, course_id):
         logger.error("Инициализация сессии провалена. Невозможно продолжить.")
         return None
@@ -28,8 +30,8 @@ def get_course_structure(session, course_url):
     session.headers.update({
         'Accept': 'application/json, text/plain, */*',
         'Accept-Language': 'ru-RU,ru;q=0.9,tr-RU;q=0.8,tr;q=0.7,en-US;q=0.6,en;q=0.5',
-        'Origin': 'https://apps.skillfactory.ru',
-        'Referer': 'https://apps.skillfactory.ru/',
+        'Origin': APPS_URL,
+        'Referer': f'{APPS_URL}/',
         'Sec-Fetch-Dest': 'empty',
         'Sec-Fetch-Mode': 'cors',
         'Sec-Fetch-Site': 'same-site',
@@ -42,16 +44,16 @@ def get_course_structure(session, course_url):
 
     # Сначала пытаемся получить полную структуру, потом метаданные
     endpoints = [
-        f"https://lms.skillfactory.ru/api/extended/outline/{course_id}",
-        f"https://lms.skillfactory.ru/api/course_home/course_metadata/{course_id}"
+        f"{LMS_URL}/api/extended/outline/{course_id}",
+        f"{LMS_URL}/api/course_home/course_metadata/{course_id}"
     ]
     params = {'browser_timezone': 'Europe/Moscow'}
     
     # Добавляем специальные заголовки для API запросов
     api_headers = {
         'Accept': 'application/json, text/plain, */*',
-        'Origin': 'https://apps.skillfactory.ru',
-        'Referer': 'https://apps.skillfactory.ru/',
+        'Origin': APPS_URL,
+        'Referer': f'{APPS_URL}/',
         'use-jwt-cookie': 'true',
         'Sec-Fetch-Dest': 'empty',
         'Sec-Fetch-Mode': 'cors',
@@ -82,6 +84,12 @@ def get_course_structure(session, course_url):
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Ответ сервера: {e.response.text}")
     
+    if restored_course:
+        # Cookies курса из сохраненной сессии могли устареть - загружаем страницу курса заново
+        logger.warning("Не удалось получить структуру курса с сохраненной сессией, повторяю с инициализацией курса.")
+        session.initialized_courses.discard(course_id)
+        return get_course_structure(session, course_url)
+
     logger.error("Не удалось получить структуру курса ни по одному из известных эндпоинтов.")
     return None
 
@@ -92,7 +100,8 @@ def get_enrolled_courses_data(session):
     logger.info("Получение списка доступных курсов из ЛК...")
     
     # Сначала пробуем API enrollment (возвращает курсы, на которые записан пользователь)
-    enrollment_url = "https://lms.skillfactory.ru/api/enrollment/v1/enrollment"
+    enrollment_url = f"{LMS_URL}/api/enrollment/v1/enrollment"
+    enrollments = None  # Ответ enrollment переиспользуется для фильтрации в запасном варианте
     try:
         response = session.get(enrollment_url, timeout=20)
         response.raise_for_status()
@@ -152,7 +161,7 @@ def get_enrolled_courses_data(session):
         logger.error(f"Ошибка декодирования JSON из API enrollment: {e}")
     
     # Если API enrollment не сработал, пробуем courses API, но фильтруем только те, на которые записан пользователь
-    courses_url = "https://lms.skillfactory.ru/api/courses/v1/courses/"
+    courses_url = f"{LMS_URL}/api/courses/v1/courses/"
     try:
         logger.info("Пробую получить курсы через API courses, но буду фильтровать только доступные...")
         response = session.get(courses_url, timeout=20)
@@ -165,9 +174,11 @@ def get_enrolled_courses_data(session):
         # Получаем список ID курсов из enrollment для фильтрации
         enrolled_course_ids = set()
         try:
-            enrollment_response = session.get(enrollment_url, timeout=20)
-            if enrollment_response.status_code == 200:
-                enrollments = enrollment_response.json()
+            if enrollments is None:
+                enrollment_response = session.get(enrollment_url, timeout=20)
+                if enrollment_response.status_code == 200:
+                    enrollments = enrollment_response.json()
+            if enrollments is not None:
                 for enrollment in enrollments:
                     # Извлекаем ID курса любым доступным способом
                     course_id = None
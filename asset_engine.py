@@ -0,0 +1,349 @@
+# asset_engine.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    import httpx  # Необязательная зависимость: асинхронное скачивание ресурсов страниц (pip install httpx)
+except ImportError:
+    httpx = None
+
+from config import ASSET_ASYNC_CONCURRENCY, ASSET_DOWNLOAD_WORKERS, DOWNLOAD_CHUNK_MIN_BYTES, HTTP_RETRIES
+import metrics
+import tracing
+from request_stats import record_request
+from transport import _RETRY_STATUSES, _request_headers, _retry_delay
+from utils import (
+    download_file, download_file_sniffed, sniff_extension,
+    _is_unexpected_content, _expected_size, _create_temp_file, _remove_temp_file, _transfer_progress, _download_budget
+)
+
+logger = logging.getLogger(__name__)
+
+# Ресурс для скачивания. Путь задается либо сразу (filepath), либо строится по типу файла,
+# определенному из ответа сервера: build_path(extension), allowed_extensions и default_extension
+# работают так же, как в download_file_sniffed.
+AssetJob = namedtuple(
+    'AssetJob',
+    ['url', 'filepath', 'build_path', 'allowed_extensions', 'default_extension', 'skip_existing', 'resumable'],
+    defaults=(None, None, None, None, False, False)
+)
+
+
+async def _next_chunk(chunks):
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return b''
+
+
+class AsyncAssetEngine:
+    """
+    Асинхронное скачивание ресурсов страниц на httpx.
+    Цикл событий работает в отдельном потоке и общий для всех потоков программы:
+    одновременных запросов не больше ASSET_ASYNC_CONCURRENCY на процесс,
+    а память ограничена одним блоком чтения на активный запрос.
+    """
+
+    def __init__(self, concurrency=ASSET_ASYNC_CONCURRENCY, transport=None):
+        self.concurrency = concurrency
+        # Готовый транспорт httpx (например, MockTransport в замерах bench_html.py) вместо сетевого
+        self._transport = transport
+        self._client = None
+        self._semaphore = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='asset-engine', daemon=True)
+        self._thread.start()
+        # Файлы пишутся в отдельных потоках: медленный диск не должен задерживать остальные запросы цикла
+        self._writer = ThreadPoolExecutor(max_workers=ASSET_DOWNLOAD_WORKERS, thread_name_prefix='asset-writer')
+
+    def _run(self, coroutine):
+        """Выполняет корутину в цикле движка и ждет результат в вызывающем потоке"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _disk(self, function, *args):
+        """Выполняет файловую операцию в пуле записи, не блокируя цикл событий"""
+        return self._loop.run_in_executor(self._writer, function, *args)
+
+    def _get_client(self):
+        # Клиент и семафор создаются внутри цикла событий движка
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            transport = self._transport
+            if transport is None:
+                try:
+                    transport = httpx.AsyncHTTPTransport(http2=True, retries=HTTP_RETRIES, limits=limits)
+                except ImportError:
+                    # Без пакета h2 работаем по HTTP/1.1
+                    transport = httpx.AsyncHTTPTransport(retries=HTTP_RETRIES, limits=limits)
+            self._client = httpx.AsyncClient(transport=transport, timeout=30, follow_redirects=True)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def _send(self, url, headers, timeout=30):
+        """
+        GET с повторами при 429/5xx (сетевые ошибки повторяет транспорт).
+        Тело ответа не читается: вызывающий код читает его потоково и закрывает ответ.
+        """
+        client = self._get_client()
+        for attempt in range(HTTP_RETRIES + 1):
+            response = await client.send(client.build_request('GET', url, headers=headers, timeout=timeout), stream=True)
+            if response.status_code not in _RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+            delay = _retry_delay(response, attempt)
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def _save_response(self, response, job, record_bytes=None):
+        """Асинхронный аналог _write_response: пишет тело во временный файл и атомарно переименовывает его"""
+        if _is_unexpected_content(response, job.url):
+            return None
+        expected_size = _expected_size(response)
+        chunks = response.aiter_bytes(DOWNLOAD_CHUNK_MIN_BYTES)
+        first_chunk = await _next_chunk(chunks)
+
+        filepath = job.filepath
+        if job.build_path:
+            extension = sniff_extension(
+                response.headers.get('content-type'),
+                first_chunk,
+                response.headers.get('content-disposition')
+            )
+            if not extension or (job.allowed_extensions and extension not in job.allowed_extensions):
+                if not job.default_extension:
+                    logger.debug(f"Не удалось определить подходящий тип файла ({extension}) для URL: {job.url}")
+                    return None
+                extension = job.default_extension
+            filepath = job.build_path(extension)
+
+        written_size = 0
+        temp_path = None
+        _transfer_progress.start_file(expected_size)
+        try:
+            f, temp_path = await self._disk(_create_temp_file, filepath)
+            try:
+                data = first_chunk
+                while data:
+                    await self._disk(f.write, data)
+                    written_size += len(data)
+                    _transfer_progress.update(len(data))
+                    data = await _next_chunk(chunks)
+            finally:
+                await self._disk(f.close)
+            if expected_size is not None and written_size != expected_size:
+                logger.warning(f"Файл '{os.path.basename(filepath)}' скачан не полностью: {written_size} из {expected_size} байт")
+                await self._disk(_remove_temp_file, temp_path)
+                return None
+            await self._disk(os.replace, temp_path, filepath)
+            logger.debug(f"Файл '{os.path.basename(filepath)}' успешно скачан.")
+            return filepath
+        except BaseException:
+            if temp_path:
+                _remove_temp_file(temp_path)
+            raise
+        finally:
+            _transfer_progress.finish_file(expected_size, written_size)
+            if record_bytes:
+                record_bytes(written_size)
+
+    async def _fetch_job(self, job, headers, record_bytes=None):
+        if job.skip_existing and job.filepath and os.path.exists(job.filepath):
+            logger.debug(f"Файл '{os.path.basename(job.filepath)}' уже существует, пропускаю.")
+            return job.filepath
+        async with self._semaphore:
+            started_at = time.perf_counter()
+            response = await self._send(job.url, headers)
+            latency = time.perf_counter() - started_at
+            try:
+                response.raise_for_status()
+                return await self._save_response(response, job, record_bytes)
+            finally:
+                await response.aclose()
+                record_request('GET', job.url, response.status_code, response.num_bytes_downloaded, latency)
+                if tracing.is_enabled():
+                    # Запросы цикла событий идут одновременно в одном потоке - пишем асинхронными отрезками
+                    tracing.add_async_span(f"GET {urlparse(job.url).netloc}", 'http', started_at, time.perf_counter(), {
+                        'url': job.url, 'status': response.status_code, 'bytes': response.num_bytes_downloaded
+                    })
+
+    async def _fetch_plan(self, plan, plan_headers, record_bytes=None):
+        """Пробует альтернативные URL ресурса по порядку, возвращает путь первого удачного"""
+        for job, headers in zip(plan, plan_headers):
+            try:
+                filepath = await self._fetch_job(job, headers, record_bytes)
+                if filepath:
+                    return filepath
+            except (httpx.HTTPError, OSError) as e:
+                logger.debug(f"Ошибка при скачивании файла {job.url}: {e}")
+        return None
+
+    async def _fetch_text(self, url, headers, timeout):
+        async with self._semaphore:
+            started_at = time.perf_counter()
+            response = await self._send(url, headers, timeout)
+            latency = time.perf_counter() - started_at
+            try:
+                response.raise_for_status()
+                await response.aread()
+                return response.text
+            finally:
+                await response.aclose()
+                record_request('GET', url, response.status_code, response.num_bytes_downloaded, latency)
+                if tracing.is_enabled():
+                    tracing.add_async_span(f"GET {urlparse(url).netloc}", 'http', started_at, time.perf_counter(), {
+                        'url': url, 'status': response.status_code, 'bytes': response.num_bytes_downloaded
+                    })
+
+    async def _gather(self, coroutines):
+        self._get_client()
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+
+    def download(self, plans, session):
+        """Скачивает ресурсы одновременно. Возвращает список путей (None для неудачных)."""
+        # Заголовки готовятся в вызывающем потоке: сессия requests не используется из цикла событий
+        headers = [[_request_headers(session, job.url) for job in plan] for plan in plans]
+        # Цикл событий работает в своем потоке, поэтому учет байт передается явно
+        record_bytes = metrics.byte_recorder()
+        results = self._run(self._gather([
+            self._fetch_plan(plan, plan_headers, record_bytes) for plan, plan_headers in zip(plans, headers)
+        ]))
+        return [None if isinstance(result, BaseException) else result for result in results]
+
+    def fetch_texts(self, urls, session, timeout=15):
+        """Скачивает текстовые ресурсы (CSS). Возвращает словарь URL -> текст или исключение."""
+        coroutines = [self._fetch_text(url, _request_headers(session, url), timeout) for url in urls]
+        return dict(zip(urls, self._run(self._gather(coroutines))))
+
+    def close(self):
+        if self._client is not None:
+            self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._writer.shutdown(wait=True)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_asset_engine():
+    """Возвращает общий асинхронный движок или None, если httpx не установлен"""
+    global _engine
+    if httpx is None:
+        return None
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncAssetEngine()
+            logger.debug(f"Ресурсы страниц скачиваются асинхронно (до {ASSET_ASYNC_CONCURRENCY} запросов одновременно).")
+        return _engine
+
+
+def close_asset_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
+
+
+def _download_plan_sync(plan, session):
+    for job in plan:
+        if job.build_path:
+            filepath = download_file_sniffed(job.url, session, job.build_path, job.allowed_extensions, job.default_extension)
+        elif download_file(job.url, job.filepath, session, skip_existing=job.skip_existing, resumable=job.resumable):
+            filepath = job.filepath
+        else:
+            filepath = None
+        if filepath:
+            return filepath
+    return None
+
+
+def download_assets(plans, session):
+    """
+    Скачивает ресурсы страницы одновременно.
+    plans - список AssetJob или кортежей AssetJob (альтернативные URL одного ресурса пробуются по порядку).
+    Возвращает список путей к сохраненным файлам (None для неудачных) в том же порядке.
+    Без httpx, а также для докачиваемых файлов (resumable) используется пул потоков.
+    """
+    plans = [(plan,) if isinstance(plan, AssetJob) else tuple(plan) for plan in plans]
+    results = [None] * len(plans)
+    if not plans:
+        return results
+
+    # Один и тот же файл скачивается один раз, даже если ссылка на него повторяется на странице
+    unique_plans = {}
+    for index, plan in enumerate(plans):
+        key = tuple(job.filepath for job in plan) if all(job.filepath for job in plan) else ('#', index)
+        unique_plans.setdefault(key, []).append(index)
+    first_indexes = [indexes[0] for indexes in unique_plans.values()]
+
+    engine = get_asset_engine()
+    async_indexes = [index for index in first_indexes if engine and not any(job.resumable for job in plans[index])]
+    thread_indexes = sorted(set(first_indexes) - set(async_indexes))
+
+    executor = None
+    futures = {}
+    if thread_indexes:
+        max_workers = getattr(_download_budget, 'max_workers', ASSET_DOWNLOAD_WORKERS)
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(thread_indexes)))
+        download_plan = metrics.bind(_download_plan_sync)
+        futures = {index: executor.submit(download_plan, plans[index], session) for index in thread_indexes}
+    try:
+        if async_indexes:
+            for index, filepath in zip(async_indexes, engine.download([plans[index] for index in async_indexes], session)):
+                results[index] = filepath
+        for index, future in futures.items():
+            results[index] = future.result()
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
+
+    for indexes in unique_plans.values():
+        for index in indexes[1:]:
+            results[index] = results[indexes[0]]
+    return results
+
+
+def fetch_texts(urls, session, timeout=15):
+    """
+    Скачивает текстовые ресурсы (CSS) одновременно.
+    Возвращает словарь URL -> текст (None, если скачать не удалось).
+    """
+    urls = list(dict.fromkeys(urls))
+    engine = get_asset_engine()
+    if engine:
+        results = engine.fetch_texts(urls, session, timeout)
+        for result in results.values():
+            if isinstance(result, str):
+                metrics.add_bytes(len(result.encode('utf-8')))
+    else:
+        @metrics.bind
+        def fetch(url):
+            try:
+                response = session.get(url, timeout=timeout)
+                response.raise_for_status()
+                metrics.add_bytes(len(response.content))
+                return response.text
+            except requests.RequestException as e:
+                return e
+        max_workers = getattr(_download_budget, 'max_workers', ASSET_DOWNLOAD_WORKERS)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+            results = dict(zip(urls, executor.map(fetch, urls)))
+
+    texts = {}
+    for url, result in results.items():
+        if isinstance(result, BaseException):
+            logger.warning(f"Не удалось скачать CSS {url}: {result}")
+            result = None
+        texts[url] = result
+    return texts
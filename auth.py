@@ -1,18 +1,24 @@
 import requests
 import logging
 import os
+import json
+import time
 from getpass import getpass
 from bs4 import BeautifulSoup
 
+from transport import create_session
+from config import SESSION_FILE_VERSION, LMS_URL, APPS_URL
+
 logger = logging.getLogger(__name__)
 
 # ==================================================================================================
 # АУТЕНТИФИКАЦИЯ И УПРАВЛЕНИЕ СЕССИЕЙ
 # ==================================================================================================
 
-def login_to_skillfactory(username=None, password=None):
+def login_to_skillfactory(username=None, password=None, session=None):
     """
     Выполняет вход в SkillFactory, обрабатывая CSRF, и возвращает аутентифицированную сессию.
+    Если передана session, вход выполняется в ней (повторный вход при истекшей сессии).
     """
     if not username:
         username = input("Введите email от SkillFactory: ")
@@ -20,20 +26,20 @@ def login_to_skillfactory(username=None, password=None):
         password = getpass("Введите пароль: ")
         
     logger.info("Попытка входа в SkillFactory...")
-    session = requests.Session()
+    session = session or create_session()
     session.headers.update({
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36',
         'Accept': 'application/json, text/plain, */*',
         'Accept-Language': 'ru-RU,ru;q=0.9,tr-RU;q=0.8,tr;q=0.7,en-US;q=0.6,en;q=0.5',
-        'Origin': 'https://lms.skillfactory.ru',
-        'Referer': 'https://lms.skillfactory.ru/',
+        'Origin': LMS_URL,
+        'Referer': f'{LMS_URL}/',
         'sec-ch-ua': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
         'sec-ch-ua-mobile': '?0',
         'sec-ch-ua-platform': '"Windows"'
     })
 
     # Шаг 1: Получение CSRF токена
-    csrf_url = "https://lms.skillfactory.ru/csrf/api/v1/token"
+    csrf_url = f"{LMS_URL}/csrf/api/v1/token"
     logger.debug(f"Получение CSRF токена с {csrf_url}")
     try:
         csrf_response = session.get(csrf_url, timeout=10)
@@ -49,7 +55,7 @@ def login_to_skillfactory(username=None, password=None):
         return None
 
     # Шаг 2: Вход с использованием токена
-    login_url = "https://lms.skillfactory.ru/api/user/v1/account/login_session/"
+    login_url = f"{LMS_URL}/api/user/v1/account/login_session/"
     login_payload = {
         'email': username,
         'password': password,
@@ -70,12 +76,13 @@ def login_to_skillfactory(username=None, password=None):
 
         if "sessionid" in session.cookies:
             logger.info("Вход выполнен успешно! Сессия активна.")
+            session.account_email = username
             # Обновляем заголовки для последующих запросов
             session.headers.update({
                 'Accept': 'application/json, text/plain, */*',
                 'Accept-Language': 'ru-RU,ru;q=0.9,tr-RU;q=0.8,tr;q=0.7,en-US;q=0.6,en;q=0.5',
-                'Origin': 'https://apps.skillfactory.ru',
-                'Referer': 'https://apps.skillfactory.ru/',
+                'Origin': APPS_URL,
+                'Referer': f'{APPS_URL}/',
                 'USE-JWT-COOKIE': 'true',
                 'sec-ch-ua': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
                 'sec-ch-ua-mobile': '?0',
@@ -95,11 +102,25 @@ def initialize_session_for_course(session, course_id):
     """
     Инициализирует сессию для указанного курса, переходя по страницам
     для получения необходимых cookies для домена apps.skillfactory.ru.
+    Для курсов, уже инициализированных в сохраненной сессии, страница курса не загружается.
     """
+    course_url = f"{APPS_URL}/learning/course/{course_id}/home"
+    if course_id in _initialized_courses(session):
+        logger.info(f"Сессия для курса {course_id} восстановлена из файла, загрузка страницы курса пропущена.")
+        session.headers.update({
+            'Accept': 'application/json, text/plain, */*',
+            'Origin': APPS_URL,
+            'Referer': course_url,
+            'Sec-Fetch-Dest': 'empty',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'same-site',
+            'USE-JWT-COOKIE': 'true'
+        })
+        return True
+
     logger.info(f"Инициализация сессии для курса {course_id}...")
 
     # Шаг 1: Переход на страницу курса в apps.skillfactory.ru
-    course_url = f"https://apps.skillfactory.ru/learning/course/{course_id}/home"
     logger.debug(f"Переход на страницу курса: {course_url}")
     
     # Обновляем заголовки для запроса
@@ -136,17 +157,110 @@ def initialize_session_for_course(session, course_id):
         session.headers.update({
             'Accept': 'application/json, text/plain, */*',
             'Accept-Language': 'ru-RU,ru;q=0.9,tr-RU;q=0.8,tr;q=0.7,en-US;q=0.6,en;q=0.5',
-            'Origin': 'https://apps.skillfactory.ru',
+            'Origin': APPS_URL,
             'Referer': final_url,
             'Sec-Fetch-Dest': 'empty',
             'Sec-Fetch-Mode': 'cors',
             'Sec-Fetch-Site': 'same-site',
             'USE-JWT-COOKIE': 'true'
         })
+        _initialized_courses(session).add(course_id)
         
         return True
     except requests.RequestException as e:
         logger.error(f"Ошибка при инициализации сессии для курса: {e}")
         if hasattr(e, 'response') and e.response is not None:
              logger.error(f"Ответ сервера: {e.response.text}")
-        return False 
\ No newline at end of file
+        return False 
+
+
+def _initialized_courses(session):
+    """Множество курсов, для которых в этой сессии уже загружена страница курса"""
+    if not hasattr(session, 'initialized_courses'):
+        session.initialized_courses = set()
+    return session.initialized_courses
+
+
+def save_session(session, session_file):
+    """
+    Сохраняет cookies и заголовки сессии в файл, доступный только владельцу (0600),
+    чтобы следующий запуск мог обойтись без входа.
+    """
+    cookies = [
+        {
+            'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+            'expires': cookie.expires, 'secure': cookie.secure, 'rest': cookie._rest
+        }
+        for cookie in session.cookies
+    ]
+    data = {
+        'version': SESSION_FILE_VERSION,
+        'saved_at': time.time(),
+        'account_email': getattr(session, 'account_email', None),
+        'headers': dict(session.headers),
+        'cookies': cookies,
+        'initialized_courses': sorted(_initialized_courses(session))
+    }
+    temp_path = f"{session_file}.tmp"
+    try:
+        directory = os.path.dirname(os.path.abspath(session_file))
+        os.makedirs(directory, exist_ok=True)
+        # Файл сразу создается с правами 0600: в нем cookies входа
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, session_file)
+        os.chmod(session_file, 0o600)
+        logger.debug(f"Сессия сохранена в {session_file}")
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить сессию в {session_file}: {e}")
+
+
+def _is_session_valid(session):
+    """Проверяет сессию одним легким запросом к API текущего пользователя"""
+    try:
+        response = session.get(f"{LMS_URL}/api/user/v1/me", timeout=10, allow_redirects=False)
+        return response.status_code == 200 and bool(response.json().get('username'))
+    except (requests.RequestException, ValueError) as e:
+        logger.debug(f"Не удалось проверить сохраненную сессию: {e}")
+        return False
+
+
+def restore_session(session_file, username=None):
+    """
+    Восстанавливает сессию из файла и проверяет ее одним запросом.
+    Возвращает сессию или None, если файла нет, он сохранен для другого пользователя
+    или сессия истекла (тогда нужен обычный вход).
+    """
+    if not session_file or not os.path.exists(session_file):
+        return None
+    try:
+        with open(session_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать файл сессии {session_file}: {e}")
+        return None
+    if data.get('version') != SESSION_FILE_VERSION:
+        return None
+    if username and data.get('account_email') and data['account_email'].lower() != username.lower():
+        logger.info("Сохраненная сессия принадлежит другому пользователю, выполняю вход.")
+        return None
+
+    session = create_session()
+    session.headers.clear()
+    session.headers.update(data.get('headers', {}))
+    for cookie in data.get('cookies', []):
+        cookie = requests.cookies.create_cookie(**cookie)
+        if not cookie.is_expired():
+            session.cookies.set_cookie(cookie)
+    if 'sessionid' not in session.cookies:
+        logger.info("Сохраненная сессия истекла, выполняю вход.")
+        return None
+    session.account_email = data.get('account_email')
+    session.initialized_courses = set(data.get('initialized_courses', []))
+
+    if not _is_session_valid(session):
+        logger.info("Сохраненная сессия больше не действительна, выполняю вход.")
+        return None
+    logger.info("✔ Сессия восстановлена из файла, вход не требуется.")
+    return session
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Офлайн замер производительности скачивания на тестовом сервере (fake_lms.py).
+
+Запускает тестовые LMS и Kinescope в отдельном процессе, направляет на них скрипт
+через переменные окружения SKILLFACTORY_* и скачивает тестовый курс целиком:
+вход, список курсов, структура курса, страницы, ресурсы и видео.
+В конце печатает страницы в минуту, МБ/с, пиковую память и число запросов по видам.
+
+По умолчанию вместо Chrome страницы загружает HttpDriver: он получает HTML страницы и #unit-iframe
+обычными HTTP запросами через сессию и не выполняет JavaScript. Так замер не зависит от браузера
+и показывает накладные расходы самого скрипта. С --browser chrome используется настоящий Chrome.
+
+Примеры:
+    python bench.py
+    python bench.py --chapters 5 --images 10 --latency-ms 50 --bandwidth-mbps 100
+    python bench.py --videos-every 3 --json bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from fake_lms import COURSE_NAME, PASSWORD, USERNAME, _add_course_arguments
+
+# resource есть только в Unix: на Windows пиковая память не измеряется
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('bench')
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class _SwitchTo:
+    def __init__(self, driver):
+        self._driver = driver
+
+    def frame(self, element):
+        self._driver._load(element.get_attribute('src'), frame=True)
+
+    def default_content(self):
+        self._driver._frame = None
+
+
+class HttpElement:
+    """Элемент страницы HttpDriver (минимальное подмножество WebElement)"""
+
+    def __init__(self, tag, base_url):
+        self._tag = tag
+        self._base_url = base_url
+
+    def get_attribute(self, name):
+        value = self._tag.get(name)
+        # Как и браузер, src и href возвращаются абсолютными
+        if value and name in ('src', 'href'):
+            return urljoin(self._base_url, value)
+        return value
+
+
+class HttpDriver:
+    """
+    Замена Selenium WebDriver для замеров: загружает страницы запросами через сессию скрипта.
+    Поддерживает ровно то, что использует downloader.py: get, page_source, поиск по CSS/ID,
+    переключение в iframe, cookies. Скрипты страницы не выполняются.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.switch_to = _SwitchTo(self)
+        self._page = None
+        self._frame = None
+        self._frames = {}
+
+    def _load(self, url, frame=False):
+        # Как и браузер, iframe загружается один раз вместе со страницей, а не при каждом переключении
+        if frame and url in self._frames:
+            self._frame = self._frames[url]
+            return
+        response = self.session.get(url, timeout=60)
+        document = (response.url, BeautifulSoup(response.text, 'html.parser'))
+        if frame:
+            self._frame = self._frames[url] = document
+        else:
+            self._page, self._frame, self._frames = document, None, {}
+
+    def _document(self):
+        return self._frame or self._page or ('about:blank', BeautifulSoup('', 'html.parser'))
+
+    def get(self, url):
+        self._load(url)
+
+    @property
+    def current_url(self):
+        return (self._page or ('about:blank', None))[0]
+
+    @property
+    def page_source(self):
+        return str(self._document()[1])
+
+    def find_elements(self, by, value):
+        from selenium.webdriver.common.by import By
+        selector = f"#{value}" if by == By.ID else value
+        url, soup = self._document()
+        return [HttpElement(tag, url) for tag in soup.select(selector)]
+
+    def find_element(self, by, value):
+        from selenium.common.exceptions import NoSuchElementException
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"Элемент не найден: {value}")
+        return elements[0]
+
+    def execute_script(self, script, *args):
+        return None
+
+    def execute_async_script(self, script, *args):
+        return None
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def get_cookies(self):
+        return [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain} for cookie in self.session.cookies]
+
+    def add_cookie(self, cookie):
+        pass
+
+    def quit(self):
+        pass
+
+
+def start_fake_lms(args):
+    """Запускает fake_lms.py отдельным процессом (его память не входит в замер) и возвращает (процесс, окружение)"""
+    command = [sys.executable, os.path.join(_BENCH_DIR, 'fake_lms.py')]
+    for name in ('chapters', 'sequentials', 'verticals', 'images', 'image_kb', 'documents', 'document_kb',
+                 'videos_every', 'video_segments', 'segment_kb', 'latency_ms', 'bandwidth_mbps'):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, encoding='utf-8')
+    environment = {}
+    for line in process.stdout:
+        if line.startswith('export '):
+            name, _, value = line[len('export '):].strip().partition('=')
+            environment[name] = value
+        elif line.startswith('Остановка'):
+            break
+    if len(environment) < 4:
+        process.kill()
+        raise RuntimeError("Тестовый сервер не запустился")
+    return process, environment
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_benchmark(args, environment, output_dir):
+    """Скачивает тестовый курс и возвращает словарь с результатами замера"""
+    # Модули скрипта читают адреса платформы из config при импорте, поэтому импортируются после настройки окружения
+    os.environ.update(environment)
+    if not args.real_pauses:
+        os.environ['SKILLFACTORY_PAGE_RENDER_PAUSE'] = '0'
+        os.environ['SKILLFACTORY_PAGE_SCRIPTS_PAUSE'] = '0'
+    from api import get_course_structure, get_enrolled_courses_data
+    from auth import login_to_skillfactory
+    from config import LMS_URL
+    from downloader import download_course_content, finalize_output
+    from metrics import summarize_stages
+    from navigation import find_root_block
+    from progress_tracker import ProgressTracker
+    from request_stats import format_request_report, get_request_report
+
+    if args.trace:
+        import tracing
+        tracing.start(args.trace)
+
+    started_at = time.perf_counter()
+    session = login_to_skillfactory(USERNAME, PASSWORD)
+    if not session:
+        raise RuntimeError("Не удалось войти на тестовом сервере")
+    courses = get_enrolled_courses_data(session)
+    course_structure = get_course_structure(session, f"{LMS_URL}/courses/{courses[0]['id']}/")
+    root_id, all_blocks = find_root_block(course_structure)
+    setup_s = time.perf_counter() - started_at
+
+    output_options = {
+        'minify': args.minify,
+        'optimize_images': False,
+        'webp': False,
+        'output_root': output_dir
+    }
+    driver = HttpDriver(session) if args.browser == 'http' else None
+    download_started_at = time.perf_counter()
+    download_course_content(
+        root_id, all_blocks, session, output_dir, not args.videos_every, True, COURSE_NAME,
+        output_options=output_options, driver=driver
+    )
+    if driver:
+        finalize_output(output_dir, output_options)
+    download_s = time.perf_counter() - download_started_at
+    if args.trace:
+        tracing.stop()
+
+    tracker = ProgressTracker(COURSE_NAME, output_dir)
+    try:
+        statistics = tracker.get_statistics()
+        stages = summarize_stages(tracker.get_block_metrics())
+    finally:
+        tracker.close()
+
+    # Учет запросов скрипта снимается до служебного запроса статистики сервера
+    client_report = get_request_report()
+    client_lines = format_request_report()
+    response = session.get(f"{LMS_URL}/__bench/stats", timeout=10)
+    server = response.json()
+    served_bytes = sum(server['bytes'].values())
+    return {
+        'pages': statistics['completed_count'],
+        'failed': statistics['failed_count'],
+        'setup_s': round(setup_s, 3),
+        'download_s': round(download_s, 3),
+        'pages_per_min': round(statistics['completed_count'] / download_s * 60, 1) if download_s else 0.0,
+        'served_mb': round(served_bytes / (1024 * 1024), 2),
+        'mb_per_s': round(served_bytes / (1024 * 1024) / download_s, 2) if download_s else 0.0,
+        'output_mb': round(_directory_size(output_dir) / (1024 * 1024), 2),
+        'peak_rss_mb': round(_peak_rss_mb(), 1) if resource else None,
+        'requests': dict(sorted(server['requests'].items())),
+        'requests_total': sum(server['requests'].values()),
+        'redundant_requests': client_report['redundant_requests'],
+        'waste': client_report['waste'],
+        'client_report': client_lines,
+        'stages': {name: {key: round(value, 4) for key, value in summary.items()} for name, summary in stages}
+    }
+
+
+def print_report(result):
+    print(f"\n{'='*60}")
+    print("РЕЗУЛЬТАТЫ ЗАМЕРА")
+    print(f"{'='*60}")
+    print(f"Страниц скачано:      {result['pages']} (ошибок: {result['failed']})")
+    print(f"Вход и структура:     {result['setup_s']:.2f} с")
+    print(f"Скачивание курса:     {result['download_s']:.2f} с")
+    print(f"Страниц в минуту:     {result['pages_per_min']:.1f}")
+    print(f"Отдано сервером:      {result['served_mb']:.2f} МБ ({result['mb_per_s']:.2f} МБ/с)")
+    print(f"Размер на диске:      {result['output_mb']:.2f} МБ")
+    peak_rss = f"{result['peak_rss_mb']:.1f} МБ" if result['peak_rss_mb'] is not None else "недоступно"
+    print(f"Пиковая память (RSS): {peak_rss}")
+    print(f"\nЗапросы к серверу: {result['requests_total']}")
+    for endpoint, count in result['requests'].items():
+        print(f"  {endpoint:<16} {count:>6}")
+    print()
+    for line in result['client_report']:
+        print(line)
+    if result['stages']:
+        print(f"\n{'Этап':<16} {'p50, с':>8} {'p90, с':>8} {'всего, с':>9} {'МБ':>8}")
+        for name, summary in result['stages'].items():
+            print(f"{name:<16} {summary['p50']:>8.3f} {summary['p90']:>8.3f} {summary['total_s']:>9.2f} {summary['bytes'] / (1024 * 1024):>8.2f}")
+    print(f"{'='*60}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн замер производительности скачивания на тестовом сервере.")
+    _add_course_arguments(parser)
+    parser.add_argument('--browser', choices=('http', 'chrome'), default='http', help="Чем загружать страницы: HttpDriver без JavaScript (по умолчанию) или Chrome.")
+    parser.add_argument('--real-pauses', action='store_true', help="Оставить паузы ожидания скриптов страницы (по умолчанию отключены).")
+    parser.add_argument('--minify', action='store_true', help="Включить минификацию, как main.py --minify.")
+    parser.add_argument('-o', '--output', help="Папка для скачивания (по умолчанию временная, удаляется после замера).")
+    parser.add_argument('--json', help="Сохранить результаты в JSON файл (для сравнения замеров).")
+    parser.add_argument('--trace', metavar='FILE', help="Записать трассу этапов и запросов в формате Chrome Trace.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Показывать журнал скрипта.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.videos_every and not shutil.which('ffmpeg'):
+        logger.warning("ffmpeg не найден: видео будут пропущены с ошибкой сборки.")
+
+    output_dir = args.output or tempfile.mkdtemp(prefix='skillfactory_bench_')
+    os.makedirs(output_dir, exist_ok=True)
+    process, environment = start_fake_lms(args)
+    try:
+        result = run_benchmark(args, environment, output_dir)
+    finally:
+        process.terminate()
+        process.wait()
+        if not args.output:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✔ Результаты сохранены в {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Микро-замеры этапов обработки HTML (html_processor.py) на синтетических страницах уроков.
+
+Генератор строит страницы, похожие на сохраненные из LMS: формулы MathJax со служебными блоками,
+много изображений и ссылок asset-v1, большие встроенные стили, вложенные iframe, видео Kinescope
+и длинную полосу вкладок подраздела. Сеть заменена ответами из памяти (адаптер requests
+и MockTransport httpx), поэтому замер показывает только разбор, обработку HTML и запись файлов.
+
+Для каждого этапа измеряется время (медиана и минимум по повторам) и память по tracemalloc
+(пик и оставшееся после этапа). Результаты сохраняются в JSON и сравниваются между собой:
+    python bench_html.py run --output before.json
+    python bench_html.py run --output after.json
+    python bench_html.py compare before.json after.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import unquote, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import asset_engine
+import html_processor
+from config import KINESCOPE_URL, LMS_URL
+from course_index import CourseIndex
+from html_processor import (
+    _clean_html, _embed_local_videos, download_css_and_update_html, download_js_and_update_html,
+    download_images_and_documents, process_and_save_html
+)
+from navigation import _rewire_navigation_links
+from utils import set_transfer_progress_enabled
+
+logger = logging.getLogger('bench_html')
+
+# Параметры синтетических страниц: обычный урок и очень тяжелая страница
+CORPUS_PROFILES = {
+    'typical': {
+        'paragraphs': 60, 'formulas': 40, 'images': 20, 'documents': 3, 'css_links': 4, 'scripts': 10,
+        'inline_style_kb': 16, 'iframes': 2, 'iframe_depth': 3, 'videos': 1, 'tabs': 12
+    },
+    'heavy': {
+        'paragraphs': 600, 'formulas': 400, 'images': 150, 'documents': 20, 'css_links': 12, 'scripts': 40,
+        'inline_style_kb': 256, 'iframes': 10, 'iframe_depth': 5, 'videos': 4, 'tabs': 120
+    },
+}
+
+# Этапы в порядке конвейера: каждый получает HTML, полученный предыдущим
+STAGES = ('embed_videos', 'clean', 'css', 'js', 'images', 'navigation', 'process_and_save_html')
+
+_COURSE_KEY = 'Bench+H101+2025'
+_PNG_BYTES = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 16
+
+
+def _asset_path(name):
+    return f"/asset-v1:{_COURSE_KEY}+type@asset+block@{name}"
+
+
+def _block_id(block_type, name):
+    return f"block-v1:{_COURSE_KEY}+type@{block_type}+block@{name}"
+
+
+class SyntheticLesson:
+    """Синтетическая страница урока, ответы сервера для ее ресурсов и окружение в структуре курса"""
+
+    def __init__(self, paragraphs, formulas, images, documents, css_links, scripts,
+                 inline_style_kb, iframes, iframe_depth, videos, tabs):
+        self.resources = {}
+        self.videos = []
+        self.html = self._build_html(paragraphs, formulas, images, documents, css_links, scripts,
+                                     inline_style_kb, iframes, iframe_depth, videos, tabs)
+
+        # Подраздел с tabs страницами: текущая страница - в середине полосы вкладок
+        sequential_id = _block_id('sequential', 'seq')
+        vertical_ids = [_block_id('vertical', f"v{index}") for index in range(tabs)]
+        blocks = {sequential_id: {'id': sequential_id, 'type': 'sequential', 'display_name': 'Тема', 'children': vertical_ids}}
+        for index, vertical_id in enumerate(vertical_ids):
+            blocks[vertical_id] = {'id': vertical_id, 'type': 'vertical', 'display_name': f"Урок {index + 1}", 'children': []}
+        self.all_blocks = CourseIndex(blocks)
+        self.parent_block = blocks[sequential_id]
+        self.block_data = blocks[vertical_ids[tabs // 2]]
+
+    def _add_resource(self, path, content_type, body):
+        self.resources[path] = (content_type, body.encode('utf-8') if isinstance(body, str) else body)
+
+    def _build_html(self, paragraphs, formulas, images, documents, css_links, scripts,
+                    inline_style_kb, iframes, iframe_depth, videos, tabs):
+        head = ['<title>Синтетический урок</title>', '<meta charset="utf-8">']
+        for index in range(css_links):
+            head.append(f'<link rel="stylesheet" href="/static/css/bundle{index}.css">')
+            self._add_resource(f"/static/css/bundle{index}.css", 'text/css', (
+                f"@import url('base{index}.css');\n"
+                f"@font-face {{ font-family: 'F{index}'; src: url('/static/fonts/f{index}.woff2') format('woff2'); }}\n"
+                + ''.join(f".c{index}-{rule} {{ margin: {rule}px; color: #{rule:06x}; }}\n" for rule in range(200))
+            ))
+            self._add_resource(f"/static/css/base{index}.css", 'text/css', f".base{index} {{ display: block; }}\n")
+            self._add_resource(f"/static/fonts/f{index}.woff2", 'font/woff2', b'wOF2' + bytes(4096))
+        inline_rules = ''.join(f".inline-{rule} {{ padding: {rule % 40}px; background: url('/static/images/bg{rule % 3}.png'); }}\n"
+                               for rule in range(inline_style_kb * 1024 // 64))
+        head.append(f"<style>{inline_rules}</style>")
+        head.append('<script type="text/x-mathjax-config">MathJax.Hub.Config({tex2jax: {inlineMath: [["$","$"]]}});</script>')
+        head.append('<script>window.MathJax = {showProcessingMessages: false};</script>')
+        head.append("<script>ym(12345678, 'init', {clickmap: true});</script>")
+        head.append('<script src="https://mc.yandex.ru/metrika/tag.js"></script>')
+        for index in range(scripts):
+            head.append(f'<script src="/static/js/module{index}.js"></script>')
+            self._add_resource(f"/static/js/module{index}.js", 'application/javascript',
+                               f"var api{index} = '{LMS_URL}/api/module{index}';\n" + "function f() { return 1; }\n" * 200)
+
+        body = [
+            '<div id="hde-container"><div class="hde-widget">Помощь</div></div>',
+            '<noscript><img src="https://mc.yandex.ru/watch/12345678"></noscript>',
+            '<div class="sf-sequence-tab-view__nav-buttons"><button disabled>Назад</button><button>Далее</button></div>',
+            '<div class="sequence-tab-view-navigation__tabs-container">',
+            *[f'<button class="sf-unit-tab sequence-tab-view-navigation__tab" data-url="{LMS_URL}/xblock/{_block_id("vertical", f"v{index}")}">'
+              f'<span class="sf-unit-tab__icon"></span></button>' for index in range(tabs)],
+            '</div>',
+            f'<div class="xblock xblock-student_view" data-url="{LMS_URL}/courses/course-v1:Skillfactory+H101/xblock">',
+        ]
+        for index in range(paragraphs):
+            body.append(f"<p>Абзац {index} текста урока с <b>выделением</b> и <a href=\"#p{index}\">якорем</a>.</p>")
+            if index < formulas:
+                body.append(
+                    '<span class="MathJax_Preview"></span>'
+                    f'<span class="MathJax_SVG" id="MathJax-Element-{index}-Frame" tabindex="0">'
+                    f'<svg><use xlink:href="#MJMATHI-{78 + index % 3}"></use></svg>'
+                    f'<span class="MJX_Assistive_MathML" role="presentation"><math><mi>x</mi><mn>{index}</mn></math></span></span>'
+                    '<span class="MathJax_SVG" role="presentation"></span>'
+                    f'<script type="math/tex" id="MathJax-Element-{index}">x^{{{index}}}</script>'
+                )
+        for index in range(images):
+            path = _asset_path(f"img{index}.png")
+            body.append(f'<figure><img src="{path}" alt="Рисунок {index}"><figcaption>Рисунок {index}</figcaption></figure>')
+            self._add_resource(path, 'image/png', _PNG_BYTES)
+        for index in range(documents):
+            path = _asset_path(f"doc{index}.pdf")
+            body.append(f'<p><a href="{path}">Материал {index}.pdf</a></p>')
+            self._add_resource(path, 'application/pdf', b'%PDF-1.4\n' + bytes(8192))
+        for index in range(iframes):
+            nested = f'<iframe src="{LMS_URL}/xblock/embedded{index}" title="Задание {index}"></iframe>'
+            for depth in range(iframe_depth):
+                nested = f'<div class="problem-wrapper level-{depth}">{nested}</div>'
+            body.append(nested)
+        for index in range(videos):
+            iframe_src = f"{KINESCOPE_URL}/embed/video{index}"
+            body.append(f'<div class="video-wrapper"><iframe src="{iframe_src}" allowfullscreen></iframe></div>')
+            self.videos.append({'iframe_src': iframe_src, 'video_id': f"video{index}", 'filename': f"Урок_video_{index + 1}.mp4"})
+        body.append('</div>')
+        return f"<!DOCTYPE html><html><head>{''.join(head)}</head><body>{''.join(body)}</body></html>"
+
+
+class StubAdapter(BaseAdapter):
+    """Адаптер requests, отвечающий из словаря путь -> (Content-Type, тело) без обращения к сети"""
+
+    def __init__(self, resources):
+        super().__init__()
+        self.resources = resources
+
+    def send(self, request, **kwargs):
+        content_type, body = self.resources.get(unquote(urlparse(request.url).path), ('text/plain', b''))
+        response = requests.Response()
+        response.status_code = 200 if body else 404
+        response.headers = CaseInsensitiveDict({'Content-Type': content_type, 'Content-Length': str(len(body))})
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def create_stub_session(resources):
+    """Сессия requests и асинхронный движок ресурсов, отвечающие из памяти"""
+    session = requests.Session()
+    adapter = StubAdapter(resources)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    asset_engine.close_asset_engine()
+    if asset_engine.httpx is not None:
+        httpx = asset_engine.httpx
+
+        def handler(request):
+            content_type, body = resources.get(unquote(request.url.path), ('text/plain', b''))
+            return httpx.Response(200 if body else 404, headers={'Content-Type': content_type}, content=body)
+
+        # Движок с подмененным транспортом занимает место общего движка процесса
+        asset_engine._engine = asset_engine.AsyncAssetEngine(transport=httpx.MockTransport(handler))
+    return session
+
+
+def _reset_caches():
+    """Сбрасывает кэши html_processor, чтобы каждый повтор обрабатывал страницу как первую в запуске"""
+    for cache in (html_processor._css_text_cache, html_processor._css_rewrite_cache, html_processor._css_saved_paths,
+                  html_processor._js_manifests, html_processor._shared_asset_paths, html_processor._inline_block_pages):
+        cache.clear()
+
+
+def _stage_calls(lesson, session, base_url):
+    """Функции этапов: принимают HTML и папку вывода, возвращают HTML для следующего этапа"""
+    def lesson_path(output_dir):
+        return os.path.join(output_dir, 'Модуль', 'Тема', 'Урок.html')
+
+    def assets(output_dir, kind):
+        return os.path.join(output_dir, '_assets', kind)
+
+    def navigation(html, output_dir):
+        soup = BeautifulSoup(html, 'html.parser')
+        return str(_rewire_navigation_links(soup, lesson.block_data['id'], lesson.parent_block, lesson.all_blocks))
+
+    def full_pipeline(html, output_dir):
+        process_and_save_html(
+            html, lesson.block_data, lesson.parent_block, lesson.all_blocks, lesson_path(output_dir), base_url, session,
+            downloaded_videos=lesson.videos, output_dir=output_dir, output_options={}
+        )
+        return html
+
+    return {
+        'embed_videos': lambda html, output_dir: _embed_local_videos(html, lesson.videos),
+        'clean': lambda html, output_dir: _clean_html(html),
+        'css': lambda html, output_dir: download_css_and_update_html(base_url, html, lesson_path(output_dir), assets(output_dir, 'css'), session),
+        'js': lambda html, output_dir: download_js_and_update_html(base_url, html, lesson_path(output_dir), assets(output_dir, 'js'), session),
+        'images': lambda html, output_dir: download_images_and_documents(base_url, html, lesson_path(output_dir), session),
+        'navigation': navigation,
+        'process_and_save_html': full_pipeline,
+    }
+
+
+def benchmark_profile(name, settings, repeat, warm, work_dir):
+    """Замер всех этапов на странице профиля: {этап: {median_s, min_s, samples, peak_kb, retained_kb}}"""
+    lesson = SyntheticLesson(**settings)
+    session = create_stub_session(lesson.resources)
+    base_url = f"{LMS_URL}/courses/course-v1:{_COURSE_KEY}/jump_to/{lesson.block_data['id']}"
+    calls = _stage_calls(lesson, session, base_url)
+
+    # Вход каждого этапа - результат предыдущего; полный конвейер начинается с исходной страницы
+    inputs = {}
+    html = lesson.html
+    warmup_dir = tempfile.mkdtemp(dir=work_dir)
+    for stage in STAGES:
+        inputs[stage] = lesson.html if stage == 'process_and_save_html' else html
+        result = calls[stage](inputs[stage], warmup_dir)
+        if stage != 'process_and_save_html':
+            html = result
+
+    results = {}
+    for stage in STAGES:
+        samples = []
+        output_dir = warmup_dir
+        for _ in range(repeat):
+            if not warm:
+                _reset_caches()
+                output_dir = tempfile.mkdtemp(dir=work_dir)
+            started_at = time.perf_counter()
+            calls[stage](inputs[stage], output_dir)
+            samples.append(time.perf_counter() - started_at)
+
+        # Память измеряется отдельным прогоном: tracemalloc заметно замедляет выполнение
+        if not warm:
+            _reset_caches()
+            output_dir = tempfile.mkdtemp(dir=work_dir)
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        calls[stage](inputs[stage], output_dir)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[stage] = {
+            'median_s': statistics.median(samples),
+            'min_s': min(samples),
+            'samples': [round(sample, 6) for sample in samples],
+            'peak_kb': round((peak - baseline) / 1024, 1),
+            'retained_kb': round((current - baseline) / 1024, 1),
+        }
+        logger.info(f"{name}/{stage}: {results[stage]['median_s'] * 1000:.1f} мс, пик {results[stage]['peak_kb']:.0f} КБ")
+    asset_engine.close_asset_engine()
+    return {'settings': settings, 'html_kb': round(len(lesson.html.encode('utf-8')) / 1024, 1), 'stages': results}
+
+
+def run(args):
+    profiles = list(CORPUS_PROFILES) if args.profile == 'all' else [args.profile]
+    set_transfer_progress_enabled(False)
+    work_dir = tempfile.mkdtemp(prefix='skillfactory_bench_html_')
+    try:
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'warm': args.warm,
+            'profiles': {name: benchmark_profile(name, CORPUS_PROFILES[name], args.repeat, args.warm, work_dir) for name in profiles}
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, profile in report['profiles'].items():
+        print(f"\nПрофиль '{name}' (страница {profile['html_kb']:.0f} КБ, повторов: {args.repeat}{', теплые кэши' if args.warm else ''})")
+        print(f"{'Этап':<24} {'медиана, мс':>12} {'мин, мс':>10} {'пик, КБ':>10} {'осталось, КБ':>13}")
+        for stage, result in profile['stages'].items():
+            print(f"{stage:<24} {result['median_s'] * 1000:>12.2f} {result['min_s'] * 1000:>10.2f} {result['peak_kb']:>10.0f} {result['retained_kb']:>13.0f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✔ Результаты сохранены в {args.output}")
+
+
+def compare(args):
+    """Сравнивает два файла результатов по медиане времени и пику памяти каждого этапа"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+
+    regressions = 0
+    for name, profile in current['profiles'].items():
+        base_profile = baseline['profiles'].get(name)
+        if not base_profile:
+            print(f"\nПрофиль '{name}' отсутствует в {args.baseline}, пропускаю.")
+            continue
+        print(f"\nПрофиль '{name}'")
+        print(f"{'Этап':<24} {'было, мс':>10} {'стало, мс':>10} {'время':>9} {'пик памяти':>11}")
+        for stage, result in profile['stages'].items():
+            base = base_profile['stages'].get(stage)
+            if not base:
+                continue
+            time_change = (result['median_s'] / base['median_s'] - 1) * 100 if base['median_s'] else 0.0
+            memory_change = (result['peak_kb'] / base['peak_kb'] - 1) * 100 if base['peak_kb'] else 0.0
+            mark = ''
+            if time_change > args.threshold:
+                mark = '  ← медленнее'
+                regressions += 1
+            elif time_change < -args.threshold:
+                mark = '  ✔ быстрее'
+            print(f"{stage:<24} {base['median_s'] * 1000:>10.2f} {result['median_s'] * 1000:>10.2f} "
+                  f"{time_change:>+8.1f}% {memory_change:>+10.1f}%{mark}")
+
+    if regressions:
+        print(f"\nЭтапов медленнее более чем на {args.threshold:g}%: {regressions}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микро-замеры этапов обработки HTML на синтетических страницах.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Выполнить замер.")
+    run_parser.add_argument('--profile', choices=[*CORPUS_PROFILES, 'all'], default='all', help="Профиль синтетической страницы (по умолчанию все).")
+    run_parser.add_argument('--repeat', type=int, default=5, help="Повторов каждого этапа (по умолчанию 5).")
+    run_parser.add_argument('--warm', action='store_true', help="Не сбрасывать кэши и папку вывода между повторами (как для второй и следующих страниц курса).")
+    run_parser.add_argument('--output', help="Сохранить результаты в JSON файл.")
+    run_parser.add_argument('-v', '--verbose', action='store_true', help="Показывать журнал обработки.")
+
+    compare_parser = subparsers.add_parser('compare', help="Сравнить два файла результатов.")
+    compare_parser.add_argument('baseline', help="Исходные результаты (JSON).")
+    compare_parser.add_argument('current', help="Новые результаты (JSON).")
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help="Порог изменения медианы в процентах (по умолчанию 10).")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if getattr(args, 'verbose', False) else logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,75 @@
+import os
+
+# Адреса платформы и видеохостинга. Переменные окружения позволяют направить скрипт
+# на локальный тестовый сервер (см. bench.py)
+LMS_URL = os.environ.get('SKILLFACTORY_LMS_URL', 'https://lms.skillfactory.ru')
+APPS_URL = os.environ.get('SKILLFACTORY_APPS_URL', 'https://apps.skillfactory.ru')
+LMS_CDN_URL = os.environ.get('SKILLFACTORY_LMS_CDN_URL', 'https://lms-cdn.skillfactory.ru')
+KINESCOPE_URL = os.environ.get('SKILLFACTORY_KINESCOPE_URL', 'https://kinescope.io')
+
+# Паузы (в секундах) после загрузки страницы в браузере: для AJAX-загрузки интерактивных элементов
+# и для отработки скриптов страницы
+PAGE_RENDER_PAUSE = float(os.environ.get('SKILLFACTORY_PAGE_RENDER_PAUSE', 5))
+PAGE_SCRIPTS_PAUSE = float(os.environ.get('SKILLFACTORY_PAGE_SCRIPTS_PAUSE', 2))
+
 # Список ключевых слов в названиях блоков, которые нужно игнорировать при скачивании и в навигации.
 # Регистр не учитывается.
 IGNORE_KEYWORDS_IN_TITLES = [
     'силлабус', 'добро пожаловать', 'обратная связь', 'полезные материалы',
     'карта курса', 'вводный модуль', 'описание курса', 'финальный проект',
     'организационная информация'
-]
\ No newline at end of file
+]
+
+# Количество потоков для параллельного скачивания ресурсов страницы (CSS, шрифты)
+ASSET_DOWNLOAD_WORKERS = 8
+
+# Одновременных запросов асинхронного движка ресурсов на весь процесс (asset_engine.py, нужен httpx)
+ASSET_ASYNC_CONCURRENCY = 256
+
+# Встроенные <style>/<script> не короче этого размера (в символах), повторяющиеся на разных страницах, выносятся в общие файлы _assets/shared
+SHARED_INLINE_MIN_BYTES = 512
+
+# Изображения больше этого размера (в пикселях по большей стороне) уменьшаются при --optimize-images
+IMAGE_MAX_DIMENSION = 1920
+
+# Границы размера блока чтения при скачивании файлов (подбирается по Content-Length)
+DOWNLOAD_CHUNK_MIN_BYTES = 64 * 1024
+DOWNLOAD_CHUNK_MAX_BYTES = 1024 * 1024
+
+# Сколько раз продолжать прерванную загрузку документа запросом Range за один запуск
+DOWNLOAD_RESUME_ATTEMPTS = 3
+
+# Сколько курсов пакетный режим (--all-courses) скачивает одновременно (по браузеру на курс)
+BATCH_PARALLEL_COURSES = 2
+
+# Настройки HTTP транспорта (transport.py)
+HTTP_POOL_HOSTS = 32                              # Для скольких хостов хранить пулы соединений
+HTTP_POOL_MAXSIZE = ASSET_DOWNLOAD_WORKERS * 2    # Соединений на хост (с запасом на параллельные курсы и видео)
+HTTP_RETRIES = 3                                  # Повторы при 429/5xx и сетевых ошибках
+HTTP_BACKOFF_FACTOR = 0.5                         # Базовая пауза между повторами, секунды
+
+# Файл с сохраненной сессией (cookies и заголовки), чтобы повторные запуски обходились без входа
+SESSION_FILE = os.path.join(os.path.expanduser('~'), '.skillfactory_session.json')
+SESSION_FILE_VERSION = 1
+
+# Хранитель сессии (session_keeper.py): за сколько секунд до истечения JWT/sessionid обновлять их
+# и как часто проверять сессию, если срок неизвестен
+SESSION_REFRESH_MARGIN = 5 * 60
+SESSION_CHECK_INTERVAL = 30 * 60
+# Минимальная пауза между обновлениями (после ошибки или если сервер не продлил срок JWT)
+SESSION_MIN_CHECK_DELAY = 60
+
+# База прогресса (<курс>_progress.db): сколько секунд писатель ждет, пока другой поток или процесс
+# освободит блокировку записи
+PROGRESS_BUSY_TIMEOUT = 30
+# Сколько папок курса одновременно проверяется при запуске (сверка отпечатков файлов из прогресса)
+PROGRESS_VALIDATION_WORKERS = 16
+# Реестр файлов прогресса в папке скачивания и папки ресурсов, в которые не заходит поиск файлов прогресса
+PROGRESS_REGISTRY_NAME = '_progress_registry.json'
+PROGRESS_SCAN_SKIP_DIRS = {'_assets', 'images', 'documents', 'notebooks'}
+
+# Длина интервала (в секундах) для статистики скорости скачивания в progress_manager.py --stats
+METRICS_THROUGHPUT_INTERVAL = 10 * 60
+
+# Сколько источников лишних HTTP запросов (повторные загрузки одного URL) показывать в отчете в конце запуска
+REQUEST_REPORT_TOP = 10
\ No newline at end of file
@@ -0,0 +1,156 @@
+# course_index.py
+
+import logging
+import os
+from collections.abc import Mapping
+
+from pathvalidate import sanitize_filename
+
+from config import IGNORE_KEYWORDS_IN_TITLES
+
+logger = logging.getLogger(__name__)
+
+# Блоки, которые превращаются в папки при скачивании
+CONTAINER_TYPES = ('course', 'chapter', 'sequential')
+
+
+class _BlockNode:
+    """Служебные данные блока, вычисленные один раз при построении индекса"""
+    __slots__ = ('block_type', 'parent_id', 'position', 'children', 'sanitized_name', 'filename', 'relative_path', 'ignored')
+
+    def __init__(self, block_type, parent_id, position, children, sanitized_name, ignored):
+        self.block_type = block_type
+        self.parent_id = parent_id
+        self.position = position
+        self.children = children
+        self.sanitized_name = sanitized_name
+        self.filename = f"{sanitized_name}.html"
+        self.relative_path = None
+        self.ignored = ignored
+
+
+def _outline(blocks):
+    """Дерево курса из обычного словаря блоков (ответ API или старый кэш)"""
+    for block_id, block_data in blocks.items():
+        display_name = block_data.get('display_name', 'Без названия')
+        # Блоки из компактного кэша уже содержат очищенное имя
+        sanitized_name = block_data.get('sanitized_name')
+        if sanitized_name is None:
+            sanitized_name = sanitize_filename(display_name)
+        yield block_id, block_data.get('type'), display_name, sanitized_name, block_data.get('children', [])
+
+
+class CourseIndex(Mapping):
+    """
+    Индекс блоков курса. Ведет себя как исходный словарь all_blocks (ID -> данные блока),
+    а дополнительно дает O(1) доступ к родителю, позиции среди соседей,
+    очищенным именам файлов и путям относительно папки курса.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._nodes = {}
+        self.root_id = None
+
+        # Кэш структуры отдает дерево курса из метаданных, не декодируя сами блоки
+        outline = blocks.outline() if hasattr(blocks, 'outline') else _outline(blocks)
+        parents = {}
+        for block_id, block_type, display_name, sanitized_name, children in outline:
+            if self.root_id is None and block_type == 'course':
+                self.root_id = block_id
+            for position, child_id in enumerate(children):
+                parents[child_id] = (block_id, position)
+            self._nodes[block_id] = _BlockNode(
+                block_type, None, 0, tuple(children), sanitized_name,
+                any(keyword in display_name.lower() for keyword in IGNORE_KEYWORDS_IN_TITLES)
+            )
+
+        for child_id, (parent_id, position) in parents.items():
+            node = self._nodes.get(child_id)
+            if node is not None:
+                node.parent_id = parent_id
+                node.position = position
+
+        if self.root_id is not None:
+            self._compute_paths()
+
+    @classmethod
+    def from_structure(cls, course_structure):
+        return cls(course_structure['course_blocks']['blocks'])
+
+    def _compute_paths(self):
+        """Пути относительно папки курса так же, как их строит download_material"""
+        stack = [(self.root_id, '')]
+        while stack:
+            block_id, parent_dir = stack.pop()
+            node = self._nodes.get(block_id)
+            if node is None or node.relative_path is not None:
+                continue
+            if node.block_type == 'vertical':
+                node.relative_path = os.path.join(parent_dir, node.filename)
+            elif node.block_type in CONTAINER_TYPES:
+                # Корневой блок курса не создает отдельной папки
+                node.relative_path = parent_dir if block_id == self.root_id else os.path.join(parent_dir, node.sanitized_name)
+                stack.extend((child_id, node.relative_path) for child_id in node.children)
+
+    # --- Интерфейс словаря all_blocks ---
+
+    def __getitem__(self, block_id):
+        return self._blocks[block_id]
+
+    def __iter__(self):
+        return iter(self._blocks)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, block_id):
+        return block_id in self._blocks
+
+    # --- Навигация ---
+
+    def parent_id(self, block_id):
+        node = self._nodes.get(block_id)
+        return node.parent_id if node else None
+
+    def children(self, block_id):
+        node = self._nodes.get(block_id)
+        return node.children if node else ()
+
+    def position(self, block_id):
+        """Позиция блока среди детей родителя"""
+        node = self._nodes.get(block_id)
+        return node.position if node else None
+
+    def sibling(self, block_id, offset):
+        """Соседний блок со смещением offset (-1 - предыдущий, 1 - следующий) или None"""
+        node = self._nodes.get(block_id)
+        if not node or node.parent_id is None:
+            return None
+        siblings = self._nodes[node.parent_id].children
+        position = node.position + offset
+        return siblings[position] if 0 <= position < len(siblings) else None
+
+    # --- Имена и пути ---
+
+    def sanitized_name(self, block_id):
+        return self._nodes[block_id].sanitized_name
+
+    def filename(self, block_id):
+        """Имя HTML файла страницы"""
+        return self._nodes[block_id].filename
+
+    def relative_path(self, block_id):
+        """Путь файла страницы или папки раздела относительно папки курса (None вне дерева курса)"""
+        node = self._nodes.get(block_id)
+        return node.relative_path if node else None
+
+    def is_ignored(self, block_id):
+        """Попадает ли название блока под IGNORE_KEYWORDS_IN_TITLES"""
+        node = self._nodes.get(block_id)
+        return node.ignored if node else False
+
+
+def as_course_index(all_blocks):
+    """Возвращает all_blocks как CourseIndex, не перестраивая уже готовый индекс"""
+    return all_blocks if isinstance(all_blocks, CourseIndex) else CourseIndex(all_blocks)
@@ -0,0 +1,171 @@
+# course_sync.py
+
+import hashlib
+import json
+import logging
+import os
+
+from course_index import CourseIndex, CONTAINER_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Поля блока, которые меняются без изменения содержимого (прогресс студента и т.п.)
+_VOLATILE_BLOCK_FIELDS = {'children', 'display_name', 'sanitized_name', 'completion', 'complete', 'resume_block'}
+
+
+def _get_index(course_structure):
+    try:
+        return CourseIndex(course_structure['course_blocks']['blocks'] or {})
+    except (KeyError, TypeError):
+        return CourseIndex({})
+
+
+def _block_fingerprint(block_data):
+    """
+    Отпечаток содержимого блока: edited_on, если он есть,
+    иначе хеш всех полей, кроме названия, детей и прогресса.
+    Для блоков из компактного кэша используется сохраненный отпечаток.
+    """
+    if 'fingerprint' in block_data:
+        return block_data['fingerprint']
+    if block_data.get('edited_on'):
+        return str(block_data['edited_on'])
+    content = {key: value for key, value in block_data.items() if key not in _VOLATILE_BLOCK_FIELDS}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def diff_course_structures(old_structure, new_structure):
+    """
+    Сравнивает две структуры курса поблочно.
+    Возвращает словарь с множествами ID блоков: added, removed, moved (сменился родитель),
+    renamed, edited (изменилось содержимое) и reordered (изменился список детей).
+    """
+    old_blocks = _get_index(old_structure)
+    new_blocks = _get_index(new_structure)
+
+    diff = {
+        'added': set(new_blocks) - set(old_blocks),
+        'removed': set(old_blocks) - set(new_blocks),
+        'moved': set(),
+        'renamed': set(),
+        'edited': set(),
+        'reordered': set()
+    }
+    for block_id in set(old_blocks) & set(new_blocks):
+        old_block = old_blocks[block_id]
+        new_block = new_blocks[block_id]
+        if old_blocks.parent_id(block_id) != new_blocks.parent_id(block_id):
+            diff['moved'].add(block_id)
+        if old_block.get('display_name') != new_block.get('display_name'):
+            diff['renamed'].add(block_id)
+        if old_block.get('children', []) != new_block.get('children', []):
+            diff['reordered'].add(block_id)
+        if _block_fingerprint(old_block) != _block_fingerprint(new_block):
+            diff['edited'].add(block_id)
+    return diff
+
+
+def _find_vertical(block_id, course_index):
+    """Находит страницу (vertical), в которую входит блок, или None"""
+    while block_id:
+        block_data = course_index.get(block_id)
+        if not block_data:
+            return None
+        if block_data.get('type') == 'vertical':
+            return block_id
+        if block_data.get('type') in CONTAINER_TYPES:
+            return None
+        block_id = course_index.parent_id(block_id)
+    return None
+
+
+def _collect_verticals(block_id, course_index):
+    """Возвращает все страницы (vertical) внутри блока"""
+    verticals = []
+    stack = [block_id]
+    while stack:
+        current_id = stack.pop()
+        block_data = course_index.get(current_id)
+        if not block_data:
+            continue
+        if block_data.get('type') == 'vertical':
+            verticals.append(current_id)
+        elif block_data.get('type') in CONTAINER_TYPES:
+            stack.extend(course_index.children(current_id))
+    return verticals
+
+
+def plan_course_sync(old_structure, new_structure):
+    """
+    Определяет, какие страницы нужно перерисовать после обновления структуры курса.
+    Возвращает словарь:
+      diff - результат diff_course_structures,
+      refresh_ids - ID страниц (vertical), которые нужно скачать заново,
+      stale_paths - устаревшие HTML файлы (относительно папки курса), которые нужно удалить.
+    """
+    diff = diff_course_structures(old_structure, new_structure)
+    old_blocks = _get_index(old_structure)
+    new_blocks = _get_index(new_structure)
+
+    refresh_ids = set()
+    changed_ids = diff['added'] | diff['moved'] | diff['renamed'] | diff['edited'] | diff['reordered']
+    for block_id in changed_ids:
+        block_data = new_blocks[block_id]
+        block_type = block_data.get('type')
+        if block_type in CONTAINER_TYPES:
+            # Переименованный или перемещенный раздел меняет пути всех страниц внутри
+            if block_id in diff['moved'] or block_id in diff['renamed']:
+                refresh_ids.update(_collect_verticals(block_id, new_blocks))
+            # Изменился состав или порядок страниц - обновляем навигацию у всех соседей
+            elif block_id in diff['reordered'] and block_type == 'sequential':
+                refresh_ids.update(_collect_verticals(block_id, new_blocks))
+            continue
+        vertical_id = _find_vertical(block_id, new_blocks)
+        if vertical_id:
+            refresh_ids.add(vertical_id)
+        # Новое название страницы меняет ссылки навигации на соседних страницах
+        if block_type == 'vertical' and block_id in diff['renamed']:
+            parent_id = new_blocks.parent_id(block_id)
+            if parent_id and new_blocks.get(parent_id, {}).get('type') == 'sequential':
+                refresh_ids.update(_collect_verticals(parent_id, new_blocks))
+
+    stale_paths = set()
+    for block_id in diff['removed']:
+        if old_blocks[block_id].get('type') == 'vertical':
+            stale_paths.add(old_blocks.relative_path(block_id))
+    for block_id in refresh_ids:
+        if block_id in old_blocks:
+            old_path = old_blocks.relative_path(block_id)
+            if old_path != new_blocks.relative_path(block_id):
+                stale_paths.add(old_path)
+    # Не удаляем файлы, которые по-прежнему принадлежат какой-то странице
+    current_paths = {
+        new_blocks.relative_path(block_id)
+        for block_id, block_data in new_blocks.items() if block_data.get('type') == 'vertical'
+    }
+    stale_paths = sorted(path for path in stale_paths if path and path not in current_paths)
+
+    return {'diff': diff, 'refresh_ids': refresh_ids, 'stale_paths': stale_paths}
+
+
+def log_sync_plan(sync_plan):
+    """Выводит в лог краткую сводку изменений курса"""
+    diff = sync_plan['diff']
+    logger.info(
+        f"Изменения в курсе: новых блоков {len(diff['added'])}, удаленных {len(diff['removed'])}, "
+        f"перемещенных {len(diff['moved'])}, переименованных {len(diff['renamed'])}, "
+        f"измененных {len(diff['edited'])}"
+    )
+    logger.info(f"Страниц к обновлению: {len(sync_plan['refresh_ids'])}, устаревших файлов: {len(sync_plan['stale_paths'])}")
+
+
+def remove_stale_files(output_dir, stale_paths):
+    """Удаляет HTML файлы страниц, которых больше нет в курсе или которые переехали"""
+    for relative_path in stale_paths:
+        file_path = os.path.join(output_dir, relative_path)
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.info(f"Удален устаревший файл: {relative_path}")
+            except OSError as e:
+                logger.warning(f"Не удалось удалить устаревший файл {relative_path}: {e}")
@@ -2,11 +2,13 @@
 
 import logging
 import os
-import re
 import shutil
 import subprocess
 import time
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import xmltodict
 import requests
 from bs4 import BeautifulSoup
@@ -22,9 +24,17 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import TimeoutException
 from urllib.parse import urljoin, urlparse
 
-from html_processor import process_and_save_html
-from config import IGNORE_KEYWORDS_IN_TITLES
+from html_processor import process_and_save_html, close_image_optimizers, get_assets_dir, KINESCOPE_HOST, KINESCOPE_VIDEO_ID_RE
+from course_index import as_course_index
+from utils import close_transfer_progress, set_download_budget
+from config import ASSET_DOWNLOAD_WORKERS, LMS_URL, KINESCOPE_URL, PAGE_RENDER_PAUSE, PAGE_SCRIPTS_PAUSE
+from transport import fetch_range, close_media_client
+from asset_engine import close_asset_engine
+from session_keeper import sync_driver_cookies
 from progress_tracker import ProgressTracker
+from minifier import minify_assets
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
@@ -42,17 +52,18 @@ class KinescopeDownloader:
     def download_video_by_id(self, video_id, video_name):
         self.video_id = video_id
         self.video_name = sanitize_filename(video_name)
-        self.base_url = "https://kinescope.io"
+        self.base_url = KINESCOPE_URL
         self.output_path = os.path.join(self.output_dir, f"{self.video_name}.mp4")
         return self._download()
 
     def _get_media_chunk(self, url, byte_range):
-        """Скачивает один чанк данных по URL и диапазону байт."""
-        headers = {'Range': f"bytes={byte_range}"}
+        """Скачивает один чанк данных по URL и диапазону байт (по HTTP/2, если доступен)."""
         try:
-            response = self.session.get(url, headers=headers, stream=True, timeout=60)
-            response.raise_for_status()
-            return response.content
+            with tracing.span('segment', 'video', range=byte_range) as span:
+                data = fetch_range(self.session, url, byte_range, referer=self.referer)
+                span.set(bytes=len(data))
+            metrics.add_bytes(len(data))
+            return data
         except requests.RequestException as e:
             logger.error(f"Ошибка при скачивании чанка {url} (диапазон: {byte_range}): {e}")
             return b''
@@ -135,7 +146,8 @@ class KinescopeDownloader:
         
         best_video_repr = max(representations, key=lambda r: int(r.get('@width', 0)))
         logger.info(f"Выбрано лучшее качество видео: {best_video_repr.get('@width')}x{best_video_repr.get('@height')}")
-        video_data = self._download_stream(best_video_repr, 'video')
+        with metrics.stage('video_download'):
+            video_data = self._download_stream(best_video_repr, 'video')
         if not video_data: 
             logger.error("Не удалось загрузить видеопоток.")
             return False
@@ -150,7 +162,8 @@ class KinescopeDownloader:
         if isinstance(audio_representation, list):
             audio_representation = audio_representation[0]
             
-        audio_data = self._download_stream(audio_representation, 'audio')
+        with metrics.stage('video_download'):
+            audio_data = self._download_stream(audio_representation, 'audio')
         if not audio_data: 
             logger.error("Не удалось загрузить аудиопоток.")
             return False
@@ -160,31 +173,33 @@ class KinescopeDownloader:
         temp_audio_path = os.path.join(self.output_dir, f"{self.video_id}.audio")
 
         try:
-            logger.info("Сохраняю временные аудио/видео файлы...")
-            with open(temp_video_path, 'wb') as f: 
-                f.write(video_data)
-            with open(temp_audio_path, 'wb') as f: 
-                f.write(audio_data)
-
-            logger.info(f"Собираю финальный файл '{self.video_name}.mp4' с помощью ffmpeg...")
-            # Команда для сборки без перекодирования
-            convert_cmd = [
-                "ffmpeg", "-y",
-                "-i", temp_video_path,
-                "-i", temp_audio_path,
-                "-c", "copy",
-                "-bsf:a", "aac_adtstoasc",
-                self.output_path
-            ]
+            with metrics.stage('video_mux'):
+                logger.info("Сохраняю временные аудио/видео файлы...")
+                with open(temp_video_path, 'wb') as f: 
+                    f.write(video_data)
+                with open(temp_audio_path, 'wb') as f: 
+                    f.write(audio_data)
+
+                logger.info(f"Собираю финальный файл '{self.video_name}.mp4' с помощью ffmpeg...")
+                # Команда для сборки без перекодирования
+                convert_cmd = [
+                    "ffmpeg", "-y",
+                    "-i", temp_video_path,
+                    "-i", temp_audio_path,
+                    "-c", "copy",
+                    "-bsf:a", "aac_adtstoasc",
+                    self.output_path
+                ]
             
-            # Запускаем ffmpeg, скрывая его стандартный вывод и указывая кодировку
-            result = subprocess.run(
-                convert_cmd,
-                check=True,
-                capture_output=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
+                # Запускаем ffmpeg, скрывая его стандартный вывод и указывая кодировку
+                with tracing.span('ffmpeg', 'video', file=os.path.basename(self.output_path)):
+                    result = subprocess.run(
+                        convert_cmd,
+                        check=True,
+                        capture_output=True,
+                        encoding='utf-8',
+                        errors='ignore'
+                    )
             if self.debug:
                 logger.debug(f"ffmpeg stdout: {result.stdout}")
                 logger.debug(f"ffmpeg stderr: {result.stderr}")
@@ -207,23 +222,30 @@ class KinescopeDownloader:
             if os.path.exists(temp_audio_path): 
                 os.remove(temp_audio_path)
 
-def process_content_block(driver, session, block_data, all_blocks, parent_block, html_filepath, output_dir, no_videos, progress_tracker=None):
+def process_content_block(driver, session, block_data, all_blocks, parent_block, html_filepath, output_dir, no_videos, progress_tracker=None, output_options=None):
     content_url = block_data.get('lms_web_url')
     display_name = block_data.get('display_name', 'Без названия')
     if not content_url:
         logger.warning(f"У блока '{display_name}' отсутствует lms_web_url. Пропускаю.")
         return
     logger.info(f"Обрабатываю страницу: '{display_name}' ({content_url})")
+    started_at = time.monotonic()
+    metrics.start_block(display_name)
+    metrics.switch_stage('navigate')
     try:
+        # Если сессия обновлялась во время скачивания, браузер получает новые cookies
+        sync_driver_cookies(session, driver)
         driver.get(content_url)
         
         # Ждем загрузки контента
-        kinescope_selector_str = "iframe[src*='kinescope.io']"
+        kinescope_selector_str = f"iframe[src*='{KINESCOPE_HOST}']"
         unit_iframe_selector_str = "iframe#unit-iframe"
         xblock_selector_str = "div.xblock"
         combined_wait_selector = f"{kinescope_selector_str}, {unit_iframe_selector_str}, {xblock_selector_str}"
         
-        WebDriverWait(driver, 40).until(EC.presence_of_element_located((By.CSS_SELECTOR, combined_wait_selector)))
+        metrics.switch_stage('wait_ready')
+        with tracing.span('wait_content', 'wait'):
+            WebDriverWait(driver, 40).until(EC.presence_of_element_located((By.CSS_SELECTOR, combined_wait_selector)))
         logger.info("✔ Контент урока обнаружен.")
         
         # Дополнительное ожидание загрузки интерактивных элементов
@@ -238,8 +260,9 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
             logger.debug("Основные загрузчики не найдены или не исчезли в течение 30 секунд.")
         
         # Дополнительная пауза для AJAX-загрузки интерактивных элементов
-        logger.debug("Дополнительная пауза 5 секунд для загрузки интерактивного контента...")
-        time.sleep(5)
+        logger.debug(f"Дополнительная пауза {PAGE_RENDER_PAUSE:g} секунд для загрузки интерактивного контента...")
+        with tracing.span('render_pause', 'wait', seconds=PAGE_RENDER_PAUSE):
+            time.sleep(PAGE_RENDER_PAUSE)
         
         # Проверяем, есть ли еще активные спиннеры и ждем их завершения
         try:
@@ -264,8 +287,9 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
             logger.debug(f"Не удалось дождаться исчезновения всех спиннеров: {e}")
         
         # Пауза для загрузки скриптов и удаление спиннеров
-        logger.debug("Пауза 2 секунды, чтобы дать скриптам страницы отработать...")
-        time.sleep(2)
+        logger.debug(f"Пауза {PAGE_SCRIPTS_PAUSE:g} секунды, чтобы дать скриптам страницы отработать...")
+        with tracing.span('scripts_pause', 'wait', seconds=PAGE_SCRIPTS_PAUSE):
+            time.sleep(PAGE_SCRIPTS_PAUSE)
         try:
             logger.debug("Принудительное удаление индикаторов загрузки через JS...")
             js_command = """
@@ -352,7 +376,8 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
             
             waitForMathJax();
             """
-            driver.execute_async_script(mathjax_wait_script)
+            with tracing.span('wait_mathjax', 'wait'):
+                driver.execute_async_script(mathjax_wait_script)
             
             # Удаляем временные preview элементы MathJax и очищаем пустые контейнеры
             logger.debug("Удаление временных preview элементов MathJax и очистка пустых контейнеров...")
@@ -427,6 +452,7 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
                 pass
 
         # Синхронизация cookies
+        metrics.switch_stage('capture')
         for cookie in driver.get_cookies():
             session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
         final_page_url = driver.current_url
@@ -462,13 +488,14 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
             finally:
                 driver.switch_to.default_content()
             
-            # Скачиваем каждое найденное видео
+            # Скачиваем каждое найденное видео (время скачивания и сборки учитывается отдельными этапами)
+            metrics.switch_stage(None)
             if kinescope_iframes:
                 logger.info(f"✔ Обнаружено {len(kinescope_iframes)} Kinescope видео. Начинаю скачивание...")
                 
                 for i, iframe_src in enumerate(kinescope_iframes):
                     try:
-                        video_id_match = re.search(r'kinescope\.io/(?:embed/)?([a-zA-Z0-9]+)', iframe_src)
+                        video_id_match = KINESCOPE_VIDEO_ID_RE.search(iframe_src)
                         if not video_id_match: 
                             logger.warning(f"Не удалось извлечь ID видео из iframe src: {iframe_src}")
                             continue
@@ -518,6 +545,7 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
                 logger.debug(f"Видео для '{display_name}' не найдено.")
 
         # Переключаемся обратно в основной контент
+        metrics.switch_stage('capture')
         driver.switch_to.default_content()
         page_soup = BeautifulSoup(driver.page_source, 'html.parser')
         
@@ -536,6 +564,7 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
             logger.warning(f"Не удалось встроить контент из #unit-iframe: {e}")
 
         html_content = str(page_soup)
+        metrics.switch_stage(None)
         
         process_and_save_html(
             html_content=html_content, 
@@ -546,9 +575,11 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
             base_url=final_page_url, 
             session=session, 
             downloaded_videos=downloaded_videos,  # Передаем список всех скачанных видео
-            output_dir=output_dir
+            output_dir=output_dir,
+            output_options=output_options
         )
         logger.info(f"✔ Страница '{display_name}' полностью обработана и сохранена.")
+        stages = metrics.finish_block()
         
         # Отслеживание прогресса
         if progress_tracker:
@@ -569,7 +600,9 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
                     block_data=block_data,
                     file_path=html_filepath,
                     file_size_mb=file_size_mb,
-                    has_video=bool(downloaded_videos)
+                    has_video=bool(downloaded_videos),
+                    duration_s=round(time.monotonic() - started_at, 2),
+                    stages=stages
                 )
             except Exception as e:
                 logger.warning(f"Не удалось обновить прогресс для '{display_name}': {e}")
@@ -578,35 +611,41 @@ def process_content_block(driver, session, block_data, all_blocks, parent_block,
         logger.error(f"Критическая ошибка при обработке страницы '{display_name}': {e}", exc_info=True)
         
         # Отмечаем как неудачный в трекере прогресса
+        stages = metrics.finish_block()
         if progress_tracker:
             try:
                 progress_tracker.mark_failed(
                     block_id=block_data.get('id'),
                     block_data=block_data,
-                    error_message=str(e)
+                    error_message=str(e),
+                    duration_s=round(time.monotonic() - started_at, 2),
+                    stages=stages
                 )
             except Exception as tracker_error:
                 logger.warning(f"Не удалось обновить прогресс (ошибка) для '{display_name}': {tracker_error}")
 
-def download_material(driver, session, block_id, all_blocks, current_path, output_dir, no_videos, force_overwrite, parent_block=None, progress_tracker=None):
+def download_material(driver, session, block_id, all_blocks, current_path, output_dir, no_videos, force_overwrite, parent_block=None, progress_tracker=None, output_options=None, refresh_ids=None):
+    all_blocks = as_course_index(all_blocks)
     block_data = all_blocks.get(block_id)
     if not block_data: return
     display_name = block_data.get('display_name', 'Без названия')
+    # В режиме синхронизации (--sync) заново скачиваются только измененные страницы
+    block_force_overwrite = force_overwrite or (refresh_ids is not None and block_id in refresh_ids)
     
     # Проверяем, нужно ли пропустить блок (уже завершен)
-    if progress_tracker and progress_tracker.should_skip_block(block_id, force_overwrite):
+    if progress_tracker and progress_tracker.should_skip_block(block_id, block_force_overwrite):
         logger.info(f"Блок '{display_name}' уже завершен. Пропускаю.")
         if progress_tracker:
             progress_tracker.mark_skipped(block_id, block_data, "Уже завершен")
         return
     
-    if any(keyword in display_name.lower() for keyword in IGNORE_KEYWORDS_IN_TITLES):
+    if all_blocks.is_ignored(block_id):
         logger.info(f"Пропускаю административный/вспомогательный раздел: '{display_name}'")
         if progress_tracker:
             progress_tracker.mark_skipped(block_id, block_data, "Административный раздел")
         return
     
-    sanitized_name = sanitize_filename(display_name)
+    sanitized_name = all_blocks.sanitized_name(block_id)
     block_type = block_data.get('type')
     if block_type in ['course', 'chapter', 'sequential']:
         # Специальная обработка для корневого блока курса - не создаем дополнительную папку
@@ -619,26 +658,97 @@ def download_material(driver, session, block_id, all_blocks, current_path, outpu
             new_path = os.path.join(current_path, sanitized_name)
             os.makedirs(new_path, exist_ok=True)
         
-        children = block_data.get('children', [])
+        children = all_blocks.children(block_id)
         logger.info(f"Захожу в раздел: '{display_name}'")
-        for child_id in children:
-            download_material(driver, session, child_id, all_blocks, new_path, output_dir, no_videos, force_overwrite, parent_block=block_data, progress_tracker=progress_tracker)
+        with tracing.span(display_name, 'section', type=block_type):
+            for child_id in children:
+                download_material(driver, session, child_id, all_blocks, new_path, output_dir, no_videos, force_overwrite, parent_block=block_data, progress_tracker=progress_tracker, output_options=output_options, refresh_ids=refresh_ids)
     elif block_type == 'vertical':
-        html_filepath = os.path.join(current_path, f"{sanitized_name}.html")
-        if os.path.exists(html_filepath) and not force_overwrite:
+        html_filepath = os.path.join(current_path, all_blocks.filename(block_id))
+        if os.path.exists(html_filepath) and not block_force_overwrite:
             logger.info(f"Файл '{os.path.basename(html_filepath)}' уже существует. Пропускаю.")
             if progress_tracker:
                 progress_tracker.mark_skipped(block_id, block_data, "Файл уже существует")
             return
-        process_content_block(driver=driver, session=session, block_data=block_data, all_blocks=all_blocks, parent_block=parent_block, html_filepath=html_filepath, output_dir=output_dir, no_videos=no_videos, progress_tracker=progress_tracker)
+        process_content_block(driver=driver, session=session, block_data=block_data, all_blocks=all_blocks, parent_block=parent_block, html_filepath=html_filepath, output_dir=output_dir, no_videos=no_videos, progress_tracker=progress_tracker, output_options=output_options)
     else:
         logger.debug(f"Пропущен блок '{display_name}' с типом: {block_type}")
         if progress_tracker:
             progress_tracker.mark_skipped(block_id, block_data, f"Неподдерживаемый тип: {block_type}")
 
-def download_course_content(root_id, all_blocks, session, output_dir, no_videos, force_overwrite, course_name="Курс"):
+def create_browser(session):
+    """Запускает Chrome и переносит в него cookies авторизованной сессии"""
+    options = webdriver.ChromeOptions()
+    options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    service = Service(ChromeDriverManager().install())
+    driver = webdriver.Chrome(service=service, options=options)
+    driver.get(f"{LMS_URL}/404")
+    time.sleep(1)
+    for cookie in session.cookies:
+        driver.add_cookie({k: v for k, v in cookie.__dict__.items() if k != '_rest'})
+    logger.info("Cookies сессии успешно переданы в браузер.")
+    return driver
+
+class BrowserPool:
+    """Пул браузеров для пакетного режима: браузеры запускаются по требованию и переиспользуются между курсами"""
+
+    def __init__(self, session, size):
+        self.session = session
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._drivers = []
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if not can_create:
+            return self._idle.get()
+        try:
+            driver = create_browser(self.session)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        with self._lock:
+            self._drivers.append(driver)
+        return driver
+
+    def release(self, driver):
+        self._idle.put(driver)
+
+    def close(self):
+        for driver in self._drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.debug(f"Не удалось закрыть браузер: {e}")
+        self._drivers.clear()
+
+def finalize_output(output_dir, output_options):
+    """Выполняет включенные этапы постобработки над общими ресурсами _assets"""
+    output_options = output_options or {}
+    close_transfer_progress()
+    close_media_client()
+    close_asset_engine()
+    if output_options.get('minify'):
+        try:
+            minify_assets(get_assets_dir(output_dir, output_options))
+        except Exception as e:
+            logger.warning(f"Не удалось минифицировать CSS/JS файлы: {e}")
+    if output_options.get('optimize_images'):
+        close_image_optimizers()
+
+def download_course_content(root_id, all_blocks, session, output_dir, no_videos, force_overwrite, course_name="Курс", output_options=None, refresh_ids=None, driver=None):
     # Создаем трекер прогресса
-    progress_tracker = ProgressTracker(course_name, output_dir)
+    progress_tracker = ProgressTracker(course_name, output_dir, registry_dir=(output_options or {}).get('output_root'))
     
     # Валидируем прогресс с файловой системой
     progress_tracker.validate_and_cleanup_progress()
@@ -646,25 +756,69 @@ def download_course_content(root_id, all_blocks, session, output_dir, no_videos,
     # Показываем текущий прогресс
     progress_tracker.print_progress_table()
     
-    driver = None
+    # Браузер из пула пакетного режима не закрываем, а постобработку общих ресурсов выполнит пакетный режим
+    own_driver = driver is None
     try:
-        logger.info("Инициализация единого экземпляра браузера для скачивания...")
-        options = webdriver.ChromeOptions()
-        options.add_experimental_option("excludeSwitches", ["enable-logging"])
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        driver.get("https://lms.skillfactory.ru/404")
-        time.sleep(1)
-        for cookie in session.cookies:
-            driver.add_cookie({k: v for k, v in cookie.__dict__.items() if k != '_rest'})
-        logger.info("Cookies сессии успешно переданы в браузер.")
+        if own_driver:
+            logger.info("Инициализация единого экземпляра браузера для скачивания...")
+            driver = create_browser(session)
         
-        download_material(driver, session, root_id, all_blocks, output_dir, output_dir, no_videos, force_overwrite, parent_block=None, progress_tracker=progress_tracker)
+        download_material(driver, session, root_id, all_blocks, output_dir, output_dir, no_videos, force_overwrite, parent_block=None, progress_tracker=progress_tracker, output_options=output_options, refresh_ids=refresh_ids)
+        
+        # Необязательная постобработка сохраненных файлов
+        if own_driver:
+            finalize_output(output_dir, output_options)
         
         # Показываем финальную статистику
         logger.info("Скачивание завершено!")
         progress_tracker.print_progress_table()
         
     finally:
-        if driver:
-            driver.quit()
\ No newline at end of file
+        progress_tracker.close()
+        if own_driver and driver:
+            driver.quit()
+
+def download_courses_batch(course_jobs, session, no_videos, force_overwrite, output_options=None, parallel_courses=1):
+    """
+    Скачивает несколько курсов за один запуск с общей сессией, пулом браузеров
+    и общим хранилищем ресурсов. course_jobs - список словарей с ключами
+    root_id, all_blocks, output_dir, course_name и refresh_ids.
+    Бюджет потоков скачивания ресурсов делится между одновременно скачиваемыми курсами.
+    """
+    parallel_courses = max(1, min(parallel_courses, len(course_jobs)))
+    browser_pool = BrowserPool(session, parallel_courses)
+    asset_workers = max(2, ASSET_DOWNLOAD_WORKERS // parallel_courses)
+    failed_courses = []
+
+    def run_course(job):
+        set_download_budget(asset_workers)
+        driver = browser_pool.acquire()
+        try:
+            logger.info(f"=== Курс '{job['course_name']}' ===")
+            download_course_content(
+                job['root_id'], job['all_blocks'], session, job['output_dir'],
+                no_videos, force_overwrite, job['course_name'],
+                output_options=output_options, refresh_ids=job.get('refresh_ids'), driver=driver
+            )
+        finally:
+            browser_pool.release(driver)
+
+    try:
+        with ThreadPoolExecutor(max_workers=parallel_courses) as executor:
+            futures = {executor.submit(run_course, job): job for job in course_jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка при скачивании курса '{job['course_name']}': {e}")
+                    failed_courses.append(job['course_name'])
+        # Постобработка общего хранилища ресурсов выполняется один раз для всех курсов
+        if course_jobs:
+            finalize_output(course_jobs[0]['output_dir'], output_options)
+    finally:
+        browser_pool.close()
+
+    logger.info(f"✔ Пакетное скачивание завершено: {len(course_jobs) - len(failed_courses)} из {len(course_jobs)} курсов")
+    if failed_courses:
+        logger.warning(f"Не удалось скачать курсы: {', '.join(failed_courses)}")
\ No newline at end of file
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Локальный тестовый сервер, имитирующий LMS SkillFactory и Kinescope.
+Нужен для воспроизводимых замеров производительности без доступа к платформе (см. bench.py).
+
+Запускает четыре HTTP сервера на 127.0.0.1 (lms, apps, lms-cdn, kinescope) с общим состоянием:
+вход с CSRF, enrollment и extended/outline API, страницы уроков с #unit-iframe,
+ресурсы asset-v1, CSS с @import и шрифтами, JS, MPD манифест видео с сегментами по диапазонам байт.
+Поддерживает задержку ответа и ограничение скорости отдачи, считает запросы и отданные байты.
+
+Самостоятельный запуск печатает переменные окружения, которые направляют main.py на этот сервер:
+    python fake_lms.py --chapters 3 --latency-ms 50
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+COURSE_ID = 'course-v1:Bench+B101+2025'
+COURSE_NAME = 'Тестовый курс производительности'
+USERNAME = 'bench@example.com'
+PASSWORD = 'bench'
+
+# Общий блок псевдослучайных данных: из него нарезаются изображения, шрифты и видео (данные не сжимаются)
+_PAYLOAD = random.Random(0).randbytes(1024 * 1024)
+_PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+_SHAPING_CHUNK = 16 * 1024
+
+
+def _payload(size, prefix=b''):
+    """Детерминированные данные заданного размера"""
+    data = bytearray(prefix)
+    while len(data) < size:
+        data += _PAYLOAD[:size - len(data)]
+    return bytes(data[:max(size, len(prefix))])
+
+
+def _block_id(block_type, name):
+    return f"block-v1:Bench+B101+2025+type@{block_type}+block@{name}"
+
+
+class FakeCourse:
+    """Структура тестового курса: главы -> подразделы -> страницы с изображениями, документами и видео"""
+
+    def __init__(self, chapters=2, sequentials=2, verticals=3, images=4, image_kb=64, documents=1, document_kb=256,
+                 videos_every=0, video_segments=20, segment_kb=256):
+        self.images = images
+        self.image_kb = image_kb
+        self.documents = documents
+        self.document_kb = document_kb
+        self.videos_every = videos_every
+        self.video_segments = video_segments
+        self.segment_kb = segment_kb
+        self.blocks = {}
+        self.pages = []
+
+        root_id = _block_id('course', 'course')
+        self.blocks[root_id] = {'id': root_id, 'type': 'course', 'display_name': COURSE_NAME, 'children': []}
+        for chapter in range(chapters):
+            chapter_id = _block_id('chapter', f"c{chapter}")
+            self.blocks[root_id]['children'].append(chapter_id)
+            self.blocks[chapter_id] = {'id': chapter_id, 'type': 'chapter', 'display_name': f"Модуль {chapter + 1}", 'children': []}
+            for sequential in range(sequentials):
+                sequential_id = _block_id('sequential', f"c{chapter}s{sequential}")
+                self.blocks[chapter_id]['children'].append(sequential_id)
+                self.blocks[sequential_id] = {
+                    'id': sequential_id, 'type': 'sequential',
+                    'display_name': f"Тема {chapter + 1}.{sequential + 1}", 'children': []
+                }
+                for vertical in range(verticals):
+                    name = f"c{chapter}s{sequential}v{vertical}"
+                    vertical_id = _block_id('vertical', name)
+                    self.blocks[sequential_id]['children'].append(vertical_id)
+                    self.blocks[vertical_id] = {
+                        'id': vertical_id, 'type': 'vertical',
+                        'display_name': f"Урок {chapter + 1}.{sequential + 1}.{vertical + 1}", 'children': []
+                    }
+                    self.pages.append(name)
+
+    def structure(self, lms_url):
+        """Ответ extended/outline API"""
+        blocks = {}
+        for block_id, block in self.blocks.items():
+            block = dict(block)
+            if block['type'] == 'vertical':
+                block['lms_web_url'] = f"{lms_url}/courses/{COURSE_ID}/jump_to/{block_id}"
+            blocks[block_id] = block
+        return {'name': COURSE_NAME, 'id': COURSE_ID, 'course_blocks': {'blocks': blocks}}
+
+    def has_video(self, page):
+        return bool(self.videos_every) and self.pages.index(page) % self.videos_every == 0
+
+    def unit_html(self, page, kinescope_url):
+        """Содержимое #unit-iframe: xblock с изображениями, документами, видео и формулами"""
+        parts = [
+            '<html><head><link rel="stylesheet" href="/static/css/unit.css">',
+            '<script src="/static/js/unit.js"></script></head><body>',
+            f'<div class="xblock xblock-student_view"><h2>Урок {page}</h2>'
+        ]
+        for index in range(self.images):
+            asset = f"asset-v1:Bench+B101+2025+type@asset+block@{page}_img{index}.png"
+            parts.append(f'<p>Текст урока {index}. $$x^{index}$$</p><img src="/{asset}" alt="рисунок {index}">')
+        # Общее для всех страниц изображение: проверяет переиспользование уже скачанных файлов
+        parts.append('<img src="/asset-v1:Bench+B101+2025+type@asset+block@logo.png">')
+        for index in range(self.documents):
+            parts.append(f'<a href="/asset-v1:Bench+B101+2025+type@asset+block@{page}_doc{index}.pdf">Документ {index}</a>')
+        if self.has_video(page):
+            parts.append(f'<iframe src="{kinescope_url}/embed/v{page}" allowfullscreen></iframe>')
+        parts.append('</div></body></html>')
+        return '\n'.join(parts)
+
+    def mpd(self, video_id):
+        """MPD манифест Kinescope: видео и аудио, сегменты задаются диапазонами байт одного файла"""
+        segment_size = self.segment_kb * 1024
+
+        def segment_list(filename, count):
+            segments = '\n'.join(
+                f'<SegmentURL mediaRange="{1024 + index * segment_size}-{1024 + (index + 1) * segment_size - 1}"/>'
+                for index in range(count)
+            )
+            return (f'<BaseURL>{filename}</BaseURL><SegmentList>'
+                    f'<Initialization sourceURL="{filename}" range="0-1023"/>{segments}</SegmentList>')
+
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static">
+<Period>
+<AdaptationSet mimeType="video/mp4">
+<Representation id="360" width="640" height="360">{segment_list('video_360.mp4', max(2, self.video_segments))}</Representation>
+<Representation id="720" width="1280" height="720">{segment_list('video_720.mp4', max(2, self.video_segments))}</Representation>
+</AdaptationSet>
+<AdaptationSet mimeType="audio/mp4">
+<Representation id="audio">{segment_list('audio.mp4', max(2, self.video_segments // 4))}</Representation>
+</AdaptationSet>
+</Period>
+</MPD>"""
+
+
+class FakeLMS:
+    """Четыре тестовых сервера с общим курсом, счетчиками и ограничением скорости"""
+
+    def __init__(self, course, latency_ms=0, bandwidth_mbps=0):
+        self.course = course
+        self.latency = latency_ms / 1000
+        # Скорость отдачи на одно соединение, байт в секунду (0 - без ограничения)
+        self.bandwidth = bandwidth_mbps * 1024 * 1024 / 8
+        self.requests = Counter()
+        self.bytes_sent = Counter()
+        self._lock = threading.Lock()
+        self._servers = {}
+        self.urls = {}
+
+    def start(self):
+        for site in ('lms', 'apps', 'cdn', 'kinescope'):
+            handler = type(f"{site.title()}Handler", (_Handler,), {'fake': self, 'site': site})
+            server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"fake-{site}", daemon=True).start()
+            self._servers[site] = server
+            self.urls[site] = f"http://127.0.0.1:{server.server_port}"
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def environment(self):
+        """Переменные окружения, которые направляют скрипт на тестовые серверы"""
+        return {
+            'SKILLFACTORY_LMS_URL': self.urls['lms'],
+            'SKILLFACTORY_APPS_URL': self.urls['apps'],
+            'SKILLFACTORY_LMS_CDN_URL': self.urls['cdn'],
+            'SKILLFACTORY_KINESCOPE_URL': self.urls['kinescope'],
+        }
+
+    def record(self, endpoint, size):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.bytes_sent[endpoint] += size
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'bytes': dict(self.bytes_sent)}
+
+
+def _jwt_payload_cookie():
+    """Cookie с полезной нагрузкой JWT (как у Open edX), срок - час"""
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': int(time.time()) + 3600}).encode()).decode().rstrip('=')
+    return f"eyJhbGciOiJIUzI1NiJ9.{payload}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    site = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _cookies(self):
+        cookies = {}
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name:
+                cookies[name] = value
+        return cookies
+
+    def _send(self, endpoint, status=200, body=b'', content_type='text/html; charset=utf-8', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or []):
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self._write_shaped(body)
+        self.fake.record(endpoint, len(body))
+
+    def _write_shaped(self, body):
+        if not self.fake.bandwidth:
+            self.wfile.write(body)
+            return
+        for offset in range(0, len(body), _SHAPING_CHUNK):
+            chunk = body[offset:offset + _SHAPING_CHUNK]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.fake.bandwidth)
+
+    def _send_json(self, endpoint, data, status=200, headers=None):
+        self._send(endpoint, status, json.dumps(data, ensure_ascii=False), 'application/json', headers)
+
+    def _send_range(self, endpoint, data, content_type):
+        """Отдает диапазон байт по заголовку Range (206) или весь файл"""
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not match:
+            self._send(endpoint, 200, data, content_type)
+            return
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        self._send(endpoint, 206, data[start:end + 1], content_type,
+                   [('Content-Range', f"bytes {start}-{end}/{len(data)}"), ('Accept-Ranges', 'bytes')])
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8', 'ignore') if length else ''
+        path = urlparse(self.path).path
+        if self.site == 'lms' and path == '/api/user/v1/account/login_session/':
+            if self.headers.get('X-CSRFToken') != self._cookies().get('csrftoken'):
+                self._send_json('login', {'success': False, 'value': 'CSRF'}, 403)
+            elif f"password={PASSWORD}" not in body:
+                self._send_json('login', {'success': False}, 400)
+            else:
+                self._send_json('login', {'success': True}, headers=[
+                    ('Set-Cookie', 'sessionid=bench-session; Path=/; HttpOnly'),
+                    ('Set-Cookie', f"edx-jwt-cookie-header-payload={_jwt_payload_cookie()}; Path=/")
+                ])
+        elif self.site == 'lms' and path == '/login_refresh':
+            self._send_json('login_refresh', {}, headers=[
+                ('Set-Cookie', f"edx-jwt-cookie-header-payload={_jwt_payload_cookie()}; Path=/")
+            ])
+        else:
+            self._send('other', 404, 'Not found')
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        handler = getattr(self, f"_get_{self.site}")
+        if not handler(path):
+            self._route_common(path)
+
+    def _authorized(self):
+        return self._cookies().get('sessionid') == 'bench-session'
+
+    def _get_lms(self, path):
+        course = self.fake.course
+        if path == '/csrf/api/v1/token':
+            self._send_json('csrf', {'csrfToken': 'bench-csrf'}, headers=[('Set-Cookie', 'csrftoken=bench-csrf; Path=/')])
+        elif path == '/__bench/stats':
+            self._send_json('stats', self.fake.stats())
+        elif not path.startswith(('/api/', '/courses/', '/xblock/')):
+            return False
+        elif not self._authorized():
+            self._send_json('unauthorized', {'detail': 'Authentication credentials were not provided.'}, 401)
+        elif path == '/api/user/v1/me':
+            self._send_json('me', {'username': 'bench'})
+        elif path == '/api/enrollment/v1/enrollment':
+            self._send_json('enrollment', [{
+                'is_active': True, 'course_details': {'course_id': COURSE_ID, 'course_name': COURSE_NAME}
+            }])
+        elif path == '/api/courses/v1/courses/':
+            self._send_json('courses', {'results': [{'course_id': COURSE_ID, 'name': COURSE_NAME}]})
+        elif path == f"/api/extended/outline/{COURSE_ID}":
+            self._send_json('outline', course.structure(self.fake.urls['lms']))
+        elif path.startswith('/api/course_home/course_metadata/'):
+            self._send_json('course_metadata', {'course_blocks': None})
+        elif path.startswith(f"/courses/{COURSE_ID}/jump_to/"):
+            page = path.rsplit('@', 1)[-1]
+            if page not in course.pages:
+                self._send('page', 404, 'Not found')
+            else:
+                self._send('page', body=(
+                    '<html><head><title>Урок</title><link rel="stylesheet" href="/static/css/main.css"></head><body>'
+                    f'<div class="course-wrapper"><iframe id="unit-iframe" src="/xblock/{path.rsplit("/", 1)[-1]}"></iframe></div>'
+                    '</body></html>'
+                ))
+        elif path.startswith('/xblock/'):
+            page = path.rsplit('@', 1)[-1]
+            self._send('unit', body=course.unit_html(page, self.fake.urls['kinescope']))
+        else:
+            return False
+        return True
+
+    def _get_apps(self, path):
+        if path.startswith('/learning/course/'):
+            self._send('course_home', body=f'<html><body><div id="root" data-course="{COURSE_ID}"></div></body></html>')
+            return True
+        return False
+
+    def _get_cdn(self, path):
+        return False
+
+    def _get_kinescope(self, path):
+        course = self.fake.course
+        match = re.match(r'/(v[a-zA-Z0-9]+)/(master\.mpd|[a-z0-9_]+\.mp4)$', path)
+        if path.startswith('/embed/'):
+            self._send('embed', body='<html><body><video></video></body></html>')
+        elif match and match.group(2) == 'master.mpd':
+            self._send('mpd', body=course.mpd(match.group(1)), content_type='application/dash+xml')
+        elif match:
+            segments = course.video_segments if 'video' in match.group(2) else max(2, course.video_segments // 4)
+            self._send_range('segment', _payload(1024 + segments * course.segment_kb * 1024), 'video/mp4')
+        else:
+            return False
+        return True
+
+    def _route_common(self, path):
+        """Ресурсы, которые отдаются всеми хостами: asset-v1, статика, страница 404"""
+        course = self.fake.course
+        asset = re.match(r'/asset-v1:[^/]+\+type@asset\+block@(.+)$', path)
+        if asset:
+            name = asset.group(1)
+            if name.endswith('.pdf'):
+                self._send('asset', body=_payload(course.document_kb * 1024, b'%PDF-1.4\n'), content_type='application/pdf')
+            else:
+                self._send('asset', body=_payload(course.image_kb * 1024, _PNG_HEADER), content_type='image/png')
+        elif path == '/static/css/main.css':
+            self._send('css', body="@import url('base.css');\nbody { margin: 0 auto; max-width: 960px; }\n", content_type='text/css')
+        elif path == '/static/css/base.css':
+            self._send('css', body=(
+                "@font-face { font-family: 'Bench'; src: url('/static/fonts/bench.woff2') format('woff2'); }\n"
+                "body { font-family: 'Bench', sans-serif; }\n"
+            ), content_type='text/css')
+        elif path == '/static/css/unit.css':
+            self._send('css', body="@import url('/static/css/base.css');\n.xblock { padding: 1em; }\n", content_type='text/css')
+        elif path.startswith('/static/fonts/'):
+            self._send('font', body=_payload(48 * 1024, b'wOF2'), content_type='font/woff2')
+        elif path.startswith('/static/js/'):
+            self._send('js', body="(function () { window.benchUnit = true; })();\n" * 50, content_type='application/javascript')
+        else:
+            self._send('not_found', 404, '<html><body>404</body></html>')
+
+
+def _add_course_arguments(parser):
+    """Параметры размера курса и сети (общие для fake_lms.py и bench.py)"""
+    parser.add_argument('--chapters', type=int, default=2, help="Число глав (по умолчанию 2).")
+    parser.add_argument('--sequentials', type=int, default=2, help="Подразделов в главе (по умолчанию 2).")
+    parser.add_argument('--verticals', type=int, default=3, help="Страниц в подразделе (по умолчанию 3).")
+    parser.add_argument('--images', type=int, default=4, help="Изображений на странице (по умолчанию 4).")
+    parser.add_argument('--image-kb', type=int, default=64, help="Размер изображения, КБ (по умолчанию 64).")
+    parser.add_argument('--documents', type=int, default=1, help="Документов на странице (по умолчанию 1).")
+    parser.add_argument('--document-kb', type=int, default=256, help="Размер документа, КБ (по умолчанию 256).")
+    parser.add_argument('--videos-every', type=int, default=0, help="Видео на каждой N-й странице (0 - без видео).")
+    parser.add_argument('--video-segments', type=int, default=20, help="Сегментов видеопотока (по умолчанию 20).")
+    parser.add_argument('--segment-kb', type=int, default=256, help="Размер сегмента видео, КБ (по умолчанию 256).")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Задержка каждого ответа, мс.")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help="Скорость отдачи на соединение, Мбит/с (0 - без ограничения).")
+
+
+def create_fake_lms(args):
+    """Создает и запускает тестовые серверы по параметрам командной строки"""
+    course = FakeCourse(
+        chapters=args.chapters, sequentials=args.sequentials, verticals=args.verticals,
+        images=args.images, image_kb=args.image_kb, documents=args.documents, document_kb=args.document_kb,
+        videos_every=args.videos_every, video_segments=args.video_segments, segment_kb=args.segment_kb
+    )
+    return FakeLMS(course, latency_ms=args.latency_ms, bandwidth_mbps=args.bandwidth_mbps).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Тестовый сервер, имитирующий LMS SkillFactory и Kinescope.")
+    _add_course_arguments(parser)
+    args = parser.parse_args()
+
+    fake = create_fake_lms(args)
+    # Формат вывода читает bench.py: строки export ... до строки остановки
+    print(f"Тестовые серверы запущены, страниц в курсе: {len(fake.course.pages)}")
+    print(f"Учетные данные: {USERNAME} / {PASSWORD}")
+    for name, value in fake.environment().items():
+        print(f"export {name}={value}")
+    print("Остановка: Ctrl+C", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
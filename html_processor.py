@@ -5,15 +5,40 @@ import os
 import re
 import base64
 import hashlib
+import json
+import threading
 from urllib.parse import urljoin, urlparse, unquote, quote
 import requests
 from bs4 import BeautifulSoup
 from pathvalidate import sanitize_filename
-from utils import download_file
+from config import SHARED_INLINE_MIN_BYTES, IMAGE_MAX_DIMENSION, LMS_URL, APPS_URL, LMS_CDN_URL, KINESCOPE_URL
+from asset_engine import AssetJob, download_assets, fetch_texts
+from utils import _path_lock, _write_file_atomic
 from navigation import _rewire_navigation_links
+from minifier import minify_html
+from image_optimizer import ImageOptimizer
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Расширения изображений, которые принимаются при определении типа по ответу сервера
+_IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif', 'webp', 'svg', 'avif', 'bmp', 'ico']
+
+# Плеер Kinescope: хост берется из KINESCOPE_URL, чтобы скрипт работал и с тестовым сервером
+KINESCOPE_HOST = urlparse(KINESCOPE_URL).netloc
+KINESCOPE_VIDEO_ID_RE = re.compile(re.escape(KINESCOPE_HOST) + r'/(?:embed/)?([a-zA-Z0-9]+)')
+KINESCOPE_EMBED_RE = re.compile(re.escape(KINESCOPE_HOST) + r'/embed')
+
+# Кеши CSS уровня курса (живут весь запуск и общие для всех уроков)
+_css_text_cache = {}      # URL -> исходный текст CSS (только успешно скачанные, неудачи повторяются)
+_css_rewrite_cache = {}   # (SHA-1 CSS, база URL, папка шрифтов, папка CSS) -> CSS с локальными шрифтами
+_css_saved_paths = set()  # Локальные CSS файлы, уже сохраненные или проверенные в этом запуске
+_css_cache_lock = threading.Lock()
+
+# Оптимизаторы изображений по папке _assets (пул процессов создается один раз за запуск)
+_image_optimizers = {}
+_image_optimizers_lock = threading.Lock()
+
 def _generate_stable_filename(url, extension):
     """Генерирует короткое стабильное имя файла на основе URL"""
     # Используем MD5 для стабильного хеша
@@ -65,17 +90,17 @@ def _embed_local_videos(html_content, downloaded_videos):
     # Создаем словарь для быстрого поиска: video_id -> filename
     video_mapping = {}
     for video in downloaded_videos:
-        video_id_match = re.search(r'kinescope\.io/(?:embed/)?([a-zA-Z0-9]+)', video['iframe_src'])
+        video_id_match = KINESCOPE_VIDEO_ID_RE.search(video['iframe_src'])
         if video_id_match:
             video_mapping[video_id_match.group(1)] = video['filename']
     
     # Находим ВСЕ iframe с Kinescope и заменяем их
-    iframe_tags = soup.find_all('iframe', src=re.compile(r'kinescope\.io/embed'))
+    iframe_tags = soup.find_all('iframe', src=KINESCOPE_EMBED_RE)
     replaced_count = 0
     
     for iframe_tag in iframe_tags:
         iframe_src = iframe_tag.get('src', '')
-        video_id_match = re.search(r'kinescope\.io/(?:embed/)?([a-zA-Z0-9]+)', iframe_src)
+        video_id_match = KINESCOPE_VIDEO_ID_RE.search(iframe_src)
         
         if video_id_match:
             video_id = video_id_match.group(1)
@@ -148,62 +173,118 @@ def _clean_html(html_content):
     
     return str(soup)
 
-def _get_full_css_content(css_url, session, processed_urls):
-    if css_url in processed_urls: return ""
-    processed_urls.add(css_url)
+def _resolve_css_url(url, base_url):
+    """Преобразует ссылку из CSS в абсолютный URL с учетом протокол-относительных ссылок"""
+    # Обработка протокол-относительных URL (начинающихся с //)
+    if url.startswith('//'):
+        # Извлекаем протокол из базового URL
+        base_protocol = urlparse(base_url).scheme or 'https'
+        return f"{base_protocol}:{url}"
+    return urljoin(base_url, url)
+
+def _fetch_css_text(css_url, session):
+    """Скачивает текст CSS, используя кеш уровня курса. Возвращает None при ошибке."""
+    with _css_cache_lock:
+        if css_url in _css_text_cache:
+            return _css_text_cache[css_url]
     try:
         response = session.get(css_url, timeout=15)
         response.raise_for_status()
         content = response.text
-        def replace_import(match):
-            import_statement = match.group(0)
-            url_match = re.search(r'url\((["\']?)(.*?)\1\)|(["\'])(.*?)\3', import_statement)
-            if not url_match: return ""
-            path = (url_match.group(2) or url_match.group(4)).strip()
-            
-            # Обработка протокол-относительных URL (начинающихся с //)
-            if path.startswith('//'):
-                # Извлекаем протокол из css_url
-                base_protocol = urlparse(css_url).scheme or 'https'
-                absolute_url = f"{base_protocol}:{path}"
-            else:
-                absolute_url = urljoin(css_url, path)
-            
-            return _get_full_css_content(absolute_url, session, processed_urls)
-        return re.sub(r'(?i)@import[^;]+;', replace_import, content)
+        metrics.add_bytes(len(response.content))
     except requests.RequestException as e:
         logger.warning(f"Не удалось скачать CSS {css_url}: {e}")
-        return ""
+        return None
+    with _css_cache_lock:
+        _css_text_cache[css_url] = content
+    return content
+
+def _prefetch_css_texts(css_urls, session):
+    """Параллельно скачивает CSS файлы, которых еще нет в кеше"""
+    with _css_cache_lock:
+        missing_urls = [url for url in dict.fromkeys(css_urls) if url not in _css_text_cache]
+    if len(missing_urls) > 1:
+        texts = fetch_texts(missing_urls, session)
+        with _css_cache_lock:
+            _css_text_cache.update((url, text) for url, text in texts.items() if text is not None)
+
+def _get_full_css_content(css_url, session, processed_urls):
+    if css_url in processed_urls: return ""
+    processed_urls.add(css_url)
+    content = _fetch_css_text(css_url, session)
+    if content is None: return ""
+
+    def import_url(import_statement):
+        url_match = re.search(r'url\((["\']?)(.*?)\1\)|(["\'])(.*?)\3', import_statement)
+        if not url_match: return None
+        path = (url_match.group(2) or url_match.group(4)).strip()
+        return _resolve_css_url(path, css_url)
+
+    # Все @import одного уровня скачиваются параллельно, подстановка идет по порядку
+    import_statements = re.findall(r'(?i)@import[^;]+;', content)
+    _prefetch_css_texts([url for url in map(import_url, import_statements) if url and url not in processed_urls], session)
+
+    def replace_import(match):
+        absolute_url = import_url(match.group(0))
+        if not absolute_url: return ""
+        return _get_full_css_content(absolute_url, session, processed_urls)
+    return re.sub(r'(?i)@import[^;]+;', replace_import, content)
 
 def _download_fonts_from_css(css_content, css_base_url, font_dest_dir, css_location_path, session):
     os.makedirs(font_dest_dir, exist_ok=True)
-    def font_replacer(match):
-        font_url = match.group(1).strip('\'" ')
-        if font_url.startswith('data:'): return match.group(0)
+    css_location_dir = os.path.dirname(css_location_path)
+
+    # Результат зависит от базового URL только при наличии относительных ссылок
+    font_urls = [match.strip('\'" ') for match in re.findall(r'url\(([^)]+)\)', css_content)]
+    has_relative_urls = any(not re.match(r'(?i)(data:|https?:|//)', url) for url in font_urls)
+    cache_key = (
+        hashlib.sha1(css_content.encode('utf-8')).hexdigest(),
+        css_base_url if has_relative_urls else None,
+        font_dest_dir,
+        css_location_dir
+    )
+    with _css_cache_lock:
+        if cache_key in _css_rewrite_cache:
+            return _css_rewrite_cache[cache_key]
+
+    # 1. Определяем локальные пути для всех шрифтов
+    local_font_paths = {}  # url из CSS -> (абсолютный URL, локальный путь)
+    for font_url in font_urls:
+        if font_url in local_font_paths or font_url.startswith('data:'): continue
         try:
-            # Обработка протокол-относительных URL (начинающихся с //)
-            if font_url.startswith('//'):
-                # Извлекаем протокол из css_base_url
-                base_protocol = urlparse(css_base_url).scheme or 'https'
-                absolute_font_url = f"{base_protocol}:{font_url}"
-            else:
-                absolute_font_url = urljoin(css_base_url, font_url)
-            
+            absolute_font_url = _resolve_css_url(font_url, css_base_url)
             font_filename_raw = os.path.basename(urlparse(absolute_font_url).path)
             if not font_filename_raw.lower().endswith(('.woff', '.woff2', '.ttf', '.eot', '.otf')):
-                return match.group(0)
+                continue
             font_filename = sanitize_filename(unquote(font_filename_raw))
-            if not font_filename: return match.group(0)
-            local_font_path = os.path.join(font_dest_dir, font_filename)
-            if not os.path.exists(local_font_path):
-                if not download_file(absolute_font_url, local_font_path, session):
-                    return "url('')"
-            relative_font_path = os.path.relpath(local_font_path, os.path.dirname(css_location_path)).replace("\\", "/")
-            return f"url('{relative_font_path}')"
+            if not font_filename: continue
+            local_font_paths[font_url] = (absolute_font_url, os.path.join(font_dest_dir, font_filename))
         except Exception as e:
             logger.error(f"Ошибка при обработке шрифта {font_url}: {e}")
+
+    # 2. Одновременно скачиваем отсутствующие шрифты
+    jobs = {}
+    for absolute_font_url, local_font_path in local_font_paths.values():
+        if local_font_path not in jobs and not os.path.exists(local_font_path):
+            jobs[local_font_path] = AssetJob(absolute_font_url, local_font_path)
+    download_results = {path: bool(saved_path) for path, saved_path in zip(jobs, download_assets(list(jobs.values()), session))}
+
+    # 3. Переписываем ссылки на локальные файлы
+    def font_replacer(match):
+        font_url = match.group(1).strip('\'" ')
+        if font_url.startswith('data:') or font_url not in local_font_paths: return match.group(0)
+        _, local_font_path = local_font_paths[font_url]
+        if not download_results.get(local_font_path, True):
             return "url('')"
-    return re.sub(r'url\(([^)]+)\)', font_replacer, css_content)
+        relative_font_path = os.path.relpath(local_font_path, css_location_dir).replace("\\", "/")
+        return f"url('{relative_font_path}')"
+    rewritten_css = re.sub(r'url\(([^)]+)\)', font_replacer, css_content)
+
+    # Неудачные загрузки не кешируем, чтобы повторить их на следующей странице
+    if all(download_results.values()):
+        with _css_cache_lock:
+            _css_rewrite_cache[cache_key] = rewritten_css
+    return rewritten_css
 
 def download_css_and_update_html(base_url, html_content, lesson_file_path, root_css_dir, session):
     soup = BeautifulSoup(html_content, 'html.parser')
@@ -215,27 +296,22 @@ def download_css_and_update_html(base_url, html_content, lesson_file_path, root_
         href = link.get('href')
         if not href or href.startswith('data:'): continue
         try:
-            # Обработка протокол-относительных URL (начинающихся с //)
-            if href.startswith('//'):
-                # Извлекаем протокол из base_url
-                base_protocol = urlparse(base_url).scheme or 'https'
-                css_url = f"{base_protocol}:{href}"
-            else:
-                css_url = urljoin(base_url, href)
-            
+            css_url = _resolve_css_url(href, base_url)
             css_filename = _generate_stable_filename(css_url, 'css')
             local_css_path = os.path.join(root_css_dir, css_filename)
             
-            if css_url not in processed_css_urls:
-                if not os.path.exists(local_css_path):
-                    logger.debug(f"Скачиваю CSS: {css_url} -> {css_filename}")
-                    full_css_content = _get_full_css_content(css_url, session, processed_css_urls)
-                    processed_css_with_fonts = _download_fonts_from_css(full_css_content, css_url, root_font_dir, local_css_path, session)
-                    with open(local_css_path, 'w', encoding='utf-8') as f:
-                        f.write(processed_css_with_fonts)
-                else:
-                    logger.debug(f"CSS файл уже существует: {css_filename}")
-                processed_css_urls.add(css_url)
+            # Курсы в пакетном режиме делят папку CSS: один файл проверяет и записывает только один поток
+            with _path_lock(local_css_path):
+                if css_url not in processed_css_urls and local_css_path not in _css_saved_paths:
+                    if not os.path.exists(local_css_path):
+                        logger.debug(f"Скачиваю CSS: {css_url} -> {css_filename}")
+                        full_css_content = _get_full_css_content(css_url, session, processed_css_urls)
+                        processed_css_with_fonts = _download_fonts_from_css(full_css_content, css_url, root_font_dir, local_css_path, session)
+                        _write_file_atomic(local_css_path, processed_css_with_fonts.encode('utf-8'))
+                    else:
+                        logger.debug(f"CSS файл уже существует: {css_filename}")
+                    processed_css_urls.add(css_url)
+                    _css_saved_paths.add(local_css_path)
             
             link['href'] = os.path.relpath(local_css_path, os.path.dirname(lesson_file_path)).replace("\\", "/")
         except Exception as e:
@@ -246,49 +322,245 @@ def download_css_and_update_html(base_url, html_content, lesson_file_path, root_
             style_tag.string.replace_with(_download_fonts_from_css(style_tag.string, base_url, root_font_dir, lesson_file_path, session))
     return str(soup)
 
+# Паттерны для замены ссылок на SkillFactory серверы.
+# Порядок важен: если в одной позиции подходят несколько паттернов, срабатывает первый.
+_JS_CLEAN_REPLACEMENTS = [
+    # Основные домены SkillFactory
+    (r'https://lms\.skillfactory\.ru', 'javascript:void(0); // removed lms.skillfactory.ru'),
+    (r'https://apps\.skillfactory\.ru', 'javascript:void(0); // removed apps.skillfactory.ru'),
+    (r'https://cms\.skillfactory\.ru', 'javascript:void(0); // removed cms.skillfactory.ru'),
+    (r'https://student-lk\.skillfactory\.ru', 'javascript:void(0); // removed student-lk.skillfactory.ru'),
+    (r'https://mentor-lk\.skillfactory\.ru', 'javascript:void(0); // removed mentor-lk.skillfactory.ru'),
+    (r'https://staff-lk\.skillfactory\.ru', 'javascript:void(0); // removed staff-lk.skillfactory.ru'),
+    (r'https://services\.skillfactory\.ru', 'javascript:void(0); // removed services.skillfactory.ru'),
+    (r'https://lms-cdn\.skillfactory\.ru', 'javascript:void(0); // removed lms-cdn.skillfactory.ru'),
+    
+    # Поддомены и другие варианты
+    (r'https://[a-zA-Z0-9\-\.]*\.skillfactory\.ru', 'javascript:void(0); // removed skillfactory.ru subdomain'),
+    (r'https://skillfactory\.ru', 'javascript:void(0); // removed skillfactory.ru'),
+    
+    # Специфичные API endpoints
+    (r'/login_refresh["\']?', '/dev/null" // removed login_refresh'),
+    (r'/csrf/api/v1/token["\']?', '/dev/null" // removed csrf token'),
+    (r'/api/user/v1/[^"\']*["\']?', '/dev/null" // removed user api'),
+    
+    # Email адреса (чтобы не было попыток отправки)
+    (r'mailto:[a-zA-Z0-9\.\-_]+@skillfactory\.ru', 'javascript:void(0); // removed skillfactory email'),
+    
+    # Телеграм и соцсети (менее критично, но для полноты)
+    (r'https://t\.me/skillfactory', 'javascript:void(0); // removed telegram'),
+    (r'https://vk\.com/skillfactoryschool', 'javascript:void(0); // removed vk'),
+    (r'https://blog\.skillfactory\.ru', 'javascript:void(0); // removed blog'),
+]
+
+# Все паттерны объединены в одну альтернацию: файл просматривается за один проход,
+# а номер сработавшей группы указывает на замену
+_JS_CLEAN_RE = re.compile('|'.join(f'({pattern})' for pattern, _ in _JS_CLEAN_REPLACEMENTS), re.IGNORECASE)
+
+# Манифест очищенных JS файлов: SHA-1 содержимого -> имя файла
+_JS_MANIFEST_FILENAME = '.cleaned_manifest.json'
+_js_manifests = {}  # root_js_dir -> {'hashes': {...}, 'checked': set()}
+_js_manifest_lock = threading.Lock()
+
 def _clean_js_content(js_content):
     """Очищает JS файлы от ссылок на SkillFactory серверы"""
     if not js_content:
         return js_content
-    
-    # Паттерны для замены ссылок на SkillFactory серверы
-    replacements = [
-        # Основные домены SkillFactory
-        (r'https://lms\.skillfactory\.ru', 'javascript:void(0); // removed lms.skillfactory.ru'),
-        (r'https://apps\.skillfactory\.ru', 'javascript:void(0); // removed apps.skillfactory.ru'),
-        (r'https://cms\.skillfactory\.ru', 'javascript:void(0); // removed cms.skillfactory.ru'),
-        (r'https://student-lk\.skillfactory\.ru', 'javascript:void(0); // removed student-lk.skillfactory.ru'),
-        (r'https://mentor-lk\.skillfactory\.ru', 'javascript:void(0); // removed mentor-lk.skillfactory.ru'),
-        (r'https://staff-lk\.skillfactory\.ru', 'javascript:void(0); // removed staff-lk.skillfactory.ru'),
-        (r'https://services\.skillfactory\.ru', 'javascript:void(0); // removed services.skillfactory.ru'),
-        (r'https://lms-cdn\.skillfactory\.ru', 'javascript:void(0); // removed lms-cdn.skillfactory.ru'),
-        
-        # Поддомены и другие варианты
-        (r'https://[a-zA-Z0-9\-\.]*\.skillfactory\.ru', 'javascript:void(0); // removed skillfactory.ru subdomain'),
-        (r'https://skillfactory\.ru', 'javascript:void(0); // removed skillfactory.ru'),
-        
-        # Специфичные API endpoints
-        (r'/login_refresh["\']?', '/dev/null" // removed login_refresh'),
-        (r'/csrf/api/v1/token["\']?', '/dev/null" // removed csrf token'),
-        (r'/api/user/v1/[^"\']*["\']?', '/dev/null" // removed user api'),
-        
-        # Email адреса (чтобы не было попыток отправки)
-        (r'mailto:[a-zA-Z0-9\.\-_]+@skillfactory\.ru', 'javascript:void(0); // removed skillfactory email'),
-        
-        # Телеграм и соцсети (менее критично, но для полноты)
-        (r'https://t\.me/skillfactory', 'javascript:void(0); // removed telegram'),
-        (r'https://vk\.com/skillfactoryschool', 'javascript:void(0); // removed vk'),
-        (r'https://blog\.skillfactory\.ru', 'javascript:void(0); // removed blog'),
-    ]
-    
-    cleaned_content = js_content
-    for pattern, replacement in replacements:
-        try:
-            cleaned_content = re.sub(pattern, replacement, cleaned_content, flags=re.IGNORECASE)
-        except Exception as e:
-            logger.warning(f"Ошибка при очистке JS паттерна {pattern}: {e}")
-    
-    return cleaned_content 
+    return _JS_CLEAN_RE.sub(lambda match: _JS_CLEAN_REPLACEMENTS[match.lastindex - 1][1], js_content)
+
+def _get_js_manifest(root_js_dir):
+    """Возвращает манифест очищенных JS файлов, загружая его с диска при первом обращении"""
+    manifest = _js_manifests.get(root_js_dir)
+    if manifest is None:
+        hashes = {}
+        manifest_path = os.path.join(root_js_dir, _JS_MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    hashes = json.load(f)
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить манифест JS файлов: {e}")
+        manifest = {'hashes': hashes, 'checked': set()}
+        _js_manifests[root_js_dir] = manifest
+    return manifest
+
+def _ensure_js_cleaned(local_js_path, root_js_dir):
+    """
+    Очищает локальный JS файл от ссылок на SkillFactory, если он еще не был очищен.
+    Файлы, уже проверенные в этом запуске, не читаются повторно; содержимое,
+    хеш которого записан в манифесте, не обрабатывается регулярными выражениями.
+    """
+    with _js_manifest_lock:
+        manifest = _get_js_manifest(root_js_dir)
+        if local_js_path in manifest['checked']:
+            return
+
+        with open(local_js_path, 'rb') as f:
+            raw_content = f.read()
+        content_hash = hashlib.sha1(raw_content).hexdigest()
+
+        if content_hash not in manifest['hashes']:
+            js_content = raw_content.decode('utf-8')
+            cleaned_js_content = _clean_js_content(js_content)
+            
+            # Сохраняем очищенный контент только если он изменился
+            if cleaned_js_content != js_content:
+                cleaned_bytes = cleaned_js_content.encode('utf-8')
+                with open(local_js_path, 'wb') as f:
+                    f.write(cleaned_bytes)
+                content_hash = hashlib.sha1(cleaned_bytes).hexdigest()
+                logger.debug(f"JS файл очищен от ссылок на SkillFactory: {os.path.basename(local_js_path)}")
+
+            manifest['hashes'][content_hash] = os.path.basename(local_js_path)
+            try:
+                with open(os.path.join(root_js_dir, _JS_MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+                    json.dump(manifest['hashes'], f, ensure_ascii=False)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить манифест JS файлов: {e}")
+
+        manifest['checked'].add(local_js_path)
+
+# Общая конфигурация MathJax для всех сохраненных страниц.
+# Подключается обычным скриптом до MathJax.js: объект window.MathJax используется как конфигурация.
+_MATHJAX_CONFIG_JS = """window.MathJax = {
+    AuthorInit: function () {
+        MathJax.Hub.Config({
+            jax: ["input/TeX", "output/SVG"],
+            extensions: ["tex2jax.js"],
+            tex2jax: {
+                inlineMath: [['$','$'], ['\\\\(','\\\\)']],
+                displayMath: [['$$','$$'], ['\\\\[','\\\\]']],
+                processEscapes: true,
+                preview: "none"
+            },
+            SVG: {
+                scale: 100,
+                linebreaks: { automatic: true }
+            },
+            showProcessingMessages: false,
+            messageStyle: "none"
+        });
+
+        // Скрываем preview и assistive блоки после рендеринга
+        MathJax.Hub.Register.StartupHook("End", function () {
+            var selectors = [
+                '.MathJax_Preview',
+                '.MJX_Assistive_MathML, span[role="presentation"][class*="MJX"]',
+                'span.MathJax_SVG[role="presentation"]'
+            ];
+            for (var s = 0; s < selectors.length; s++) {
+                var elements = document.querySelectorAll(selectors[s]);
+                for (var i = 0; i < elements.length; i++) {
+                    elements[i].style.display = 'none';
+                    elements[i].style.visibility = 'hidden';
+                    elements[i].style.height = '0';
+                    elements[i].style.width = '0';
+                    elements[i].style.margin = '0';
+                    elements[i].style.padding = '0';
+                }
+            }
+        });
+    }
+};
+"""
+
+# Общие стили офлайн-страниц: скрытие спиннеров и MathJax preview
+_OFFLINE_RUNTIME_CSS = """.xblock-student_view-loading, .spinner-border { display: none !important; }
+.MathJax_Preview { display: none !important; visibility: hidden !important; height: 0 !important; width: 0 !important; margin: 0 !important; padding: 0 !important; }
+span[class*="MathJax_Preview"] { display: none !important; }
+.MJX_Assistive_MathML { display: none !important; visibility: hidden !important; height: 0 !important; width: 0 !important; margin: 0 !important; padding: 0 !important; }
+span[role="presentation"][class*="MJX"] { display: none !important; }
+span.MathJax_SVG[role="presentation"] { display: none !important; }
+.MathJax_SVG { display: inline-block !important; }
+"""
+
+# Типы <script>, содержимое которых можно вынести во внешний JS файл.
+# Модули не выносятся: <script type="module" src=...> не загружается со страниц file://
+_SHAREABLE_SCRIPT_TYPES = ['', 'text/javascript', 'application/javascript']
+
+_shared_asset_paths = set()  # Общие файлы, уже записанные или проверенные в этом запуске
+_inline_block_pages = {}     # Путь общего файла встроенного блока -> первая страница, где блок встретился
+_shared_asset_lock = threading.Lock()
+
+def _is_repeated_block(shared_path, lesson_path):
+    """Встречался ли блок на другой странице (в этом запуске или в общем файле с прошлого запуска)"""
+    with _shared_asset_lock:
+        first_page = _inline_block_pages.setdefault(shared_path, lesson_path)
+        return first_page != lesson_path or shared_path in _shared_asset_paths or os.path.exists(shared_path)
+
+def _write_shared_file(file_path, content):
+    """Записывает общий файл, если его еще нет или содержимое изменилось"""
+    with _shared_asset_lock:
+        if file_path in _shared_asset_paths:
+            return file_path
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        existing_content = None
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                existing_content = f.read()
+        if existing_content != content:
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+        _shared_asset_paths.add(file_path)
+        return file_path
+
+def _ensure_runtime_file(assets_dir, filename, content):
+    """Возвращает путь к файлу общей среды выполнения _assets/runtime, создавая или обновляя его"""
+    return _write_shared_file(os.path.join(assets_dir, 'runtime', filename), content)
+
+def _rebase_css_urls(css_content, from_dir, to_dir):
+    """Пересчитывает относительные url() в CSS при переносе стилей из from_dir в to_dir"""
+    def url_replacer(match):
+        url = match.group(1).strip('\'" ')
+        if not url or re.match(r'(?i)([a-z][a-z0-9+.\-]*:|//|/|#)', url):
+            return match.group(0)
+        rebased_url = os.path.relpath(os.path.normpath(os.path.join(from_dir, url)), to_dir).replace("\\", "/")
+        return f"url('{rebased_url}')"
+    return re.sub(r'url\(([^)]+)\)', url_replacer, css_content)
+
+def _share_inline_assets(soup, lesson_path, assets_dir):
+    """
+    Выносит крупные встроенные <style> и <script>, повторяющиеся на разных страницах,
+    в общие файлы _assets/shared, названные по хешу содержимого. Одинаковые блоки хранятся один раз
+    и кешируются браузером; блок, который встретился впервые, остается на странице.
+    """
+    lesson_dir = os.path.dirname(lesson_path)
+    shared_dir = os.path.join(assets_dir, 'shared')
+    shared_count = 0
+
+    for style_tag in soup.find_all('style'):
+        css_content = style_tag.string
+        if not css_content or len(css_content) < SHARED_INLINE_MIN_BYTES or style_tag.find_parent('svg'):
+            continue
+        css_content = _rebase_css_urls(str(css_content), lesson_dir, shared_dir)
+        content_hash = hashlib.sha1(css_content.encode('utf-8')).hexdigest()[:16]
+        shared_path = os.path.join(shared_dir, f"{content_hash}.css")
+        if not _is_repeated_block(shared_path, lesson_path):
+            continue
+        _write_shared_file(shared_path, css_content)
+        link_tag = soup.new_tag('link', rel='stylesheet', href=os.path.relpath(shared_path, lesson_dir).replace("\\", "/"))
+        if style_tag.get('media'):
+            link_tag['media'] = style_tag['media']
+        style_tag.replace_with(link_tag)
+        shared_count += 1
+
+    for script_tag in soup.find_all('script', src=False):
+        js_content = script_tag.string
+        script_type = script_tag.get('type', '').strip().lower()
+        if not js_content or len(js_content) < SHARED_INLINE_MIN_BYTES or script_type not in _SHAREABLE_SCRIPT_TYPES:
+            continue
+        content_hash = hashlib.sha1(str(js_content).encode('utf-8')).hexdigest()[:16]
+        shared_path = os.path.join(shared_dir, f"{content_hash}.js")
+        if not _is_repeated_block(shared_path, lesson_path):
+            continue
+        _write_shared_file(shared_path, str(js_content))
+        script_tag.string = ''
+        script_tag['src'] = os.path.relpath(shared_path, lesson_dir).replace("\\", "/")
+        shared_count += 1
+
+    if shared_count > 0:
+        logger.debug(f"Вынесено {shared_count} встроенных блоков в {shared_dir}")
+    return soup
 
 def download_js_and_update_html(base_url, html_content, lesson_file_path, root_js_dir, session):
     soup = BeautifulSoup(html_content, 'html.parser')
@@ -308,64 +580,7 @@ def download_js_and_update_html(base_url, html_content, lesson_file_path, root_j
             script.decompose()
             logger.info("Удален старый script с window.MathJax")
     
-    if soup.head:
-        config_script = soup.new_tag("script", type="text/x-mathjax-config")
-        config_script.string = """
-        MathJax.Hub.Config({
-            jax: ["input/TeX", "output/SVG"],
-            extensions: ["tex2jax.js"],
-            tex2jax: {
-                inlineMath: [['$','$'], ['\\(','\\)']],
-                displayMath: [['$$','$$'], ['\\[','\\]']],
-                processEscapes: true,
-                preview: "none"
-            },
-            SVG: {
-                scale: 100,
-                linebreaks: { automatic: true }
-            },
-            showProcessingMessages: false,
-            messageStyle: "none"
-        });
-        
-        // Удаляем preview блоки после рендеринга
-        MathJax.Hub.Queue(function () {
-            var previews = document.querySelectorAll('.MathJax_Preview');
-            for (var i = 0; i < previews.length; i++) {
-                previews[i].style.display = 'none';
-                previews[i].style.visibility = 'hidden';
-                previews[i].style.height = '0';
-                previews[i].style.width = '0';
-                previews[i].style.margin = '0';
-                previews[i].style.padding = '0';
-            }
-            
-            // Удаляем assistive элементы MathJax
-            var assistive = document.querySelectorAll('.MJX_Assistive_MathML, span[role="presentation"][class*="MJX"]');
-            for (var j = 0; j < assistive.length; j++) {
-                assistive[j].style.display = 'none';
-                assistive[j].style.visibility = 'hidden';
-                assistive[j].style.height = '0';
-                assistive[j].style.width = '0';
-                assistive[j].style.margin = '0';
-                assistive[j].style.padding = '0';
-            }
-            
-            // Удаляем пустые MathJax_SVG блоки с role="presentation"
-            var emptyMathJax = document.querySelectorAll('span.MathJax_SVG[role="presentation"]');
-            for (var k = 0; k < emptyMathJax.length; k++) {
-                emptyMathJax[k].style.display = 'none';
-                emptyMathJax[k].style.visibility = 'hidden';
-                emptyMathJax[k].style.height = '0';
-                emptyMathJax[k].style.width = '0';
-                emptyMathJax[k].style.margin = '0';
-                emptyMathJax[k].style.padding = '0';
-            }
-        });
-        """
-        soup.head.insert(0, config_script)
-        logger.info("Добавлена новая конфигурация MathJax с отключенным preview")
-    
+    pending_scripts = []  # (тег script, URL, локальный путь)
     for script in soup.find_all('script', src=True):
         src = script.get('src')
         if not src: continue
@@ -387,42 +602,42 @@ def download_js_and_update_html(base_url, html_content, lesson_file_path, root_j
             js_url = urljoin(base_url, src)
         
         js_filename = _generate_stable_filename(js_url, 'js')
-        local_js_path = os.path.join(root_js_dir, js_filename)
-        
-        if not os.path.exists(local_js_path):
-            logger.debug(f"Скачиваю JS: {js_url} -> {js_filename}")
-            if not download_file(js_url, local_js_path, session):
-                script.decompose()
-                continue
-        else:
-            logger.debug(f"JS файл уже существует: {js_filename}")
+        pending_scripts.append((script, js_url, os.path.join(root_js_dir, js_filename)))
+    
+    # Отсутствующие скрипты страницы скачиваются одновременно
+    saved_paths = download_assets([AssetJob(js_url, local_js_path, skip_existing=True) for _, js_url, local_js_path in pending_scripts], session)
+    for (script, js_url, local_js_path), saved_path in zip(pending_scripts, saved_paths):
+        if not saved_path:
+            script.decompose()
+            continue
         
         # Очищаем JS файл от ссылок на SkillFactory (как новый, так и существующий)
         try:
-            with open(local_js_path, 'r', encoding='utf-8') as f:
-                js_content = f.read()
-            
-            cleaned_js_content = _clean_js_content(js_content)
-            
-            # Сохраняем очищенный контент только если он изменился
-            if cleaned_js_content != js_content:
-                with open(local_js_path, 'w', encoding='utf-8') as f:
-                    f.write(cleaned_js_content)
-                logger.debug(f"JS файл очищен от ссылок на SkillFactory: {js_filename}")
+            _ensure_js_cleaned(local_js_path, root_js_dir)
         except Exception as e:
-            logger.warning(f"Не удалось очистить JS файл {js_filename}: {e}")
+            logger.warning(f"Не удалось очистить JS файл {os.path.basename(local_js_path)}: {e}")
         
         script['src'] = os.path.relpath(local_js_path, os.path.dirname(lesson_file_path)).replace("\\", "/")
     
+    # Добавляем конфигурацию MathJax после обработки внешних скриптов, чтобы она не была скачана как удаленный JS
+    if soup.head:
+        # Конфигурация MathJax вынесена в общий файл _assets/runtime, а не встраивается в каждую страницу
+        config_path = _ensure_runtime_file(os.path.dirname(root_js_dir), 'mathjax-config.js', _MATHJAX_CONFIG_JS)
+        config_script = soup.new_tag("script", src=os.path.relpath(config_path, os.path.dirname(lesson_file_path)).replace("\\", "/"))
+        soup.head.insert(0, config_script)
+        logger.info("Добавлена новая конфигурация MathJax с отключенным preview")
+    
     return str(soup)
 
-def download_images_and_documents(base_url, html_content, lesson_path, session):
+def download_images_and_documents(base_url, html_content, lesson_path, session, image_optimizer=None):
     soup = BeautifulSoup(html_content, 'html.parser')
     lesson_dir = os.path.dirname(lesson_path)
     images_dir = os.path.join(lesson_dir, "images")
     docs_dir = os.path.join(lesson_dir, "documents")
     os.makedirs(images_dir, exist_ok=True)
     os.makedirs(docs_dir, exist_ok=True)
+    saved_images = []  # (тег img, локальный путь) для последующей оптимизации
+    pending_images = []  # (тег img, URL, план скачивания)
     
     for img in soup.find_all('img', src=True):
         src = img.get('src', '')
@@ -438,7 +653,7 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
             else:
                 img_url = urljoin(base_url, src)
             
-            img_filename = None
+            plan = None
             
             # Специальная обработка для asset-v1 ссылок (может быть в пути URL)
             if 'asset-v1:' in img_url:
@@ -453,46 +668,25 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
                     clean_block_id = decoded_block_id.replace('+', '_').replace('@', '_')
                     img_filename = sanitize_filename(clean_block_id)
                     
-                    # Если нет расширения, добавляем .png по умолчанию
-                    if not any(img_filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg']):
-                        img_filename += '.png'
+                    has_extension = any(img_filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg'])
                     
                     logger.debug(f"Asset изображение: {decoded_block_id} -> {img_filename}")
                     
                     # Пробуем разные URL для скачивания
                     urls_to_try = [
                         img_url,  # Используем исходный URL
-                        f"https://apps.skillfactory.ru/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
-                        f"https://lms-cdn.skillfactory.ru/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
-                        f"https://lms.skillfactory.ru/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}"
+                        f"{APPS_URL}/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
+                        f"{LMS_CDN_URL}/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
+                        f"{LMS_URL}/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}"
                     ]
                     
-                    logger.info(f"Ищу рабочий URL для изображения {decoded_block_id}, пробую {len(urls_to_try)} вариантов")
-                    
-                    working_url = None
-                    for url_try in urls_to_try:
-                        try:
-                            logger.debug(f"Проверяю URL: {url_try}")
-                            res = session.head(url_try, timeout=10, allow_redirects=True)
-                            if res.status_code == 200:
-                                content_type = res.headers.get('content-type', '').lower()
-                                # Проверяем, что это действительно изображение, а не HTML страница
-                                if content_type.startswith('image/') or 'image' in content_type:
-                                    logger.info(f"Найден рабочий URL для asset изображения: {url_try}")
-                                    working_url = url_try
-                                    break
-                                else:
-                                    logger.debug(f"URL вернул неправильный Content-Type: {content_type}")
-                            else:
-                                logger.debug(f"URL вернул статус {res.status_code}")
-                        except requests.RequestException as e:
-                            logger.debug(f"Ошибка при проверке URL {url_try}: {e}")
-                            continue
+                    # Сразу скачиваем GET-запросом: тип определяется по ответу, без отдельного HEAD
+                    def build_asset_path(extension, base_filename=img_filename, fixed=has_extension):
+                        return os.path.join(images_dir, base_filename if fixed else f"{base_filename}.{extension}")
                     
-                    if working_url: 
-                        img_url = working_url
-                    else:
-                        logger.warning(f"Не найден рабочий URL для asset изображения: {decoded_block_id}")
+                    plan = [AssetJob(url_try, build_path=build_asset_path, allowed_extensions=_IMAGE_EXTENSIONS) for url_try in urls_to_try]
+                    # Последняя попытка - исходный URL без проверки типа (если нет расширения, .png по умолчанию)
+                    plan.append(AssetJob(img_url, os.path.join(images_dir, img_filename if has_extension else f"{img_filename}.png"), skip_existing=True))
                 else:
                     logger.warning(f"Не удалось извлечь данные из asset-v1 URL: {img_url}")
             else:
@@ -517,40 +711,26 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
                     is_cdn_hash_url or
                     (len(original_filename) > 30 and not any(char in original_filename for char in ['_', '-', ' ', '.']))):
                     
-                    # Пытаемся определить расширение из Content-Type
-                    try:
-                        head_response = session.head(img_url, timeout=10, allow_redirects=True)
-                        content_type = head_response.headers.get('content-type', '').lower()
-                        
-                        if 'image/png' in content_type:
-                            extension = 'png'
-                        elif 'image/jpeg' in content_type or 'image/jpg' in content_type:
-                            extension = 'jpg'
-                        elif 'image/gif' in content_type:
-                            extension = 'gif'
-                        elif 'image/webp' in content_type:
-                            extension = 'webp'
-                        elif 'image/svg' in content_type:
-                            extension = 'svg'
-                        else:
-                            extension = 'png'  # По умолчанию
-                            
-                    except Exception:
-                        # Если не удалось определить, пытаемся извлечь из оригинального имени
-                        if '.' in original_filename:
-                            extension = original_filename.split('.')[-1].lower()
-                            if extension not in ['png', 'jpg', 'jpeg', 'gif', 'webp', 'svg']:
-                                extension = 'png'
-                        else:
-                            extension = 'png'
+                    # Расширение по умолчанию берем из оригинального имени
+                    default_extension = 'png'
+                    if '.' in original_filename:
+                        original_extension = original_filename.split('.')[-1].lower()
+                        if original_extension in _IMAGE_EXTENSIONS:
+                            default_extension = original_extension
                     
-                    # Создаем читаемое имя на основе URL с хешем для уникальности
-                    img_filename = _generate_stable_filename(img_url, extension)
+                    # Скачиваем одним запросом: расширение определяется из Content-Type
+                    # или сигнатуры файла, имя строится на основе URL с хешем для уникальности
+                    plan = AssetJob(
+                        img_url,
+                        build_path=lambda extension, url=img_url: os.path.join(images_dir, _generate_stable_filename(url, extension)),
+                        allowed_extensions=_IMAGE_EXTENSIONS,
+                        default_extension=default_extension
+                    )
                     
                     if is_cdn_hash_url:
-                        logger.debug(f"CDN изображение с хешированным именем: {img_url[:50]}... -> {img_filename}")
+                        logger.debug(f"CDN изображение с хешированным именем: {img_url[:50]}...")
                     else:
-                        logger.debug(f"Длинное имя изображения заменено: {original_filename[:30]}... -> {img_filename}")
+                        logger.debug(f"Длинное имя изображения будет заменено: {original_filename[:30]}...")
                 else:
                     # Имя файла нормальное, используем как есть
                     img_filename = original_filename
@@ -558,26 +738,21 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
                     # Добавляем расширение если его нет
                     if not any(img_filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg']):
                         img_filename += '.png'
+                    
+                    # Файлы пишутся атомарно, поэтому уже существующее изображение скачано целиком
+                    plan = AssetJob(img_url, os.path.join(images_dir, img_filename), skip_existing=True)
             
-            if not img_filename: 
+            if not plan: 
                 logger.warning(f"Не удалось определить имя файла для изображения: {src}")
                 continue
             
-            local_img_path = os.path.join(images_dir, img_filename)
-            
-            # Скачиваем изображение
-            if download_file(img_url, local_img_path, session):
-                # Обновляем src на относительный путь с корректным именем файла
-                relative_path = os.path.relpath(local_img_path, lesson_dir).replace(os.sep, '/')
-                img['src'] = relative_path
-                logger.debug(f"Изображение сохранено: {img_filename}")
-            else:
-                logger.warning(f"Не удалось скачать изображение: {img_url}")
+            pending_images.append((img, img_url, plan))
                 
         except Exception as e:
             logger.error(f"Ошибка при обработке изображения {src}: {e}")
     
     # Обработка документов
+    pending_documents = []  # (тег a, URL, план скачивания)
     doc_exts = ['.pdf', '.zip', '.rar', '.docx', '.xlsx', '.pptx']
     for a in soup.find_all('a', href=True):
         href = a.get('href')
@@ -592,6 +767,7 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
                     doc_url = urljoin(base_url, href)
                 
                 doc_filename = None
+                plan = None
                 
                 # Специальная обработка для asset-v1 ссылок документов
                 if 'asset-v1:' in doc_url:
@@ -604,26 +780,14 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
                         clean_block_id = decoded_block_id.replace('+', '_').replace('@', '_')
                         doc_filename = sanitize_filename(clean_block_id)
                         
-                        # Если нет расширения, пытаемся определить его
+                        # Если нет расширения, определяем его по ответу сервера при скачивании
                         if not any(doc_filename.lower().endswith(ext) for ext in doc_exts):
-                            # Пробуем определить тип по запросу HEAD
-                            try:
-                                head_response = session.head(doc_url, timeout=10)
-                                content_type = head_response.headers.get('content-type', '').lower()
-                                if 'pdf' in content_type:
-                                    doc_filename += '.pdf'
-                                elif 'word' in content_type or 'document' in content_type:
-                                    doc_filename += '.docx'
-                                elif 'powerpoint' in content_type or 'presentation' in content_type:
-                                    doc_filename += '.pptx'
-                                elif 'excel' in content_type or 'spreadsheet' in content_type:
-                                    doc_filename += '.xlsx'
-                                elif 'zip' in content_type:
-                                    doc_filename += '.zip'
-                                else:
-                                    doc_filename += '.pdf'  # По умолчанию PDF
-                            except:
-                                doc_filename += '.pdf'  # По умолчанию PDF
+                            plan = AssetJob(
+                                doc_url,
+                                build_path=lambda extension, base_filename=doc_filename: os.path.join(docs_dir, f"{base_filename}.{extension}"),
+                                allowed_extensions=[ext.lstrip('.') for ext in doc_exts],
+                                default_extension='pdf'  # По умолчанию PDF
+                            )
                 else:
                     # Обычный документ
                     doc_filename = sanitize_filename(os.path.basename(unquote(urlparse(doc_url).path)))
@@ -631,17 +795,49 @@ def download_images_and_documents(base_url, html_content, lesson_path, session):
                 if not doc_filename: 
                     continue
                 
-                local_doc_path = os.path.join(docs_dir, doc_filename)
-                
-                if download_file(doc_url, local_doc_path, session):
-                    # Обновляем href на относительный путь
-                    relative_path = os.path.relpath(local_doc_path, lesson_dir).replace(os.sep, '/')
-                    a['href'] = relative_path
-                    logger.debug(f"Документ сохранен: {doc_filename}")
+                # Документы и архивы бывают большими: при обрыве загрузка продолжается с места остановки
+                pending_documents.append((a, doc_url, plan or AssetJob(doc_url, os.path.join(docs_dir, doc_filename), resumable=True)))
                     
             except Exception as e:
                 logger.error(f"Ошибка при обработке документа {href}: {e}")
     
+    # Изображения и документы страницы скачиваются одновременно
+    saved_paths = download_assets([plan for _, _, plan in pending_images + pending_documents], session)
+    
+    for (img, img_url, _), local_img_path in zip(pending_images, saved_paths):
+        if local_img_path:
+            # Обновляем src на относительный путь с корректным именем файла
+            relative_path = os.path.relpath(local_img_path, lesson_dir).replace(os.sep, '/')
+            img['src'] = relative_path
+            saved_images.append((img, local_img_path))
+            logger.debug(f"Изображение сохранено: {os.path.basename(local_img_path)}")
+        else:
+            logger.warning(f"Не удалось скачать изображение: {img_url}")
+    
+    # Необязательная оптимизация изображений (--optimize-images) сразу для всей страницы
+    if image_optimizer and saved_images:
+        try:
+            optimized = image_optimizer.optimize([path for _, path in saved_images])
+            for img, local_img_path in saved_images:
+                result = optimized.get(local_img_path)
+                if not result:
+                    continue
+                if result['path'] != local_img_path:
+                    img['src'] = os.path.relpath(result['path'], lesson_dir).replace(os.sep, '/')
+                # Размеры задаем, только если автор не указал их сам
+                if not img.get('width') and not img.get('height'):
+                    img['width'] = str(result['width'])
+                    img['height'] = str(result['height'])
+        except Exception as e:
+            logger.warning(f"Не удалось оптимизировать изображения: {e}")
+    
+    for (a, doc_url, _), local_doc_path in zip(pending_documents, saved_paths[len(pending_images):]):
+        if local_doc_path:
+            # Обновляем href на относительный путь
+            relative_path = os.path.relpath(local_doc_path, lesson_dir).replace(os.sep, '/')
+            a['href'] = relative_path
+            logger.debug(f"Документ сохранен: {os.path.basename(local_doc_path)}")
+    
     return str(soup) 
 
 def download_notebooks_and_update_html(base_url, html_content, lesson_path, session):
@@ -658,6 +854,7 @@ def download_notebooks_and_update_html(base_url, html_content, lesson_path, sess
     
     all_links = soup.find_all('a', href=True)
     notebooks_processed = 0
+    pending_notebooks = []  # (тег a, URL, имя файла)
     
     for link in all_links:
         href = link.get('href')
@@ -697,9 +894,9 @@ def download_notebooks_and_update_html(base_url, html_content, lesson_path, sess
                         # Пробуем разные URL для скачивания
                         urls_to_try = [
                             notebook_url,  # Исходный URL
-                            f"https://apps.skillfactory.ru/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
-                            f"https://lms-cdn.skillfactory.ru/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
-                            f"https://lms.skillfactory.ru/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}"
+                            f"{APPS_URL}/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
+                            f"{LMS_CDN_URL}/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}",
+                            f"{LMS_URL}/asset-v1:{org}+{course}+{run}+type@asset+block@{quote(block_id)}"
                         ]
                         
                         logger.info(f"Ищу рабочий URL для ноутбука {decoded_block_id}")
@@ -807,39 +1004,38 @@ Google Colab ноутбуки требуют интернет-соединени
                     
                 logger.info(f"Найдена кнопка скачивания ноутбука: {link.get_text(strip=True)}")
             
-            # Если это ноутбук, скачиваем его
+            # Если это ноутбук, скачиваем его вместе с остальными ноутбуками страницы
             if is_notebook and notebook_url and notebook_filename:
                 notebooks_processed += 1
                 logger.info(f"Обрабатываю ноутбук #{notebooks_processed}: {notebook_filename}")
-                
-                local_notebook_path = os.path.join(notebooks_dir, notebook_filename)
-                
-                # Проверяем, существует ли уже файл
-                if os.path.exists(local_notebook_path):
-                    logger.debug(f"Ноутбук уже существует: {notebook_filename}")
-                else:
-                    # Скачиваем ноутбук
-                    logger.info(f"Скачиваю ноутбук: {notebook_url}")
-                    if not download_file(notebook_url, local_notebook_path, session):
-                        logger.warning(f"Не удалось скачать ноутбук: {notebook_url}")
-                        continue
-                
-                # Обновляем ссылку на локальный файл
-                relative_path = os.path.relpath(local_notebook_path, lesson_dir).replace(os.sep, '/')
-                old_href = link['href']
-                link['href'] = relative_path
-                
-                # Убеждаемся, что download атрибут указывает на правильное имя файла
-                link['download'] = notebook_filename
-                
-                # Добавляем информацию в title
-                link['title'] = f"Jupyter Notebook: {notebook_filename}"
-                
-                logger.info(f"✔ Ноутбук скачан и ссылка обновлена: {old_href} -> {relative_path}")
+                pending_notebooks.append((link, notebook_url, notebook_filename))
                 
         except Exception as e:
             logger.error(f"Ошибка при обработке ноутбука {href}: {e}")
     
+    # Уже существующие ноутбуки не скачиваются повторно
+    saved_paths = download_assets([
+        AssetJob(notebook_url, os.path.join(notebooks_dir, notebook_filename), skip_existing=True)
+        for _, notebook_url, notebook_filename in pending_notebooks
+    ], session)
+    for (link, notebook_url, notebook_filename), local_notebook_path in zip(pending_notebooks, saved_paths):
+        if not local_notebook_path:
+            logger.warning(f"Не удалось скачать ноутбук: {notebook_url}")
+            continue
+        
+        # Обновляем ссылку на локальный файл
+        relative_path = os.path.relpath(local_notebook_path, lesson_dir).replace(os.sep, '/')
+        old_href = link['href']
+        link['href'] = relative_path
+        
+        # Убеждаемся, что download атрибут указывает на правильное имя файла
+        link['download'] = notebook_filename
+        
+        # Добавляем информацию в title
+        link['title'] = f"Jupyter Notebook: {notebook_filename}"
+        
+        logger.info(f"✔ Ноутбук скачан и ссылка обновлена: {old_href} -> {relative_path}")
+    
     if notebooks_processed > 0:
         logger.info(f"✔ Обработано {notebooks_processed} ноутбуков")
     else:
@@ -850,44 +1046,77 @@ Google Colab ноутбуки требуют интернет-соединени
 def _embed_local_video(html_content, relative_video_path):
     """Старая функция для замены одного видео - оставлена для совместимости"""
     soup = BeautifulSoup(html_content, 'html.parser')
-    iframe_tag = soup.find('iframe', src=re.compile(r'kinescope\.io/embed'))
+    iframe_tag = soup.find('iframe', src=KINESCOPE_EMBED_RE)
     if iframe_tag:
         video_tag = soup.new_tag("video", controls=True, width="100%", preload="metadata")
         video_tag['src'] = relative_video_path.replace(os.sep, "/")
         iframe_tag.replace_with(video_tag)
     return str(soup)
 
-def process_and_save_html(html_content, block_data, parent_block, all_blocks, lesson_path, base_url, session, downloaded_videos=None, relative_video_path=None, output_dir=None):
+def get_assets_dir(output_dir, output_options=None):
+    """Папка общих ресурсов: _assets курса или общее хранилище пакетного режима"""
+    return (output_options or {}).get('assets_dir') or os.path.join(output_dir, '_assets')
+
+def _get_image_optimizer(assets_dir, output_options):
+    """Возвращает общий для всего запуска оптимизатор изображений или None, если этап выключен"""
+    if not output_options.get('optimize_images'):
+        return None
+    with _image_optimizers_lock:
+        image_optimizer = _image_optimizers.get(assets_dir)
+        if image_optimizer is None:
+            image_optimizer = ImageOptimizer(
+                assets_dir,
+                max_dimension=output_options.get('max_image_dimension', IMAGE_MAX_DIMENSION),
+                convert_to_webp=output_options.get('webp', False)
+            )
+            _image_optimizers[assets_dir] = image_optimizer
+        return image_optimizer
+
+def close_image_optimizers():
+    """Останавливает пулы процессов оптимизации изображений"""
+    with _image_optimizers_lock:
+        for image_optimizer in _image_optimizers.values():
+            image_optimizer.close()
+        _image_optimizers.clear()
+
+def process_and_save_html(html_content, block_data, parent_block, all_blocks, lesson_path, base_url, session, downloaded_videos=None, relative_video_path=None, output_dir=None, output_options=None):
+    output_options = output_options or {}
+    metrics.switch_stage('html_clean')
     # Поддерживаем оба варианта для обратной совместимости
     if downloaded_videos:
         html_content = _embed_local_videos(html_content, downloaded_videos)
     elif relative_video_path:
         html_content = _embed_local_video(html_content, relative_video_path)
     html_content = _clean_html(html_content)
-    assets_dir = os.path.join(output_dir, '_assets')
+    assets_dir = get_assets_dir(output_dir, output_options)
     css_dir = os.path.join(assets_dir, 'css')
     js_dir = os.path.join(assets_dir, 'js')
+    metrics.switch_stage('css')
     html_content = download_css_and_update_html(base_url, html_content, lesson_path, css_dir, session)
+    metrics.switch_stage('js')
     html_content = download_js_and_update_html(base_url, html_content, lesson_path, js_dir, session)
-    html_content = download_images_and_documents(base_url, html_content, lesson_path, session)
+    metrics.switch_stage('images')
+    html_content = download_images_and_documents(base_url, html_content, lesson_path, session, _get_image_optimizer(assets_dir, output_options))
+    metrics.switch_stage('notebooks')
     html_content = download_notebooks_and_update_html(base_url, html_content, lesson_path, session)
+    metrics.switch_stage('html_finalize')
     soup = BeautifulSoup(html_content, 'html.parser')
     
     final_soup = _rewire_navigation_links(soup, block_data.get('id'), parent_block, all_blocks)
 
-    # Оставляем только простое правило для скрытия спиннеров и MathJax preview
+    # Оставляем только простое правило для скрытия спиннеров и MathJax preview (общий файл)
     if final_soup.head:
-        hide_spinner_style = final_soup.new_tag('style')
-        hide_spinner_style.string = """
-        .xblock-student_view-loading, .spinner-border { display: none !important; }
-        .MathJax_Preview { display: none !important; visibility: hidden !important; height: 0 !important; width: 0 !important; margin: 0 !important; padding: 0 !important; }
-        span[class*="MathJax_Preview"] { display: none !important; }
-        .MJX_Assistive_MathML { display: none !important; visibility: hidden !important; height: 0 !important; width: 0 !important; margin: 0 !important; padding: 0 !important; }
-        span[role="presentation"][class*="MJX"] { display: none !important; }
-        span.MathJax_SVG[role="presentation"] { display: none !important; }
-        .MathJax_SVG { display: inline-block !important; }
-        """
-        final_soup.head.append(hide_spinner_style)
+        runtime_css_path = _ensure_runtime_file(assets_dir, 'offline.css', _OFFLINE_RUNTIME_CSS)
+        hide_spinner_link = final_soup.new_tag('link', rel='stylesheet', href=os.path.relpath(runtime_css_path, os.path.dirname(lesson_path)).replace("\\", "/"))
+        final_soup.head.append(hide_spinner_link)
+    
+    # Одинаковые встроенные стили и скрипты выносим в общие файлы
+    _share_inline_assets(final_soup, lesson_path, assets_dir)
+    
+    # Необязательная минификация HTML (--minify)
+    if output_options.get('minify'):
+        minify_html(final_soup)
     
     with open(lesson_path, 'w', encoding='utf-8') as f:
-        f.write(str(final_soup)) 
\ No newline at end of file
+        f.write(str(final_soup))
+    metrics.switch_stage(None) 
\ No newline at end of file
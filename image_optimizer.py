@@ -0,0 +1,193 @@
+# image_optimizer.py
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import ExifTags, Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+_IMAGE_MANIFEST_FILENAME = '.image_manifest.json'
+
+# Форматы, которые перекодируются; остальные (GIF, SVG, ICO) только измеряются
+_RECOMPRESSIBLE_FORMATS = {'PNG', 'JPEG'}
+
+
+def _file_sha1(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _optimize_image_file(file_path, max_dimension, convert_to_webp):
+    """
+    Оптимизирует одно изображение (выполняется в отдельном процессе).
+    Уменьшает его до max_dimension по большей стороне, пересжимает PNG/JPEG
+    и при необходимости конвертирует в WebP.
+    Возвращает словарь с итоговым путем, размерами и сэкономленными байтами или None.
+    """
+    try:
+        original_size = os.path.getsize(file_path)
+        with Image.open(file_path) as image:
+            image_format = image.format
+            if image_format not in _RECOMPRESSIBLE_FORMATS:
+                return {'path': file_path, 'width': image.width, 'height': image.height, 'saved_bytes': 0}
+
+            image.load()
+            icc_profile = image.info.get('icc_profile')
+            # Поворот из EXIF применяется к пикселям: после пересохранения без EXIF фото не должно лечь на бок
+            changed = image.getexif().get(ExifTags.Base.Orientation, 1) != 1
+            image = ImageOps.exif_transpose(image)
+            if max_dimension and max(image.size) > max_dimension:
+                image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+                changed = True
+
+            base_path, extension = os.path.splitext(file_path)
+            if convert_to_webp:
+                output_path = f"{base_path}.webp"
+                save_kwargs = {'format': 'WEBP', 'lossless': image_format == 'PNG', 'quality': 85, 'method': 6}
+            elif image_format == 'PNG':
+                output_path = file_path
+                save_kwargs = {'format': 'PNG', 'optimize': True}
+            else:
+                output_path = file_path
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                save_kwargs = {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True}
+
+            if icc_profile:
+                save_kwargs['icc_profile'] = icc_profile
+            temp_path = f"{output_path}.tmp"
+            image.save(temp_path, **save_kwargs)
+            width, height = image.size
+
+        # Оставляем оригинал, если результат не меньше, а изображение не уменьшалось и не поворачивалось
+        if os.path.getsize(temp_path) >= original_size and not changed:
+            os.remove(temp_path)
+            with Image.open(file_path) as image:
+                return {'path': file_path, 'width': image.width, 'height': image.height, 'saved_bytes': 0}
+
+        saved_bytes = original_size - os.path.getsize(temp_path)
+        os.replace(temp_path, output_path)
+        if output_path != file_path:
+            os.remove(file_path)
+        return {'path': output_path, 'width': width, 'height': height, 'saved_bytes': saved_bytes}
+    except Exception as e:
+        logger.debug(f"Не удалось оптимизировать изображение {file_path}: {e}")
+        return None
+
+
+class ImageOptimizer:
+    """
+    Оптимизирует скачанные изображения в пуле процессов.
+    Результаты запоминаются в манифесте по хешу содержимого: уже оптимизированные
+    файлы не обрабатываются повторно, а одинаковые изображения копируются из готового результата.
+    """
+
+    def __init__(self, assets_dir, max_dimension=1920, convert_to_webp=False, max_workers=None):
+        self.assets_dir = assets_dir
+        self.max_dimension = max_dimension
+        self.convert_to_webp = convert_to_webp
+        self.manifest_path = os.path.join(assets_dir, _IMAGE_MANIFEST_FILENAME)
+        self.manifest = self._load_manifest()
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def _load_manifest(self):
+        """Загружает манифест: SHA-1 исходного или итогового файла -> результат"""
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить манифест изображений: {e}")
+        return {}
+
+    def _save_manifest(self):
+        try:
+            os.makedirs(self.assets_dir, exist_ok=True)
+            with open(self.manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить манифест изображений: {e}")
+
+    def _settings(self):
+        """Настройки, от которых зависит результат (хранятся в записи манифеста)"""
+        return [self.max_dimension, self.convert_to_webp]
+
+    def _reuse_result(self, file_path, entry, content_hash):
+        """Применяет ранее полученный результат к файлу с тем же содержимым"""
+        # Результат запуска с другими --max-image-dimension или --webp не подходит
+        if entry.get('settings') != self._settings():
+            return None
+        base_path = os.path.splitext(file_path)[0]
+        output_path = f"{base_path}.{entry['ext']}" if entry['ext'] else file_path
+        if entry.get('optimized_path') == os.path.relpath(file_path, self.assets_dir).replace("\\", "/"):
+            # Результат был записан на место этого файла: он годится, только если файл с тех пор не заменили
+            if content_hash != entry['output_sha1']:
+                return None
+        else:
+            source_path = entry.get('optimized_path') and os.path.normpath(os.path.join(self.assets_dir, entry['optimized_path']))
+            if not source_path or not os.path.exists(source_path) or _file_sha1(source_path) != entry['output_sha1']:
+                return None
+            if source_path != output_path:
+                shutil.copyfile(source_path, output_path)
+            if output_path != file_path:
+                os.remove(file_path)
+        return {'path': output_path, 'width': entry['width'], 'height': entry['height'], 'saved_bytes': 0}
+
+    def optimize(self, file_paths):
+        """
+        Оптимизирует набор изображений параллельно.
+        Возвращает словарь: исходный путь -> {'path', 'width', 'height'}.
+        """
+        results = {}
+        pending = {}  # путь -> SHA-1 исходного содержимого
+        for file_path in dict.fromkeys(file_paths):
+            if not os.path.exists(file_path):
+                continue
+            content_hash = _file_sha1(file_path)
+            with self._lock:
+                entry = self.manifest.get(content_hash)
+            if entry:
+                reused = self._reuse_result(file_path, entry, content_hash)
+                if reused:
+                    results[file_path] = reused
+                    continue
+            pending[file_path] = content_hash
+
+        if pending:
+            futures = {
+                file_path: self._executor.submit(_optimize_image_file, file_path, self.max_dimension, self.convert_to_webp)
+                for file_path in pending
+            }
+            saved_bytes = 0
+            with self._lock:
+                for file_path, future in futures.items():
+                    result = future.result()
+                    if not result:
+                        continue
+                    results[file_path] = result
+                    saved_bytes += result['saved_bytes']
+                    entry = {
+                        'ext': os.path.splitext(result['path'])[1].lstrip('.'),
+                        'width': result['width'],
+                        'height': result['height'],
+                        'optimized_path': os.path.relpath(result['path'], self.assets_dir).replace("\\", "/"),
+                        'output_sha1': _file_sha1(result['path']),
+                        'settings': self._settings()
+                    }
+                    # Запоминаем результат и по исходному, и по итоговому содержимому
+                    self.manifest[pending[file_path]] = entry
+                    self.manifest[entry['output_sha1']] = entry
+                self._save_manifest()
+            if saved_bytes > 0:
+                logger.debug(f"Оптимизировано {len(futures)} изображений, сэкономлено {saved_bytes / 1024:.0f} КБ")
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -4,7 +4,6 @@ import argparse
 import logging
 import os
 import sys
-import json
 import time
 from getpass import getpass
 
@@ -16,12 +15,18 @@ from urllib.parse import urlparse
 
 # Импорты из наших модулей
 from api import get_course_structure, get_enrolled_courses_data
-from auth import login_to_skillfactory
-from downloader import download_course_content
+from auth import login_to_skillfactory, restore_session, save_session
+from session_keeper import SessionKeeper
+from downloader import download_course_content, download_courses_batch
 from navigation import (
     find_root_block, choose_course_from_list,
     build_navigation_tree, interactive_navigate
 )
+from config import IMAGE_MAX_DIMENSION, BATCH_PARALLEL_COURSES, SESSION_FILE, LMS_URL
+from course_sync import plan_course_sync, log_sync_plan, remove_stale_files
+from structure_cache import read_cache_info, load_structure_cache, save_structure_cache
+import tracing
+from request_stats import log_request_report
 
 # Настройка логирования
 logging.basicConfig(
@@ -35,6 +40,118 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def prepare_course(session, args, course_url, course_name_for_dir="", ask_cache=True):
+    """
+    Загружает структуру курса (из кэша или с сервера) и при --sync определяет измененные страницы.
+    Возвращает словарь с course_structure, output_dir, course_name и refresh_ids или None.
+    """
+    # Определяем имя папки и путь к кэшу
+    course_structure = None
+    output_dir = args.output
+    if course_name_for_dir:
+        output_dir = os.path.join(args.output, sanitize_filename(course_name_for_dir))
+    
+    os.makedirs(output_dir, exist_ok=True)
+    
+    use_cache = False
+    # В режиме синхронизации кэш используется только для сравнения со свежей структурой
+    previous_structure = None
+    cache_info = read_cache_info(output_dir)
+    if cache_info and ask_cache and not args.force_overwrite and not args.sync:
+        cache_age_hours = (time.time() - cache_info['saved_at']) / 3600
+        choice = input(f"Найден кэш для курса '{course_name_for_dir}' (сохранен {cache_age_hours:.0f} ч назад). Использовать его? (y/n): ").lower()
+        if choice in ['y', 'yes']:
+            logger.info("Используется кэшированная структура курса.")
+            course_structure = load_structure_cache(output_dir)
+            use_cache = course_structure is not None
+
+    if not use_cache:
+        logger.info("Получение новой структуры курса с сервера...")
+        course_structure = get_course_structure(session, course_url)
+        if not course_structure:
+            logger.error("Не удалось получить структуру курса.")
+            return None
+        if not args.no_saved_session:
+            # Запоминаем инициализацию курса, чтобы следующий запуск не загружал страницу курса
+            save_session(session, args.session_file)
+        
+        # Если имя курса не было известно (при запуске по URL), извлекаем его сейчас
+        if not course_name_for_dir:
+             course_name_for_dir = course_structure.get('name', 'unknown_course')
+             output_dir = os.path.join(args.output, sanitize_filename(course_name_for_dir))
+             os.makedirs(output_dir, exist_ok=True)
+
+        if args.sync:
+            try:
+                # Читаем кэш целиком (без mmap), так как он сразу будет перезаписан
+                previous_structure = load_structure_cache(output_dir, lazy=False)
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать кэш структуры для синхронизации: {e}")
+
+        try:
+            save_structure_cache(output_dir, course_structure)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш структуры курса: {e}")
+
+    refresh_ids = None
+    if args.sync:
+        if previous_structure:
+            sync_plan = plan_course_sync(previous_structure, course_structure)
+            log_sync_plan(sync_plan)
+            remove_stale_files(output_dir, sync_plan['stale_paths'])
+            refresh_ids = sync_plan['refresh_ids']
+        else:
+            logger.info("Кэш структуры не найден, синхронизация выполняется как обычное скачивание.")
+
+    return {
+        'course_structure': course_structure,
+        'output_dir': output_dir,
+        'course_name': course_name_for_dir,
+        'refresh_ids': refresh_ids
+    }
+
+
+def run_batch(session, args, output_options):
+    """Пакетный режим: скачивает все курсы пользователя (или отобранные --course-filter) за один запуск"""
+    courses = get_enrolled_courses_data(session)
+    if not courses:
+        logger.critical("Не удалось получить список курсов. Завершение работы.")
+        sys.exit(1)
+
+    if args.course_filter:
+        filters = [course_filter.lower() for course_filter in args.course_filter]
+        courses = [
+            course for course in courses
+            if any(course_filter in f"{course.get('name', '')} {course.get('id', '')}".lower() for course_filter in filters)
+        ]
+    logger.info(f"Пакетный режим: курсов к скачиванию - {len(courses)}")
+
+    # Структуры курсов получаем последовательно: запросы к API меняют заголовки общей сессии
+    course_jobs = []
+    for course in courses:
+        course_url = f"{LMS_URL}/courses/{course['id']}/"
+        prepared = prepare_course(session, args, course_url, course.get('name', ''), ask_cache=False)
+        if not prepared:
+            logger.warning(f"Пропускаю курс '{course.get('name', course['id'])}': не удалось получить структуру.")
+            continue
+        root_id, all_blocks = find_root_block(prepared['course_structure'])
+        if not root_id:
+            logger.warning(f"Пропускаю курс '{prepared['course_name']}': не найден корневой элемент.")
+            continue
+        course_jobs.append({
+            'root_id': root_id,
+            'all_blocks': all_blocks,
+            'output_dir': prepared['output_dir'],
+            'course_name': prepared['course_name'],
+            'refresh_ids': prepared['refresh_ids']
+        })
+
+    download_courses_batch(
+        course_jobs, session, args.no_videos, args.force_overwrite,
+        output_options=output_options, parallel_courses=args.parallel_courses
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description="Скачивает курсы с SkillFactory.")
     parser.add_argument('-u', '--username', help="Ваш email от SkillFactory.")
@@ -44,21 +161,63 @@ def main():
     parser.add_argument('--no-videos', action='store_true', help="Не скачивать видео.")
     parser.add_argument('--force-overwrite', action='store_true', help="Принудительно перезаписать существующие файлы.")
     parser.add_argument('--interactive', action='store_true', help="Запустить в интерактивном режиме для выбора курса.")
+    parser.add_argument('--all-courses', action='store_true', help="Пакетный режим: скачать все курсы пользователя за один запуск.")
+    parser.add_argument('--course-filter', action='append', help="В пакетном режиме скачивать только курсы, в названии или ID которых есть эта строка (можно указать несколько раз).")
+    parser.add_argument('--parallel-courses', type=int, default=BATCH_PARALLEL_COURSES, help=f"Сколько курсов скачивать одновременно в пакетном режиме (по умолчанию {BATCH_PARALLEL_COURSES}).")
+    parser.add_argument('--sync', action='store_true', help="Обновить ранее скачанный курс: скачать заново только измененные страницы.")
+    parser.add_argument('--minify', action='store_true', help="Минифицировать сохраненные HTML, CSS и JS файлы.")
+    parser.add_argument('--optimize-images', action='store_true', help="Пересжимать скачанные изображения и уменьшать слишком большие.")
+    parser.add_argument('--webp', action='store_true', help="При оптимизации конвертировать PNG/JPEG в WebP.")
+    parser.add_argument('--max-image-dimension', type=int, default=IMAGE_MAX_DIMENSION, help=f"Максимальный размер изображения по большей стороне в пикселях (по умолчанию {IMAGE_MAX_DIMENSION}).")
+    parser.add_argument('--session-file', default=SESSION_FILE, help=f"Файл для сохранения сессии между запусками (по умолчанию {SESSION_FILE}).")
+    parser.add_argument('--no-saved-session', action='store_true', help="Не использовать и не сохранять сессию: всегда выполнять вход.")
+    parser.add_argument('--trace', metavar='FILE', help="Записать трассу этапов и HTTP запросов в формате Chrome Trace (chrome://tracing, ui.perfetto.dev).")
 
     args = parser.parse_args()
+    if args.trace:
+        tracing.start(args.trace)
 
-    # Шаг 1: Логин
-    username = args.username or input("Введите email от SkillFactory: ")
-    password = args.password or getpass("Введите пароль: ")
-
-    session = login_to_skillfactory(username, password)
+    # Шаг 1: Логин (сохраненная сессия проверяется одним запросом, вход - только если она истекла)
+    session = None
+    username, password = args.username, args.password
+    if not args.no_saved_session:
+        session = restore_session(args.session_file, args.username)
     if not session:
-        logger.critical("Не удалось авторизоваться. Завершение работы.")
-        sys.exit(1)
+        username = args.username or input("Введите email от SkillFactory: ")
+        password = args.password or getpass("Введите пароль: ")
 
-    # Шаг 2: Получение структуры курса
-    course_structure = None
-    output_dir = args.output
+        session = login_to_skillfactory(username, password)
+        if not session:
+            logger.critical("Не удалось авторизоваться. Завершение работы.")
+            sys.exit(1)
+        if not args.no_saved_session:
+            save_session(session, args.session_file)
+
+    # Фоновое обновление JWT и сессии во время долгого скачивания
+    session_keeper = SessionKeeper(session, username, password, None if args.no_saved_session else args.session_file)
+    session_keeper.start()
+
+    # Шаг 2: Параметры обработки
+    output_options = {
+        'minify': args.minify,
+        'optimize_images': args.optimize_images or args.webp,
+        'webp': args.webp,
+        'max_image_dimension': args.max_image_dimension,
+        # Корень папки скачивания: здесь хранится реестр файлов прогресса всех курсов
+        'output_root': args.output
+    }
+
+    if args.all_courses:
+        # Общее хранилище ресурсов для всех курсов пакета
+        output_options['assets_dir'] = os.path.join(args.output, '_assets')
+        run_batch(session, args, output_options)
+        session_keeper.stop()
+        log_request_report()
+        tracing.stop()
+        logger.info("Работа скрипта завершена.")
+        return
+
+    # Шаг 3: Получение структуры курса
     course_name_for_dir = ""
 
     if not args.course_url:
@@ -73,49 +232,21 @@ def main():
             logger.info("Курс не выбран. Выход.")
             sys.exit(0)
         
-        course_url = f"https://lms.skillfactory.ru/courses/{chosen_course['id']}/"
+        course_url = f"{LMS_URL}/courses/{chosen_course['id']}/"
         course_name_for_dir = chosen_course['name']
     else:
         # Прямое указание URL
         course_url = args.course_url
 
-    # Определяем имя папки и путь к кэшу
-    if course_name_for_dir:
-        output_dir = os.path.join(args.output, sanitize_filename(course_name_for_dir))
-    
-    os.makedirs(output_dir, exist_ok=True)
-    cache_path = os.path.join(output_dir, 'course_structure.json')
-    
-    use_cache = False
-    if os.path.exists(cache_path) and not args.force_overwrite:
-        choice = input(f"Найден кэш для курса '{course_name_for_dir}'. Использовать его? (y/n): ").lower()
-        if choice in ['y', 'yes']:
-            logger.info("Используется кэшированная структура курса.")
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                course_structure = json.load(f)
-            use_cache = True
-
-    if not use_cache:
-        logger.info("Получение новой структуры курса с сервера...")
-        course_structure = get_course_structure(session, course_url)
-        if not course_structure:
-            logger.error("Не удалось получить структуру курса.")
-            sys.exit(1)
-        
-        # Если имя курса не было известно (при запуске по URL), извлекаем его сейчас
-        if not course_name_for_dir:
-             course_name_for_dir = course_structure.get('name', 'unknown_course')
-             output_dir = os.path.join(args.output, sanitize_filename(course_name_for_dir))
-             os.makedirs(output_dir, exist_ok=True)
-             # Переопределяем cache_path, если имя папки изменилось
-             cache_path = os.path.join(output_dir, 'course_structure.json')
-
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(course_structure, f, ensure_ascii=False, indent=4)
-        logger.info(f"Структура курса сохранена в кэш: {cache_path}")
-
+    prepared = prepare_course(session, args, course_url, course_name_for_dir)
+    if not prepared:
+        sys.exit(1)
+    course_structure = prepared['course_structure']
+    output_dir = prepared['output_dir']
+    course_name_for_dir = prepared['course_name']
+    refresh_ids = prepared['refresh_ids']
 
-    # Шаг 3: Обработка и скачивание
+    # Шаг 4: Скачивание
     root_id, all_blocks = find_root_block(course_structure)
     if not root_id:
         logger.error("Не удалось найти корневой элемент курса.")
@@ -129,15 +260,19 @@ def main():
             sys.exit(1)
         interactive_navigate(
             course_tree, all_blocks, session, output_dir, 
-            args.no_videos, args.force_overwrite
+            args.no_videos, args.force_overwrite, output_options, refresh_ids
         )
     else:
         logger.info("Запуск в режиме автоматического скачивания всего курса...")
         download_course_content(
             root_id, all_blocks, session, output_dir,
-            args.no_videos, args.force_overwrite, course_name_for_dir
+            args.no_videos, args.force_overwrite, course_name_for_dir,
+            output_options=output_options, refresh_ids=refresh_ids
         )
 
+    session_keeper.stop()
+    log_request_report()
+    tracing.stop()
     logger.info("Работа скрипта завершена.")
 
 
@@ -0,0 +1,198 @@
+# metrics.py
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import METRICS_THROUGHPUT_INTERVAL
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки страницы в порядке выполнения (для вывода статистики)
+STAGES = (
+    'navigate', 'wait_ready', 'video_download', 'video_mux', 'capture',
+    'html_clean', 'css', 'js', 'images', 'notebooks', 'html_finalize'
+)
+
+_current = threading.local()
+
+
+class BlockMetrics:
+    """
+    Время и объем скачанных данных по этапам обработки одной страницы.
+    Байты засчитываются этапу, который был открыт, когда началась загрузка,
+    в том числе если файл скачивал другой поток (см. bind).
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _stage_entry(self, name):
+        return self.stages.setdefault(name, {'s': 0.0, 'bytes': 0})
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self._stage_entry(name)['s'] += seconds
+
+    def add_bytes(self, name, count):
+        with self._lock:
+            self._stage_entry(name)['bytes'] += count
+
+    def as_dict(self):
+        with self._lock:
+            return {name: {'s': round(entry['s'], 3), 'bytes': entry['bytes']} for name, entry in self.stages.items()}
+
+
+def start_block(name=None):
+    """Начинает сбор метрик страницы в текущем потоке (name - название страницы для трассы)"""
+    _current.block = BlockMetrics()
+    _current.stages = []
+    _current.block_name = name
+    _current.block_started_at = time.perf_counter()
+    return _current.block
+
+
+def finish_block():
+    """Завершает сбор метрик страницы и возвращает их словарем (или None, если сбор не начинался)"""
+    switch_stage(None)
+    block = getattr(_current, 'block', None)
+    if block is not None:
+        tracing.add_span(_current.block_name or 'page', 'page', _current.block_started_at, time.perf_counter())
+    _current.block = None
+    _current.stages = []
+    return block.as_dict() if block else None
+
+
+@contextmanager
+def stage(name):
+    """Засчитывает время выполнения блока кода этапу name текущей страницы"""
+    block = getattr(_current, 'block', None)
+    if block is None:
+        yield
+        return
+    _current.stages.append(name)
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        finished_at = time.perf_counter()
+        block.add_time(name, finished_at - started_at)
+        tracing.add_span(name, 'stage', started_at, finished_at)
+        _current.stages.pop()
+
+
+def switch_stage(name):
+    """
+    Завершает текущий последовательный этап страницы и начинает этап name (None - только завершить).
+    Удобно для длинного линейного кода, где этапы идут друг за другом.
+    """
+    block = getattr(_current, 'block', None)
+    if block is None:
+        return
+    lap = getattr(_current, 'lap', None)
+    if lap:
+        finished_at = time.perf_counter()
+        block.add_time(lap[0], finished_at - lap[1])
+        tracing.add_span(lap[0], 'stage', lap[1], finished_at)
+        _current.stages.remove(lap[0])
+    _current.lap = None
+    if name:
+        _current.lap = (name, time.perf_counter())
+        _current.stages.append(name)
+
+
+def byte_recorder():
+    """
+    Функция учета скачанных байт для текущего этапа страницы или None вне этапа.
+    Ее можно передать в другой поток или цикл событий: учет останется за этой страницей.
+    """
+    block = getattr(_current, 'block', None)
+    stages = getattr(_current, 'stages', None)
+    if block is None or not stages:
+        return None
+    name = stages[-1]
+    return lambda count: block.add_bytes(name, count)
+
+
+def add_bytes(count):
+    """Засчитывает скачанные байты текущему этапу страницы (в потоке страницы или привязанном через bind)"""
+    recorder = getattr(_current, 'recorder', None) or byte_recorder()
+    if recorder and count:
+        recorder(count)
+
+
+def bind(function):
+    """Оборачивает функцию для пула потоков так, чтобы ее загрузки учитывались за текущим этапом страницы"""
+    recorder = byte_recorder()
+    if recorder is None:
+        return function
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_current, 'recorder', None)
+        _current.recorder = recorder
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.recorder = previous
+    return wrapper
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль (метод ближайшего ранга) отсортированного списка"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize_stages(records):
+    """
+    Сводка по этапам для записей прогресса (словари с ключом stages).
+    Возвращает список (этап, {count, p50, p90, p99, total_s, bytes, mb_per_s}) в порядке STAGES.
+    """
+    durations = {}
+    totals = {}
+    for record in records:
+        for name, entry in (record.get('stages') or {}).items():
+            durations.setdefault(name, []).append(entry.get('s', 0))
+            totals[name] = totals.get(name, 0) + entry.get('bytes', 0)
+
+    summary = []
+    for name in sorted(durations, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)):
+        values = sorted(durations[name])
+        total_s = sum(values)
+        summary.append((name, {
+            'count': len(values),
+            'p50': percentile(values, 0.5),
+            'p90': percentile(values, 0.9),
+            'p99': percentile(values, 0.99),
+            'total_s': total_s,
+            'bytes': totals[name],
+            'mb_per_s': totals[name] / (1024 * 1024) / total_s if total_s else 0.0
+        }))
+    return summary
+
+
+def throughput_by_interval(records, interval=METRICS_THROUGHPUT_INTERVAL):
+    """
+    Скачанный объем по интервалам времени завершения страниц.
+    Возвращает список (начало интервала, число страниц, МБ, МБ/с в среднем за интервал).
+    """
+    buckets = {}
+    for record in records:
+        try:
+            finished_at = datetime.fromisoformat(record['updated_at']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            continue
+        total_bytes = sum(entry.get('bytes', 0) for entry in (record.get('stages') or {}).values())
+        bucket = buckets.setdefault(int(finished_at // interval) * interval, [0, 0])
+        bucket[0] += 1
+        bucket[1] += total_bytes
+    return [
+        (datetime.fromtimestamp(start), pages, total_bytes / (1024 * 1024), total_bytes / (1024 * 1024) / interval)
+        for start, (pages, total_bytes) in sorted(buckets.items())
+    ]
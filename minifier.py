@@ -0,0 +1,184 @@
+# minifier.py
+
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import Comment, NavigableString
+
+try:
+    import rjsmin  # Необязательная зависимость для минификации JS
+except ImportError:
+    rjsmin = None
+
+logger = logging.getLogger(__name__)
+
+_MINIFY_MANIFEST_FILENAME = '.minify_manifest.json'
+
+# Подпапки _assets, файлы в которых принадлежат нам и могут быть минифицированы
+_MINIFY_ASSET_DIRS = ['css', 'js', 'runtime', 'shared']
+
+# Теги, внутри которых пробелы значимы
+_WHITESPACE_SENSITIVE_TAGS = {'pre', 'textarea', 'script', 'style', 'code'}
+
+# Атрибуты со значениями по умолчанию, которые можно удалить: тег -> (атрибут, значение)
+_DEFAULT_ATTRIBUTES = {
+    'script': ('type', 'text/javascript'),
+    'style': ('type', 'text/css'),
+    'link': ('type', 'text/css'),
+    'form': ('method', 'get'),
+}
+
+# Атрибуты, которые бессмысленны с пустым значением
+_EMPTY_REMOVABLE_ATTRIBUTES = ['class', 'style', 'id', 'title']
+
+
+def minify_html(soup):
+    """
+    Минифицирует HTML-документ BeautifulSoup на месте: удаляет комментарии,
+    схлопывает пробелы в тексте и убирает пустые и стандартные атрибуты.
+    """
+    # 1. Комментарии (условные комментарии IE оставляем)
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        if not comment.strip().startswith('[if'):
+            comment.extract()
+
+    # 2. Пробелы в текстовых узлах
+    for text_node in soup.find_all(string=True):
+        if type(text_node) is not NavigableString:
+            continue
+        if any(parent.name in _WHITESPACE_SENSITIVE_TAGS for parent in text_node.parents):
+            continue
+        collapsed_text = re.sub(r'\s+', ' ', text_node)
+        if collapsed_text != text_node:
+            text_node.replace_with(collapsed_text)
+
+    # 3. Пустые и стандартные атрибуты
+    for tag in soup.find_all(True):
+        for attribute in _EMPTY_REMOVABLE_ATTRIBUTES:
+            value = tag.attrs.get(attribute)
+            if value is not None and not (' '.join(value) if isinstance(value, list) else value).strip():
+                del tag[attribute]
+        default_attribute = _DEFAULT_ATTRIBUTES.get(tag.name)
+        if default_attribute:
+            attribute, default_value = default_attribute
+            if str(tag.get(attribute, '')).strip().lower() == default_value:
+                del tag[attribute]
+    return soup
+
+
+def _compact_css_code(code):
+    """Убирает лишние пробелы в участке CSS без строк и комментариев"""
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    code = re.sub(r':\s+', ':', code)
+    return code.replace(';}', '}')
+
+
+def minify_css(css_content):
+    """Минифицирует CSS: удаляет комментарии и лишние пробелы, не затрагивая строки"""
+    result = []
+    code_start = 0
+    i = 0
+    length = len(css_content)
+    while i < length:
+        char = css_content[i]
+        if char in '"\'':
+            # Строки копируем как есть
+            end = i + 1
+            while end < length and css_content[end] != char:
+                end += 2 if css_content[end] == '\\' else 1
+            end = min(end + 1, length)
+        elif css_content.startswith('/*', i):
+            # Комментарии удаляем, кроме лицензионных /*! ... */
+            end = css_content.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+        else:
+            i += 1
+            continue
+        result.append(_compact_css_code(css_content[code_start:i]))
+        if char in '"\'' or css_content.startswith('/*!', i):
+            result.append(css_content[i:end])
+        i = code_start = end
+    result.append(_compact_css_code(css_content[code_start:]))
+    return ''.join(result).strip()
+
+
+def minify_js(js_content):
+    """Минифицирует JS с помощью rjsmin. Возвращает None, если библиотека не установлена."""
+    if rjsmin is None:
+        return None
+    return rjsmin.jsmin(js_content)
+
+
+def _minify_asset_file(file_path):
+    """
+    Минифицирует один файл (выполняется в отдельном процессе).
+    Возвращает (путь, SHA-1 итогового содержимого, сэкономлено байт).
+    """
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        content = f.read()
+    if file_path.endswith('.css'):
+        minified = minify_css(content)
+    else:
+        minified = minify_js(content)
+    if minified is None or len(minified) >= len(content):
+        minified = content
+    else:
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(minified)
+    return file_path, hashlib.sha1(minified.encode('utf-8')).hexdigest(), len(content.encode('utf-8')) - len(minified.encode('utf-8'))
+
+
+def minify_assets(assets_dir, max_workers=None):
+    """
+    Минифицирует CSS и JS файлы в _assets в пуле процессов.
+    Хеши результатов сохраняются в манифест, поэтому уже минифицированные файлы пропускаются.
+    """
+    manifest_path = os.path.join(assets_dir, _MINIFY_MANIFEST_FILENAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить манифест минификации: {e}")
+
+    if rjsmin is None:
+        logger.info("Библиотека rjsmin не установлена, JS файлы не минифицируются.")
+
+    pending_files = []
+    for subdir in _MINIFY_ASSET_DIRS:
+        asset_subdir = os.path.join(assets_dir, subdir)
+        if not os.path.isdir(asset_subdir):
+            continue
+        for entry in os.scandir(asset_subdir):
+            if not entry.is_file():
+                continue
+            if not entry.name.endswith('.css') and not (entry.name.endswith('.js') and rjsmin is not None):
+                continue
+            with open(entry.path, 'rb') as f:
+                content_hash = hashlib.sha1(f.read()).hexdigest()
+            if content_hash not in manifest:
+                pending_files.append(entry.path)
+
+    if not pending_files:
+        logger.debug("Нет новых файлов для минификации.")
+        return
+
+    logger.info(f"Минифицирую {len(pending_files)} CSS/JS файлов...")
+    saved_bytes = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for file_path, content_hash, file_saved_bytes in executor.map(_minify_asset_file, pending_files, chunksize=8):
+            manifest[content_hash] = os.path.relpath(file_path, assets_dir).replace("\\", "/")
+            saved_bytes += file_saved_bytes
+
+    try:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить манифест минификации: {e}")
+    logger.info(f"✔ Минификация завершена, сэкономлено {saved_bytes / (1024 * 1024):.1f} МБ")
@@ -2,14 +2,9 @@
 
 import logging
 import os
-from pathvalidate import sanitize_filename
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 from urllib.parse import urlparse
-import time
 
-from config import IGNORE_KEYWORDS_IN_TITLES
+from course_index import CourseIndex, as_course_index
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +16,11 @@ def _rewire_navigation_links(soup, current_block_id, parent_block, all_blocks):
     if not parent_block or parent_block.get('type') not in ['sequential']:
         return soup 
 
-    siblings = parent_block.get('children', [])
-    try:
-        current_index = siblings.index(current_block_id)
-    except ValueError:
+    course_index = as_course_index(all_blocks)
+    siblings = course_index.children(parent_block.get('id'))
+    if course_index.parent_id(current_block_id) != parent_block.get('id'):
         return soup
+    current_index = course_index.position(current_block_id)
 
     prev_button = soup.select_one('.sf-sequence-tab-view__nav-buttons button:first-of-type, .sf-sequence-tab-view__nav-buttons a:first-of-type')
     next_button = soup.select_one('.sf-sequence-tab-view__nav-buttons button:last-of-type, .sf-sequence-tab-view__nav-buttons a:last-of-type')
@@ -33,21 +28,17 @@ def _rewire_navigation_links(soup, current_block_id, parent_block, all_blocks):
     if prev_button:
         if current_index > 0:
             prev_block_id = siblings[current_index - 1]
-            prev_block_data = all_blocks.get(prev_block_id)
-            if prev_block_data:
-                prev_filename = f"{sanitize_filename(prev_block_data.get('display_name', ''))}.html"
+            if prev_block_id in course_index:
                 prev_button.name = 'a'
-                prev_button['href'] = prev_filename
+                prev_button['href'] = course_index.filename(prev_block_id)
         prev_button.attrs.pop('disabled', None)
 
     if next_button:
         if current_index < len(siblings) - 1:
             next_block_id = siblings[current_index + 1]
-            next_block_data = all_blocks.get(next_block_id)
-            if next_block_data:
-                next_filename = f"{sanitize_filename(next_block_data.get('display_name', ''))}.html"
+            if next_block_id in course_index:
                 next_button.name = 'a'
-                next_button['href'] = next_filename
+                next_button['href'] = course_index.filename(next_block_id)
         next_button.attrs.pop('disabled', None)
     
     tabs_container = soup.select_one('.sequence-tab-view-navigation__tabs-container')
@@ -56,10 +47,9 @@ def _rewire_navigation_links(soup, current_block_id, parent_block, all_blocks):
              tab.decompose() 
 
         for i, block_id in enumerate(siblings):
-            block_data = all_blocks.get(block_id)
+            block_data = course_index.get(block_id)
             if block_data and block_data.get('type') == 'vertical':
-                filename = f"{sanitize_filename(block_data.get('display_name', ''))}.html"
-                new_tab_link = soup.new_tag('a', href=filename)
+                new_tab_link = soup.new_tag('a', href=course_index.filename(block_id))
                 new_tab_div = soup.new_tag('div', **{'class': 'sf-unit-tab sequence-tab-view-navigation__tab'})
                 if block_id == current_block_id:
                     new_tab_div['class'].append('sf-unit-tab--current')
@@ -70,12 +60,12 @@ def _rewire_navigation_links(soup, current_block_id, parent_block, all_blocks):
 
 
 def find_root_block(course_structure):
+    """Строит индекс блоков курса. Возвращает (ID корневого блока, CourseIndex)."""
     try:
-        all_blocks = course_structure['course_blocks']['blocks']
-        for block_id, block_data in all_blocks.items():
-            if block_data.get('type') == 'course':
-                logger.info(f"Корневой элемент успешно найден: {block_id}")
-                return block_id, all_blocks
+        course_index = CourseIndex.from_structure(course_structure)
+        if course_index.root_id is not None:
+            logger.info(f"Корневой элемент успешно найден: {course_index.root_id}")
+            return course_index.root_id, course_index
         logger.error("В словаре блоков не найден элемент с type='course'.")
         return None, None
     except (KeyError, TypeError):
@@ -84,17 +74,17 @@ def find_root_block(course_structure):
 
 
 def build_navigation_tree(block_id, all_blocks):
+    all_blocks = as_course_index(all_blocks)
     block_data = all_blocks.get(block_id)
     if not block_data: return None
-    display_name = block_data.get('display_name', 'N/A')
-    if any(keyword in display_name.lower() for keyword in IGNORE_KEYWORDS_IN_TITLES):
+    if all_blocks.is_ignored(block_id):
         return None
+    display_name = block_data.get('display_name', 'N/A')
     node = {'id': block_id, 'display_name': display_name, 'type': block_data.get('type', 'N/A'), 'children': []}
-    if 'children' in block_data:
-        for child_id in block_data['children']:
-            child_node = build_navigation_tree(child_id, all_blocks)
-            if child_node:
-                node['children'].append(child_node)
+    for child_id in all_blocks.children(block_id):
+        child_node = build_navigation_tree(child_id, all_blocks)
+        if child_node:
+            node['children'].append(child_node)
     return node
 
 
@@ -116,14 +106,16 @@ def choose_course_from_list(courses):
             print("Некорректный ввод.")
 
 
-def interactive_navigate(course_tree, all_blocks, session, output_dir, no_videos, force_overwrite):
+def interactive_navigate(course_tree, all_blocks, session, output_dir, no_videos, force_overwrite, output_options=None, refresh_ids=None):
     # === ИЗМЕНЕНИЕ ЗДЕСЬ: Импорт перенесен внутрь функции ===
-    from downloader import download_material 
+    from downloader import download_material, finalize_output, create_browser
     from progress_tracker import ProgressTracker
     
+    all_blocks = as_course_index(all_blocks)
+    
     # Создаем ProgressTracker для интерактивного режима
     course_name = course_tree.get('display_name', 'Курс')
-    progress_tracker = ProgressTracker(course_name, output_dir)
+    progress_tracker = ProgressTracker(course_name, output_dir, registry_dir=(output_options or {}).get('output_root'))
     
     # Валидируем прогресс с файловой системой
     progress_tracker.validate_and_cleanup_progress()
@@ -160,33 +152,17 @@ def interactive_navigate(course_tree, all_blocks, session, output_dir, no_videos
             elif choice == 'd':
                 if not driver_initialized:
                     logger.info("Для интерактивного режима будет запущен единый браузер.")
-                    options = webdriver.ChromeOptions()
-                    options.add_experimental_option("excludeSwitches", ["enable-logging"])
-                    service = Service(ChromeDriverManager().install())
-                    driver = webdriver.Chrome(service=service, options=options)
-                    driver.get("https://lms.skillfactory.ru/404")
-                    time.sleep(1)
-                    for cookie in session.cookies:
-                        driver.add_cookie({k: v for k, v in cookie.__dict__.items() if k != '_rest'})
-                    logger.info("Cookies сессии успешно переданы в браузер.")
+                    driver = create_browser(session)
                     driver_initialized = True
                 
-                # Исключаем корневой блок курса из пути, чтобы избежать дублирования
-                # Корневой блок курса (type='course') уже учтен в output_dir
-                relative_path_parts = []
-                for p in path_stack:
-                    # Получаем данные блока из all_blocks
-                    block_data = all_blocks.get(p['id'])
-                    # Пропускаем корневой блок курса
-                    if block_data and block_data.get('type') != 'course':
-                        relative_path_parts.append(p['display_name'])
-                
-                sanitized_parts = [sanitize_filename(p) for p in relative_path_parts]
-                download_path = os.path.join(output_dir, *sanitized_parts)
+                # Путь раздела уже вычислен в индексе (корневой блок курса учтен в output_dir)
+                parent_relative_path = all_blocks.relative_path(path_stack[-1]['id']) if path_stack else ''
+                download_path = os.path.join(output_dir, parent_relative_path or '')
                 os.makedirs(download_path, exist_ok=True)
                 parent_block_data = all_blocks.get(path_stack[-1]['id']) if path_stack else None
                 logger.info(f"Начинаю скачивание '{current_node['display_name']}' в '{download_path}'...")
-                download_material(driver, session, current_node['id'], all_blocks, download_path, output_dir, no_videos, force_overwrite, parent_block=parent_block_data, progress_tracker=progress_tracker)
+                download_material(driver, session, current_node['id'], all_blocks, download_path, output_dir, no_videos, force_overwrite, parent_block=parent_block_data, progress_tracker=progress_tracker, output_options=output_options, refresh_ids=refresh_ids)
+                finalize_output(output_dir, output_options)
                 logger.info("Скачивание завершено.")
                 
                 # Показываем обновленный прогресс после скачивания
@@ -204,6 +180,7 @@ def interactive_navigate(course_tree, all_blocks, session, output_dir, no_videos
             else:
                 print("! Неизвестная команда.")
     finally:
+        progress_tracker.close()
         if driver:
             logger.info("Закрытие браузера.")
             driver.quit()
\ No newline at end of file
@@ -5,40 +5,32 @@
 
 import argparse
 import os
-import json
 import sys
 from pathvalidate import sanitize_filename
-from progress_tracker import ProgressTracker
+from progress_tracker import ProgressTracker, list_registered_progress_files
+from metrics import summarize_stages, throughput_by_interval, percentile
 
-def list_progress_files(directory="."):
-    """Находит все файлы прогресса в директории"""
-    progress_files = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith('_progress.json'):
-                progress_files.append(os.path.join(root, file))
-    return progress_files
+def list_progress_files(directory=".", rescan=False):
+    """Находит все файлы прогресса в директории (по реестру, а без него - поиском по папкам)"""
+    return list_registered_progress_files(directory, rescan=rescan)
 
 def show_progress_summary(progress_file):
     """Показывает краткую сводку по файлу прогресса"""
     try:
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        tracker = ProgressTracker(None, os.path.dirname(progress_file), progress_file=progress_file)
+        try:
+            stats = tracker.get_statistics()
+        finally:
+            tracker.close()
         
-        course_name = data.get('course_name', 'Неизвестный курс')
-        stats = data.get('statistics', {})
-        completed = len(data.get('completed', {}))
-        failed = len(data.get('failed', {}))
-        skipped = len(data.get('skipped', {}))
-        
-        print(f"\n📚 {course_name}")
+        print(f"\n📚 {tracker.course_name or 'Неизвестный курс'}")
         print(f"   📁 {progress_file}")
-        print(f"   ✅ Завершено: {completed}")
-        print(f"   ❌ Неудачно: {failed}")
-        print(f"   ⏭️  Пропущено: {skipped}")
-        print(f"   📊 Размер: {stats.get('total_size_mb', 0):.1f} МБ")
-        print(f"   🎥 Видео: {stats.get('videos_downloaded', 0)}")
-        print(f"   📄 HTML: {stats.get('html_files_created', 0)}")
+        print(f"   ✅ Завершено: {stats['completed_count']}")
+        print(f"   ❌ Неудачно: {stats['failed_count']}")
+        print(f"   ⏭️  Пропущено: {stats['skipped_count']}")
+        print(f"   📊 Размер: {stats['total_size_mb']:.1f} МБ")
+        print(f"   🎥 Видео: {stats['videos_downloaded']}")
+        print(f"   📄 HTML: {stats['html_files_created']}")
         
     except Exception as e:
         print(f"❌ Ошибка при чтении {progress_file}: {e}")
@@ -46,24 +38,65 @@ def show_progress_summary(progress_file):
 def show_detailed_progress(progress_file):
     """Показывает детальный прогресс"""
     try:
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        tracker = ProgressTracker(None, os.path.dirname(progress_file), progress_file=progress_file)
+        try:
+            tracker.print_progress_table()
+        finally:
+            tracker.close()
         
-        course_name = data.get('course_name', 'Неизвестный курс')
+    except Exception as e:
+        print(f"❌ Ошибка при чтении {progress_file}: {e}")
+
+def show_stage_statistics(progress_file, slowest_count=10):
+    """Показывает статистику времени по этапам, самые медленные страницы и скорость скачивания"""
+    try:
+        tracker = ProgressTracker(None, os.path.dirname(progress_file), progress_file=progress_file)
+        try:
+            records = tracker.get_block_metrics()
+        finally:
+            tracker.close()
+        
+        if not records:
+            print("Метрики обработки страниц не найдены (они записываются начиная с этой версии).")
+            return
         
-        # Создаем временный трекер для использования метода print_progress_table
-        temp_dir = os.path.dirname(progress_file)
-        tracker = ProgressTracker(course_name, temp_dir)
-        tracker.progress_data = data
-        tracker.print_progress_table()
+        durations = sorted(record['duration_s'] for record in records)
+        print("\n" + "="*80)
+        print(f"СТАТИСТИКА ОБРАБОТКИ: {tracker.course_name}")
+        print("="*80)
+        print(f"📄 Страниц: {len(records)}, время на страницу: "
+              f"p50 {percentile(durations, 0.5):.1f} с, p90 {percentile(durations, 0.9):.1f} с, "
+              f"p99 {percentile(durations, 0.99):.1f} с, всего {sum(durations) / 60:.1f} мин")
+        
+        print("\n⏱️  Этапы (секунды на страницу):")
+        print("-" * 80)
+        print(f"   {'Этап':<16}{'страниц':>8}{'p50':>8}{'p90':>8}{'p99':>8}{'всего, мин':>12}{'МБ':>9}{'МБ/с':>8}")
+        for name, stats in summarize_stages(records):
+            print(f"   {name:<16}{stats['count']:>8}{stats['p50']:>8.2f}{stats['p90']:>8.2f}{stats['p99']:>8.2f}"
+                  f"{stats['total_s'] / 60:>12.1f}{stats['bytes'] / (1024 * 1024):>9.1f}{stats['mb_per_s']:>8.2f}")
+        
+        print("\n🐢 Самые медленные страницы:")
+        print("-" * 80)
+        for record in sorted(records, key=lambda record: record['duration_s'], reverse=True)[:slowest_count]:
+            stages = record['stages']
+            slowest_stage = max(stages, key=lambda name: stages[name]['s']) if stages else '-'
+            print(f"   {(record['display_name'] or '')[:50]:<50} {record['duration_s']:>7.1f} с  (дольше всего: {slowest_stage})")
+        
+        print("\n📈 Скорость скачивания по времени:")
+        print("-" * 80)
+        for started_at, pages, size_mb, mb_per_s in throughput_by_interval(records):
+            print(f"   {started_at:%Y-%m-%d %H:%M}  страниц: {pages:>4}  {size_mb:>9.1f} МБ  {mb_per_s:>7.2f} МБ/с")
+        print("="*80)
         
     except Exception as e:
         print(f"❌ Ошибка при чтении {progress_file}: {e}")
 
 def clean_progress_file(progress_file):
-    """Удаляет файл прогресса"""
+    """Удаляет базу прогресса вместе с файлами WAL"""
     try:
-        os.remove(progress_file)
+        for path in (progress_file, f"{progress_file}-wal", f"{progress_file}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
         print(f"✅ Файл прогресса удален: {progress_file}")
     except Exception as e:
         print(f"❌ Ошибка при удалении {progress_file}: {e}")
@@ -71,20 +104,16 @@ def clean_progress_file(progress_file):
 def reset_failed_items(progress_file):
     """Сбрасывает неудачные элементы для повторной попытки"""
     try:
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        tracker = ProgressTracker(None, os.path.dirname(progress_file), progress_file=progress_file)
+        try:
+            failed_count = tracker.reset_failed()
+        finally:
+            tracker.close()
         
-        failed_count = len(data.get('failed', {}))
         if failed_count == 0:
             print("Неудачных элементов не найдено.")
             return
         
-        # Очищаем неудачные элементы
-        data['failed'] = {}
-        
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
         print(f"✅ Сброшено {failed_count} неудачных элементов в {progress_file}")
         
     except Exception as e:
@@ -95,15 +124,17 @@ def main():
     parser.add_argument('--list', '-l', action='store_true', help="Показать все файлы прогресса")
     parser.add_argument('--show', '-s', help="Показать детальный прогресс для файла")
     parser.add_argument('--summary', help="Показать краткую сводку для файла")
+    parser.add_argument('--stats', help="Показать статистику времени по этапам и скорости скачивания для файла")
     parser.add_argument('--clean', '-c', help="Удалить файл прогресса")
     parser.add_argument('--reset-failed', '-r', help="Сбросить неудачные элементы для повторной попытки")
     parser.add_argument('--directory', '-d', default='.', help="Директория для поиска файлов прогресса")
+    parser.add_argument('--rescan', action='store_true', help="Заново найти файлы прогресса и обновить реестр (для --list)")
     
     args = parser.parse_args()
     
     if args.list:
         print("🔍 Поиск файлов прогресса...")
-        progress_files = list_progress_files(args.directory)
+        progress_files = list_progress_files(args.directory, rescan=args.rescan)
         
         if not progress_files:
             print("Файлы прогресса не найдены.")
@@ -125,6 +156,12 @@ def main():
             return
         show_detailed_progress(args.show)
         
+    elif args.stats:
+        if not os.path.exists(args.stats):
+            print(f"❌ Файл не найден: {args.stats}")
+            return
+        show_stage_statistics(args.stats)
+        
     elif args.summary:
         if not os.path.exists(args.summary):
             print(f"❌ Файл не найден: {args.summary}")
@@ -1,77 +1,381 @@
 import json
 import os
 import logging
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathvalidate import sanitize_filename
 
+from config import PROGRESS_BUSY_TIMEOUT, PROGRESS_VALIDATION_WORKERS, PROGRESS_REGISTRY_NAME, PROGRESS_SCAN_SKIP_DIRS
+
 logger = logging.getLogger(__name__)
 
+# Блокировка действует только внутри процесса; между процессами реестр защищен
+# уникальным временным файлом на каждую запись и проверкой записи после сохранения
+_registry_lock = threading.Lock()
+_REGISTRY_WRITE_ATTEMPTS = 3
+
+# Одна строка на пару (блок, статус): блок может быть одновременно завершен и пропущен при повторном запуске
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS progress (
+    block_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    display_name TEXT,
+    block_type TEXT,
+    updated_at TEXT,
+    file_path TEXT,
+    file_size_mb REAL NOT NULL DEFAULT 0,
+    has_video INTEGER NOT NULL DEFAULT 0,
+    duration_s REAL,
+    message TEXT,
+    fingerprint TEXT,
+    stages TEXT,
+    PRIMARY KEY (block_id, status)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS progress_by_status ON progress (status, updated_at);
+"""
+
+# Столбцы, добавленные после первой версии схемы (базы старых версий дополняются при открытии)
+_ADDED_COLUMNS = (('fingerprint', 'TEXT'), ('stages', 'TEXT'))
+
+_STATUSES = ('completed', 'failed', 'skipped')
+
+
+def get_progress_path(output_dir, course_name):
+    return os.path.join(output_dir, f"{sanitize_filename(course_name)}_progress.db")
+
+
+def connect_progress_db(progress_file):
+    """
+    Открывает базу прогресса в режиме WAL: читатели не блокируют писателя,
+    а несколько процессов и потоков могут обновлять ее одновременно.
+    """
+    connection = sqlite3.connect(progress_file, timeout=PROGRESS_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL NORMAL не теряет целостность, fsync выполняется при контрольных точках
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+    existing_columns = {row[1] for row in connection.execute("PRAGMA table_info(progress)")}
+    for column, column_type in _ADDED_COLUMNS:
+        if column in existing_columns:
+            continue
+        try:
+            connection.execute(f"ALTER TABLE progress ADD COLUMN {column} {column_type}")
+        except sqlite3.OperationalError:
+            pass  # Столбец уже добавил другой процесс
+    return connection
+
+
+def _stat_fingerprint(stat_result):
+    """Отпечаток файла (inode, размер, время изменения): меняется при любой перезаписи файла"""
+    return f"{stat_result.st_ino}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+
+
+def _file_fingerprint(file_path):
+    try:
+        return _stat_fingerprint(os.stat(file_path))
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def _scan_fingerprints(directory, names):
+    """
+    Отпечатки файлов из names в одной папке. Папка читается одним os.scandir,
+    а stat выполняется только для нужных файлов.
+    """
+    fingerprints = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name in names and entry.is_file():
+                    fingerprints[entry.name] = _stat_fingerprint(entry.stat())
+    except OSError as e:
+        logger.debug(f"Не удалось прочитать папку {directory}: {e}")
+    return fingerprints
+
+
+def _read_registry(registry_path):
+    try:
+        with open(registry_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('progress_files', {})
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"Реестр прогресса {registry_path} поврежден: {e}")
+        return None
+
+
+def _write_registry(registry_path, entries):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(registry_path) or '.', prefix=f"{os.path.basename(registry_path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'progress_files': entries}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, registry_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def register_progress_file(registry_dir, progress_file, course_name):
+    """
+    Добавляет файл прогресса в реестр папки скачивания (PROGRESS_REGISTRY_NAME),
+    чтобы progress_manager.py --list находил курсы без обхода всего архива.
+    """
+    registry_path = os.path.join(registry_dir, PROGRESS_REGISTRY_NAME)
+    relative_path = os.path.relpath(progress_file, registry_dir)
+    with _registry_lock:
+        # Другой процесс мог записать реестр одновременно с нами: перечитываем и повторяем, пока запись не сохранится
+        for _ in range(_REGISTRY_WRITE_ATTEMPTS):
+            entries = _read_registry(registry_path) or {}
+            if relative_path in entries:
+                return
+            entries[relative_path] = {'course_name': course_name, 'registered_at': datetime.now().isoformat()}
+            try:
+                _write_registry(registry_path, entries)
+            except OSError as e:
+                logger.warning(f"Не удалось обновить реестр прогресса {registry_path}: {e}")
+                return
+
+
+def scan_progress_files(directory):
+    """
+    Ищет файлы прогресса обходом папок через os.scandir, не заходя в папки ресурсов
+    (PROGRESS_SCAN_SKIP_DIRS), где лежит основная масса файлов архива.
+    """
+    progress_files = []
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in PROGRESS_SCAN_SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.name.endswith('_progress.db'):
+                        progress_files.append(entry.path)
+        except OSError as e:
+            logger.debug(f"Не удалось прочитать папку {current}: {e}")
+    return sorted(progress_files)
+
+
+def list_registered_progress_files(directory, rescan=False):
+    """
+    Возвращает файлы прогресса из реестра папки. Если реестра нет (или rescan), выполняет поиск.
+    Реестр обновляется (найденным и без удаленных файлов), только если он уже есть в папке,
+    то есть ProgressTracker зарегистрировал в ней курсы: просмотр чужой папки ничего в нее не пишет.
+    """
+    registry_path = os.path.join(directory, PROGRESS_REGISTRY_NAME)
+    with _registry_lock:
+        registered = _read_registry(registry_path)
+        if registered is None or rescan:
+            entries = {
+                os.path.relpath(path, directory): (registered or {}).get(os.path.relpath(path, directory), {})
+                for path in scan_progress_files(directory)
+            }
+            stale = registered is not None
+        else:
+            entries = {path: info for path, info in registered.items() if os.path.exists(os.path.join(directory, path))}
+            stale = len(entries) != len(registered)
+        if stale:
+            try:
+                _write_registry(registry_path, entries)
+            except OSError as e:
+                logger.warning(f"Не удалось обновить реестр прогресса {registry_path}: {e}")
+    return sorted(os.path.join(directory, path) for path in entries)
+
+
+def _legacy_journal_path(progress_file):
+    return f"{os.path.splitext(progress_file)[0]}.jsonl"
+
+
+def _load_legacy_progress(json_file):
+    """Читает прогресс старого формата: снимок <курс>_progress.json и журнал <курс>_progress.jsonl"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    journal_path = _legacy_journal_path(json_file)
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('seq', 0) <= data.get("journal_seq", 0):
+                    continue
+                if event['op'] == 'uncompleted':
+                    data["completed"].pop(event['id'], None)
+                elif event['op'] in _STATUSES:
+                    data[event['op']][event['id']] = event['info']
+    return data
+
+
 class ProgressTracker:
-    """Класс для отслеживания прогресса скачивания курса"""
-    
-    def __init__(self, course_name, output_dir):
+    """
+    Класс для отслеживания прогресса скачивания курса.
+    Прогресс хранится в SQLite (<курс>_progress.db, режим WAL), поэтому его могут
+    безопасно обновлять несколько потоков и процессов; каждое обновление - отдельная
+    транзакция, а массовые изменения группируются через batch().
+    """
+
+    def __init__(self, course_name, output_dir, progress_file=None, registry_dir=None):
         self.course_name = course_name
         self.output_dir = output_dir
-        self.progress_file = os.path.join(output_dir, f"{sanitize_filename(course_name)}_progress.json")
-        self.progress_data = self._load_progress()
-    
+        self.progress_file = progress_file or get_progress_path(output_dir, course_name)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._load_progress()
+        # Утилиты открывают базу по пути и берут имя курса из нее
+        self.course_name = course_name or self._get_meta('course_name')
+        if registry_dir:
+            register_progress_file(registry_dir, self.progress_file, self.course_name)
+
+    def _connection(self):
+        """Соединение с базой для текущего потока"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = connect_progress_db(self.progress_file)
+            self._local.depth = 0
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def batch(self):
+        """Группирует несколько обновлений в одну транзакцию (вложенные вызовы объединяются)"""
+        connection = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield connection
+            finally:
+                self._local.depth -= 1
+            return
+        # IMMEDIATE сразу берет блокировку записи, чтобы параллельные писатели ждали, а не получали ошибку посреди транзакции
+        connection.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.depth = 0
+
+    def _get_meta(self, key):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
     def _load_progress(self):
-        """Загружает прогресс из JSON файла"""
-        if os.path.exists(self.progress_file):
+        """
+        Открывает базу прогресса и переносит в нее прогресс из JSON файла старого формата.
+        JSON файл проверяется при каждом открытии: если перенос не удался, он повторится при следующем запуске.
+        """
+        is_new = not os.path.exists(self.progress_file)
+        try:
+            connection = self._connection()
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось открыть базу прогресса {self.progress_file}: {e}")
+            raise
+
+        if is_new:
+            with self.batch():
+                now = datetime.now().isoformat()
+                connection.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [('course_name', self.course_name), ('created_at', now), ('last_updated', now)]
+                )
+
+        legacy_file = f"{os.path.splitext(self.progress_file)[0]}.json"
+        if os.path.exists(legacy_file):
             try:
-                with open(self.progress_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                logger.info(f"Загружен прогресс скачивания: {len(data.get('completed', {}))} завершенных элементов")
-                return data
+                # Отдельная транзакция: при ошибке частично перенесенные записи откатываются, JSON файл остается на месте
+                with self.batch():
+                    self._import_legacy(_load_legacy_progress(legacy_file))
             except Exception as e:
-                logger.warning(f"Не удалось загрузить файл прогресса: {e}")
-        
-        # Создаем новый файл прогресса
-        new_progress = {
-            "course_name": self.course_name,
-            "created_at": datetime.now().isoformat(),
-            "last_updated": datetime.now().isoformat(),
-            "completed": {},  # block_id -> info
-            "failed": {},     # block_id -> error_info
-            "skipped": {},    # block_id -> reason
-            "statistics": {
-                "total_processed": 0,
-                "total_size_mb": 0,
-                "videos_downloaded": 0,
-                "html_files_created": 0
-            }
-        }
-        
-        # Сразу сохраняем новый файл прогресса
-        try:
-            with open(self.progress_file, 'w', encoding='utf-8') as f:
-                json.dump(new_progress, f, ensure_ascii=False, indent=2)
+                logger.warning(f"Не удалось перенести прогресс из {legacy_file}: {e}")
+            else:
+                os.replace(legacy_file, f"{legacy_file}.bak")
+                if os.path.exists(_legacy_journal_path(legacy_file)):
+                    os.remove(_legacy_journal_path(legacy_file))
+                logger.info(f"Прогресс перенесен из {legacy_file} в {self.progress_file}")
+        if is_new:
             logger.info(f"Создан новый файл прогресса: {self.progress_file}")
-        except Exception as e:
-            logger.error(f"Не удалось создать файл прогресса: {e}")
-        
-        return new_progress
-    
-    def _save_progress(self):
-        """Сохраняет прогресс в JSON файл"""
-        try:
-            self.progress_data["last_updated"] = datetime.now().isoformat()
-            with open(self.progress_file, 'w', encoding='utf-8') as f:
-                json.dump(self.progress_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Не удалось сохранить прогресс: {e}")
-    
+        else:
+            logger.info(f"Загружен прогресс скачивания: {self._count('completed')} завершенных элементов")
+
+    def _import_legacy(self, data):
+        """
+        Переносит словари completed/failed/skipped старого формата в базу.
+        Записи, которые уже есть в базе, новее JSON файла и не перезаписываются.
+        """
+        existing = {row[0] for row in self._connection().execute("SELECT block_id FROM progress")}
+        for block_id, info in data.get("completed", {}).items():
+            if block_id not in existing:
+                self._write('completed', block_id, info, info.get('completed_at'), info.get('file_path'),
+                            info.get('file_size_mb', 0), info.get('has_video', False))
+        for block_id, info in data.get("failed", {}).items():
+            if block_id not in existing:
+                self._write('failed', block_id, info, info.get('failed_at'), message=info.get('error'))
+        for block_id, info in data.get("skipped", {}).items():
+            if block_id not in existing:
+                self._write('skipped', block_id, info, info.get('skipped_at'), message=info.get('reason'))
+        if data.get("created_at"):
+            self._connection().execute("UPDATE meta SET value = ? WHERE key = 'created_at'", (data["created_at"],))
+
+    def _write(self, status, block_id, block_data, updated_at=None, file_path=None, file_size_mb=0, has_video=False, duration_s=None, message=None, fingerprint=None, stages=None):
+        updated_at = updated_at or datetime.now().isoformat()
+        with self.batch() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO progress (block_id, status, display_name, block_type, updated_at, file_path, file_size_mb, has_video, duration_s, message, fingerprint, stages) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (block_id, status, block_data.get('display_name', 'Без названия'), block_data.get('type', 'unknown'),
+                 updated_at, file_path, file_size_mb, int(bool(has_video)), duration_s, message, fingerprint,
+                 json.dumps(stages) if stages else None)
+            )
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_updated', ?)", (updated_at,))
+
+    def _count(self, status):
+        return self._connection().execute("SELECT COUNT(*) FROM progress WHERE status = ?", (status,)).fetchone()[0]
+
+    def _rows(self, status):
+        return self._connection().execute(
+            "SELECT * FROM progress WHERE status = ? ORDER BY updated_at", (status,)
+        ).fetchall()
+
+    def close(self):
+        """Закрывает соединения с базой (WAL сливается в основной файл при закрытии последнего)"""
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except sqlite3.Error as e:
+                    logger.debug(f"Не удалось закрыть соединение с базой прогресса: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
     def _file_exists_and_valid(self, file_path):
         """Проверяет, существует ли файл и имеет ли он разумный размер"""
         if not file_path or not os.path.exists(file_path):
             return False
-        
+
         try:
             # Проверяем размер файла
             file_size = os.path.getsize(file_path)
             if file_size < 100:  # Файл меньше 100 байт подозрителен
                 return False
-            
+
             # Для HTML файлов проверяем содержимое
             if file_path.endswith('.html'):
                 with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
@@ -82,133 +386,140 @@ class ProgressTracker:
                     # Проверяем, что это не пустая страница или страница с ошибкой
                     if len(content.strip()) < 50:
                         return False
-            
+
             return True
         except Exception as e:
             logger.debug(f"Ошибка при проверке файла {file_path}: {e}")
             return False
-    
+
     def validate_and_cleanup_progress(self):
         """Проверяет реальное состояние файловой системы и обновляет прогресс"""
         logger.info("Проверяю соответствие прогресса реальному состоянию файловой системы...")
-        
-        cleaned_completed = {}
-        cleaned_failed = {}
-        updated_stats = {
-            "total_processed": 0,
-            "total_size_mb": 0,
-            "videos_downloaded": 0,
-            "html_files_created": 0
-        }
-        
-        # Проверяем завершенные элементы
-        for block_id, info in self.progress_data["completed"].items():
-            file_path = info.get('file_path')
-            
-            if self._file_exists_and_valid(file_path):
-                # Файл существует и валиден - оставляем в прогрессе
-                cleaned_completed[block_id] = info
-                
-                # Обновляем статистику
-                updated_stats["total_processed"] += 1
-                updated_stats["total_size_mb"] += info.get('file_size_mb', 0)
-                if info.get('has_video', False):
-                    updated_stats["videos_downloaded"] += 1
-                if file_path and file_path.endswith('.html'):
-                    updated_stats["html_files_created"] += 1
-                    
-                logger.debug(f"✅ Файл существует: {info.get('display_name', block_id)}")
-            else:
+
+        rows = self._rows('completed')
+        names_by_directory = {}
+        for row in rows:
+            if row['file_path']:
+                names_by_directory.setdefault(os.path.dirname(row['file_path']), set()).add(os.path.basename(row['file_path']))
+
+        missing_ids = set()
+        changed_rows = []
+        with ThreadPoolExecutor(max_workers=PROGRESS_VALIDATION_WORKERS) as executor:
+            # Папки читаются параллельно: на сетевых дисках время уходит на ожидание ответов, а не на процессор
+            directories = list(names_by_directory)
+            scanned = executor.map(lambda directory: _scan_fingerprints(directory or '.', names_by_directory[directory]), directories)
+            current_fingerprints = {}
+            for directory, fingerprints in zip(directories, scanned):
+                for name, fingerprint in fingerprints.items():
+                    current_fingerprints[(directory, name)] = fingerprint
+
+            for row in rows:
+                fingerprint = None
+                if row['file_path']:
+                    fingerprint = current_fingerprints.get((os.path.dirname(row['file_path']), os.path.basename(row['file_path'])))
+                if fingerprint is None:
+                    missing_ids.add(row['block_id'])
+                elif fingerprint != row['fingerprint']:
+                    # Файл изменился после скачивания (или отпечаток еще не записан) - проверяем содержимое
+                    changed_rows.append((row, fingerprint))
+
+            checks = executor.map(lambda item: self._file_exists_and_valid(item[0]['file_path']), changed_rows)
+            valid_fingerprints = []
+            for (row, fingerprint), is_valid in zip(changed_rows, checks):
+                if is_valid:
+                    valid_fingerprints.append((fingerprint, row['block_id']))
+                else:
+                    missing_ids.add(row['block_id'])
+
+        for row in rows:
+            if row['block_id'] in missing_ids:
                 # Файл не существует или поврежден - удаляем из завершенных
-                logger.warning(f"❌ Файл не найден или поврежден, удаляю из прогресса: {info.get('display_name', block_id)} -> {file_path}")
-        
-        # Проверяем неудачные элементы - оставляем как есть, но можем очистить старые
-        for block_id, info in self.progress_data["failed"].items():
-            # Оставляем неудачные элементы для повторной попытки
-            cleaned_failed[block_id] = info
-        
-        # Обновляем данные прогресса
-        removed_count = len(self.progress_data["completed"]) - len(cleaned_completed)
-        if removed_count > 0:
-            logger.info(f"🧹 Удалено из прогресса {removed_count} элементов с отсутствующими файлами")
-            
-            self.progress_data["completed"] = cleaned_completed
-            self.progress_data["failed"] = cleaned_failed
-            self.progress_data["statistics"] = updated_stats
-            
-            # Добавляем запись о валидации
-            self.progress_data["last_validated"] = datetime.now().isoformat()
-            
-            self._save_progress()
+                logger.warning(f"❌ Файл не найден или поврежден, удаляю из прогресса: {row['display_name'] or row['block_id']} -> {row['file_path']}")
+        logger.debug(f"Проверено файлов: {len(rows)}, из них по содержимому: {len(changed_rows)}")
+
+        if valid_fingerprints:
+            with self.batch() as connection:
+                connection.executemany(
+                    "UPDATE progress SET fingerprint = ? WHERE block_id = ? AND status = 'completed'", valid_fingerprints
+                )
+
+        # Неудачные элементы остаются для повторной попытки
+        if missing_ids:
+            logger.info(f"🧹 Удалено из прогресса {len(missing_ids)} элементов с отсутствующими файлами")
+            with self.batch() as connection:
+                connection.executemany(
+                    "DELETE FROM progress WHERE block_id = ? AND status = 'completed'",
+                    [(block_id,) for block_id in missing_ids]
+                )
+                # Добавляем запись о валидации
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_validated', ?)", (datetime.now().isoformat(),))
             logger.info("✅ Прогресс обновлен в соответствии с файловой системой")
         else:
             logger.info("✅ Все файлы из прогресса найдены, обновление не требуется")
-    
+
     def is_completed(self, block_id):
         """Проверяет, завершен ли блок"""
-        return block_id in self.progress_data["completed"]
-    
-    def mark_completed(self, block_id, block_data, file_path=None, file_size_mb=0, has_video=False):
+        return self._connection().execute(
+            "SELECT 1 FROM progress WHERE block_id = ? AND status = 'completed'", (block_id,)
+        ).fetchone() is not None
+
+    def mark_completed(self, block_id, block_data, file_path=None, file_size_mb=0, has_video=False, duration_s=None, stages=None):
         """Отмечает блок как завершенный"""
-        self.progress_data["completed"][block_id] = {
-            "display_name": block_data.get('display_name', 'Без названия'),
-            "type": block_data.get('type', 'unknown'),
-            "completed_at": datetime.now().isoformat(),
-            "file_path": file_path,
-            "file_size_mb": round(file_size_mb, 2),
-            "has_video": has_video
-        }
-        
-        # Обновляем статистику
-        stats = self.progress_data["statistics"]
-        stats["total_processed"] += 1
-        stats["total_size_mb"] += file_size_mb
-        if has_video:
-            stats["videos_downloaded"] += 1
-        if file_path and file_path.endswith('.html'):
-            stats["html_files_created"] += 1
-        
-        self._save_progress()
+        # Отпечаток записывается только для корректного файла: при следующем запуске он подтверждает файл без чтения
+        fingerprint = _file_fingerprint(file_path) if self._file_exists_and_valid(file_path) else None
+        self._write('completed', block_id, block_data, file_path=file_path, file_size_mb=round(file_size_mb, 2),
+                    has_video=has_video, duration_s=duration_s, fingerprint=fingerprint, stages=stages)
         logger.debug(f"Отмечен как завершенный: {block_data.get('display_name', block_id)}")
-    
-    def mark_failed(self, block_id, block_data, error_message):
+
+    def mark_failed(self, block_id, block_data, error_message, duration_s=None, stages=None):
         """Отмечает блок как неудачный"""
-        self.progress_data["failed"][block_id] = {
-            "display_name": block_data.get('display_name', 'Без названия'),
-            "type": block_data.get('type', 'unknown'),
-            "failed_at": datetime.now().isoformat(),
-            "error": str(error_message)
-        }
-        self._save_progress()
+        self._write('failed', block_id, block_data, duration_s=duration_s, message=str(error_message), stages=stages)
         logger.warning(f"Отмечен как неудачный: {block_data.get('display_name', block_id)} - {error_message}")
-    
+
     def mark_skipped(self, block_id, block_data, reason):
         """Отмечает блок как пропущенный"""
-        self.progress_data["skipped"][block_id] = {
-            "display_name": block_data.get('display_name', 'Без названия'),
-            "type": block_data.get('type', 'unknown'),
-            "skipped_at": datetime.now().isoformat(),
-            "reason": reason
-        }
-        self._save_progress()
+        self._write('skipped', block_id, block_data, message=reason)
         logger.debug(f"Отмечен как пропущенный: {block_data.get('display_name', block_id)} - {reason}")
-    
+
     def get_statistics(self):
         """Возвращает статистику прогресса"""
-        stats = self.progress_data["statistics"].copy()
-        stats.update({
-            "completed_count": len(self.progress_data["completed"]),
-            "failed_count": len(self.progress_data["failed"]),
-            "skipped_count": len(self.progress_data["skipped"])
-        })
-        return stats
-    
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(file_size_mb), 0), COALESCE(SUM(has_video), 0), "
+            "COALESCE(SUM(file_path LIKE '%.html'), 0) FROM progress WHERE status = 'completed'"
+        ).fetchone()
+        counts = dict(connection.execute("SELECT status, COUNT(*) FROM progress GROUP BY status").fetchall())
+        return {
+            "total_processed": row[0],
+            "total_size_mb": round(row[1], 2),
+            "videos_downloaded": row[2],
+            "html_files_created": row[3],
+            "completed_count": counts.get('completed', 0),
+            "failed_count": counts.get('failed', 0),
+            "skipped_count": counts.get('skipped', 0)
+        }
+
+    def get_block_metrics(self):
+        """Длительность, размер и метрики этапов завершенных страниц (в порядке завершения)"""
+        records = []
+        for row in self._connection().execute(
+            "SELECT display_name, updated_at, duration_s, file_size_mb, stages FROM progress "
+            "WHERE status = 'completed' AND duration_s IS NOT NULL ORDER BY updated_at"
+        ):
+            record = dict(row)
+            try:
+                record['stages'] = json.loads(record['stages']) if record['stages'] else {}
+            except ValueError:
+                record['stages'] = {}
+            records.append(record)
+        return records
+
     def print_progress_table(self):
         """Выводит таблицу прогресса в консоль"""
         print("\n" + "="*80)
         print(f"ПРОГРЕСС СКАЧИВАНИЯ: {self.course_name}")
         print("="*80)
-        
+
         stats = self.get_statistics()
         print(f"📊 Общая статистика:")
         print(f"   • Завершено: {stats['completed_count']}")
@@ -217,77 +528,80 @@ class ProgressTracker:
         print(f"   • Общий размер: {stats['total_size_mb']:.1f} МБ")
         print(f"   • HTML файлов: {stats['html_files_created']}")
         print(f"   • Видео скачано: {stats['videos_downloaded']}")
-        
-        if self.progress_data["completed"]:
-            print(f"\n✅ Завершенные элементы ({len(self.progress_data['completed'])}):")
+
+        if stats['completed_count']:
+            print(f"\n✅ Завершенные элементы ({stats['completed_count']}):")
             print("-" * 80)
-            for block_id, info in self.progress_data["completed"].items():
-                size_info = f" ({info['file_size_mb']:.1f} МБ)" if info['file_size_mb'] > 0 else ""
-                video_info = " 🎥" if info['has_video'] else ""
-                print(f"   {info['display_name'][:60]:<60} {size_info:<10} {video_info}")
-        
-        if self.progress_data["failed"]:
-            print(f"\n❌ Неудачные элементы ({len(self.progress_data['failed'])}):")
+            for row in self._rows('completed'):
+                size_info = f" ({row['file_size_mb']:.1f} МБ)" if row['file_size_mb'] > 0 else ""
+                video_info = " 🎥" if row['has_video'] else ""
+                print(f"   {row['display_name'][:60]:<60} {size_info:<10} {video_info}")
+
+        if stats['failed_count']:
+            print(f"\n❌ Неудачные элементы ({stats['failed_count']}):")
             print("-" * 80)
-            for block_id, info in self.progress_data["failed"].items():
-                print(f"   {info['display_name'][:50]:<50} | {info['error'][:25]}")
-        
-        if self.progress_data["skipped"]:
-            print(f"\n⏭️  Пропущенные элементы ({len(self.progress_data['skipped'])}):")
+            for row in self._rows('failed'):
+                print(f"   {row['display_name'][:50]:<50} | {(row['message'] or '')[:25]}")
+
+        if stats['skipped_count']:
+            print(f"\n⏭️  Пропущенные элементы ({stats['skipped_count']}):")
             print("-" * 80)
-            for block_id, info in self.progress_data["skipped"].items():
-                print(f"   {info['display_name'][:50]:<50} | {info['reason'][:25]}")
-        
+            for row in self._rows('skipped'):
+                print(f"   {row['display_name'][:50]:<50} | {(row['message'] or '')[:25]}")
+
         print("="*80)
-    
+
     def get_resume_point(self, all_blocks):
         """Находит точку для возобновления скачивания"""
-        completed_ids = set(self.progress_data["completed"].keys())
-        failed_ids = set(self.progress_data["failed"].keys())
-        
+        finished_ids = {
+            row[0] for row in self._connection().execute(
+                "SELECT block_id FROM progress WHERE status IN ('completed', 'failed')"
+            )
+        }
+
         # Находим все блоки, которые еще не обработаны
-        remaining_blocks = []
-        for block_id, block_data in all_blocks.items():
-            if block_id not in completed_ids and block_id not in failed_ids:
-                remaining_blocks.append((block_id, block_data))
-        
-        return remaining_blocks
-    
+        return [(block_id, block_data) for block_id, block_data in all_blocks.items() if block_id not in finished_ids]
+
     def should_skip_block(self, block_id, force_overwrite=False):
         """Определяет, нужно ли пропустить блок с проверкой файловой системы"""
         if force_overwrite:
             return False
-        
+
         # Проверяем, есть ли блок в завершенных
-        if block_id not in self.progress_data["completed"]:
+        row = self._connection().execute(
+            "SELECT display_name, file_path, fingerprint FROM progress WHERE block_id = ? AND status = 'completed'", (block_id,)
+        ).fetchone()
+        if row is None:
             return False
-        
-        # Получаем информацию о файле
-        block_info = self.progress_data["completed"][block_id]
-        file_path = block_info.get('file_path')
-        
+
+        # Неизмененный файл подтверждается одним stat, без чтения содержимого
+        fingerprint = _file_fingerprint(row['file_path'])
+        if fingerprint and fingerprint == row['fingerprint']:
+            return True
+
         # Проверяем, существует ли файл реально
-        if self._file_exists_and_valid(file_path):
+        if self._file_exists_and_valid(row['file_path']):
+            with self.batch() as connection:
+                connection.execute(
+                    "UPDATE progress SET fingerprint = ? WHERE block_id = ? AND status = 'completed'", (fingerprint, block_id)
+                )
             return True  # Файл существует и валиден - пропускаем
         else:
             # Файл не существует или поврежден - удаляем из завершенных
-            logger.warning(f"🔄 Файл не найден, повторно скачиваю: {block_info.get('display_name', block_id)} -> {file_path}")
-            del self.progress_data["completed"][block_id]
-            
-            # Обновляем статистику
-            stats = self.progress_data["statistics"]
-            stats["total_processed"] = max(0, stats["total_processed"] - 1)
-            stats["total_size_mb"] = max(0, stats["total_size_mb"] - block_info.get('file_size_mb', 0))
-            if block_info.get('has_video', False):
-                stats["videos_downloaded"] = max(0, stats["videos_downloaded"] - 1)
-            if file_path and file_path.endswith('.html'):
-                stats["html_files_created"] = max(0, stats["html_files_created"] - 1)
-            
-            self._save_progress()
+            logger.warning(f"🔄 Файл не найден, повторно скачиваю: {row['display_name'] or block_id} -> {row['file_path']}")
+            with self.batch() as connection:
+                connection.execute("DELETE FROM progress WHERE block_id = ? AND status = 'completed'", (block_id,))
             return False  # Не пропускаем - нужно скачать заново
-    
+
+    def reset_failed(self):
+        """Удаляет неудачные элементы для повторной попытки. Возвращает их число."""
+        with self.batch() as connection:
+            return connection.execute("DELETE FROM progress WHERE status = 'failed'").rowcount
+
     def cleanup_progress_file(self):
         """Удаляет файл прогресса (для полного перезапуска)"""
-        if os.path.exists(self.progress_file):
-            os.remove(self.progress_file)
-            logger.info("Файл прогресса удален") 
\ No newline at end of file
+        self.close()
+        for path in (self.progress_file, f"{self.progress_file}-wal", f"{self.progress_file}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info("Файл прогресса удален")
@@ -0,0 +1,146 @@
+# request_stats.py
+
+import logging
+import re
+import threading
+from urllib.parse import urlparse
+
+from config import REQUEST_REPORT_TOP
+
+logger = logging.getLogger(__name__)
+
+# Классы адресов для сводки: первый подходящий по пути URL
+_ENDPOINT_CLASSES = [
+    ('api', re.compile(r'/api/|/csrf/|/login')),
+    ('asset', re.compile(r'asset-v1:')),
+    ('video', re.compile(r'\.(mpd|mp4|m4s|ts)$|/embed/')),
+    ('css', re.compile(r'\.css$')),
+    ('js', re.compile(r'\.js$')),
+    ('font', re.compile(r'\.(woff2?|ttf|otf|eot)$')),
+    ('image', re.compile(r'\.(png|jpe?g|gif|webp|svg|avif|bmp|ico)$')),
+    ('page', re.compile(r'/courses/|/xblock/|/learning/')),
+]
+
+
+def classify_url(url):
+    """Класс адреса (api, asset, video, css, js, font, image, page или other)"""
+    path = urlparse(url).path.lower()
+    for name, pattern in _ENDPOINT_CLASSES:
+        if pattern.search(path):
+            return name
+    return 'other'
+
+
+class RequestStats:
+    """
+    Учет HTTP запросов за запуск: число, байты и задержка по хостам и классам адресов,
+    а также повторные успешные загрузки одного и того же URL (с тем же диапазоном байт).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}    # (хост, класс) -> [запросов, байт, сумма задержек, ошибок]
+        self._fetches = {}   # (метод, URL, диапазон) -> [успешных запросов, байт]
+
+    def record(self, method, url, status, size, seconds, byte_range=None):
+        key = (urlparse(url).netloc, classify_url(url))
+        with self._lock:
+            group = self._groups.setdefault(key, [0, 0, 0.0, 0])
+            group[0] += 1
+            group[1] += size or 0
+            group[2] += seconds
+            if status is None or status >= 400:
+                group[3] += 1
+                return
+            fetch = self._fetches.setdefault((method, url, byte_range), [0, 0])
+            fetch[0] += 1
+            fetch[1] += size or 0
+
+    def reset(self):
+        with self._lock:
+            self._groups.clear()
+            self._fetches.clear()
+
+    def report(self, top=REQUEST_REPORT_TOP):
+        """Сводка: итоги, группы по хостам и классам, источники лишних запросов (по убыванию потерь)"""
+        with self._lock:
+            groups = {key: list(value) for key, value in self._groups.items()}
+            fetches = {key: list(value) for key, value in self._fetches.items()}
+
+        waste = []
+        for (method, url, byte_range), (count, size) in fetches.items():
+            if count > 1:
+                waste.append({
+                    'kind': 'duplicate', 'method': method, 'url': url, 'range': byte_range,
+                    'endpoint': classify_url(url), 'count': count, 'wasted_bytes': size - size // count
+                })
+            if method == 'HEAD' and ('GET', url, byte_range) in fetches:
+                waste.append({
+                    'kind': 'head_then_get', 'method': method, 'url': url, 'range': byte_range,
+                    'endpoint': classify_url(url), 'count': count, 'wasted_bytes': 0
+                })
+        waste.sort(key=lambda item: (item['wasted_bytes'], item['count']), reverse=True)
+
+        return {
+            'requests': sum(group[0] for group in groups.values()),
+            'bytes': sum(group[1] for group in groups.values()),
+            'errors': sum(group[3] for group in groups.values()),
+            'redundant_requests': sum(item['count'] - 1 for item in waste if item['kind'] == 'duplicate')
+                                  + sum(item['count'] for item in waste if item['kind'] == 'head_then_get'),
+            'groups': [
+                {'host': host, 'endpoint': endpoint, 'requests': count, 'bytes': size,
+                 'avg_latency_ms': round(seconds / count * 1000, 1) if count else 0.0, 'errors': errors}
+                for (host, endpoint), (count, size, seconds, errors) in sorted(groups.items(), key=lambda item: -item[1][0])
+            ],
+            'waste': waste[:top],
+        }
+
+
+_stats = RequestStats()
+
+
+def record_request(method, url, status, size, seconds, byte_range=None):
+    """
+    Учитывает один HTTP запрос. size - байты тела (по Content-Length, если тело читается позже),
+    seconds - время до получения заголовков ответа.
+    """
+    _stats.record(method, url, status, size, seconds, byte_range)
+
+
+def reset_request_stats():
+    _stats.reset()
+
+
+def get_request_report(top=REQUEST_REPORT_TOP):
+    return _stats.report(top)
+
+
+def format_request_report(top=REQUEST_REPORT_TOP):
+    """Отчет об HTTP запросах запуска строками текста"""
+    report = get_request_report(top)
+    lines = [
+        f"HTTP запросов: {report['requests']}, получено {report['bytes'] / (1024 * 1024):.1f} МБ, "
+        f"ошибок: {report['errors']}, лишних: {report['redundant_requests']}",
+        f"{'Хост':<32} {'Класс':<7} {'Запросов':>9} {'МБ':>9} {'Задержка, мс':>13} {'Ошибок':>7}",
+    ]
+    for group in report['groups']:
+        lines.append(
+            f"{group['host'][:32]:<32} {group['endpoint']:<7} {group['requests']:>9} "
+            f"{group['bytes'] / (1024 * 1024):>9.2f} {group['avg_latency_ms']:>13.1f} {group['errors']:>7}"
+        )
+    if report['waste']:
+        lines.append("Источники лишних запросов:")
+        for item in report['waste']:
+            description = 'HEAD перед GET' if item['kind'] == 'head_then_get' else f"скачан {item['count']} раз(а)"
+            byte_range = f" [{item['range']}]" if item['range'] else ''
+            lines.append(
+                f"  {item['endpoint']:<7} {description}, потеряно {item['wasted_bytes'] / 1024:.0f} КБ: "
+                f"{item['method']} {item['url']}{byte_range}"
+            )
+    return lines
+
+
+def log_request_report(top=REQUEST_REPORT_TOP):
+    """Записывает отчет об HTTP запросах запуска в журнал"""
+    for line in format_request_report(top):
+        logger.info(line)
@@ -0,0 +1,164 @@
+# session_keeper.py
+
+import base64
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from auth import initialize_session_for_course, login_to_skillfactory, save_session
+from config import SESSION_CHECK_INTERVAL, SESSION_MIN_CHECK_DELAY, SESSION_REFRESH_MARGIN, LMS_URL
+
+logger = logging.getLogger(__name__)
+
+# Open edX хранит JWT в двух cookies: заголовок с полезной нагрузкой и подпись
+_JWT_PAYLOAD_COOKIE = 'edx-jwt-cookie-header-payload'
+_LOGIN_REFRESH_URL = f"{LMS_URL}/login_refresh"
+
+
+def _jwt_expiry(session):
+    """Время истечения JWT (exp, Unix time) из cookies сессии или None"""
+    for cookie in session.cookies:
+        if cookie.name != _JWT_PAYLOAD_COOKIE:
+            continue
+        try:
+            payload = cookie.value.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        except (IndexError, ValueError):
+            return None
+    return None
+
+
+def _session_cookie_expiry(session):
+    """Время истечения cookie sessionid, если сервер его указал"""
+    expiries = [cookie.expires for cookie in session.cookies if cookie.name == 'sessionid' and cookie.expires]
+    return min(expiries) if expiries else None
+
+
+class SessionKeeper:
+    """
+    Поддерживает сессию живой во время долгого скачивания.
+    Фоновый поток следит за сроком JWT и cookie sessionid и заранее обновляет их
+    (через login_refresh, а если сессия истекла - повторным входом).
+    Браузеры получают новые cookies перед загрузкой следующей страницы (sync_driver):
+    WebDriver нельзя вызывать из чужого потока.
+    """
+
+    def __init__(self, session, username=None, password=None, session_file=None):
+        self.session = session
+        self.username = username
+        self.password = password
+        self.session_file = session_file
+        self._generation = 0
+        self._driver_state = {}  # id(driver) -> (переданное поколение cookies, cookies, которые браузер не принял)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='session-keeper', daemon=True)
+        self._thread.start()
+        # Браузеры и загрузчики находят хранителя через сессию
+        self.session.session_keeper = self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _next_check_delay(self):
+        """Секунды до следующей проверки: заранее до истечения JWT/sessionid, но не реже SESSION_CHECK_INTERVAL"""
+        deadlines = [expiry for expiry in (_jwt_expiry(self.session), _session_cookie_expiry(self.session)) if expiry]
+        delay = SESSION_CHECK_INTERVAL
+        if deadlines:
+            delay = min(delay, min(deadlines) - SESSION_REFRESH_MARGIN - time.time())
+        return max(delay, 0)
+
+    def _run(self):
+        delay = self._next_check_delay()
+        while not self._stop.wait(delay):
+            try:
+                if not self.refresh():
+                    # Без пароля сессию не восстановить, повторные запросы только нагружают сервер
+                    logger.warning("Хранитель сессии остановлен.")
+                    return
+            except Exception as e:
+                logger.warning(f"Не удалось обновить сессию: {e}")
+            # Не повторяем сразу ни после ошибки, ни если сервер не продлил срок JWT
+            delay = max(self._next_check_delay(), SESSION_MIN_CHECK_DELAY)
+
+    def _refresh_jwt(self):
+        """Обновляет JWT через login_refresh. Возвращает False, если сессия на сервере истекла."""
+        response = self.session.post(_LOGIN_REFRESH_URL, timeout=15)
+        if response.status_code in (401, 403):
+            return False
+        response.raise_for_status()
+        return True
+
+    def refresh(self):
+        """Обновляет JWT, а при истекшей сессии выполняет повторный вход"""
+        with self._lock:
+            if self._refresh_jwt():
+                logger.info("✔ JWT сессии обновлен.")
+            elif self.username and self.password:
+                logger.info("Сессия истекла, выполняю повторный вход...")
+                self._relogin()
+                logger.info("✔ Повторный вход выполнен.")
+            else:
+                logger.warning("Сессия истекла, а пароль неизвестен (сессия была восстановлена из файла). Перезапустите скрипт.")
+                return False
+            self._generation += 1
+        if self.session_file:
+            save_session(self.session, self.session_file)
+        return True
+
+    def _relogin(self):
+        """
+        Входит заново в отдельной сессии и переносит ее cookies в общую.
+        Вход в общей сессии переписал бы заголовки (Origin, Referer), с которыми в этот момент
+        идут запросы потоков скачивания, поэтому курсы инициализируются заново тоже в новой сессии.
+        """
+        fresh_session = login_to_skillfactory(self.username, self.password)
+        if not fresh_session:
+            raise requests.RequestException("повторный вход не удался")
+        try:
+            for course_id in sorted(getattr(self.session, 'initialized_courses', ())):
+                if not initialize_session_for_course(fresh_session, course_id):
+                    logger.warning(f"Не удалось заново инициализировать сессию для курса {course_id}")
+            self.session.cookies.update(fresh_session.cookies)
+        finally:
+            fresh_session.close()
+
+    def sync_driver(self, driver):
+        """Переносит обновленные cookies в браузер (вызывается из потока, который этим браузером управляет)"""
+        with self._lock:
+            generation = self._generation
+            synced_generation, pending = self._driver_state.get(id(driver), (0, []))
+            if synced_generation >= generation:
+                if not pending:
+                    return
+                cookies = pending
+            else:
+                cookies = list(self.session.cookies)
+        failed = []
+        for cookie in cookies:
+            try:
+                driver.add_cookie({k: v for k, v in cookie.__dict__.items() if k != '_rest'})
+            except Exception as e:
+                # Cookies чужого домена браузер принимает только на страницах этого домена: повторим на следующей странице
+                logger.debug(f"Не удалось передать cookie {cookie.name} в браузер: {e}")
+                failed.append(cookie)
+        with self._lock:
+            self._driver_state[id(driver)] = (generation, failed)
+        if len(failed) < len(cookies):
+            logger.debug("Обновленные cookies сессии переданы в браузер.")
+
+
+def sync_driver_cookies(session, driver):
+    """Передает браузеру cookies, обновленные хранителем сессии, если он запущен"""
+    keeper = getattr(session, 'session_keeper', None)
+    if keeper:
+        keeper.sync_driver(driver)
@@ -0,0 +1,253 @@
+# structure_cache.py
+
+import functools
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections.abc import Mapping
+
+try:
+    import orjson  # Необязательная зависимость: ускоряет кодирование JSON
+except ImportError:
+    orjson = None
+
+from pathvalidate import sanitize_filename
+
+from course_sync import _block_fingerprint
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILENAME = 'course_structure.cache'
+LEGACY_CACHE_FILENAME = 'course_structure.json'
+
+_MAGIC = b'SFCS'
+# Версия 3: ID блоков и схема дерева (для CourseIndex без декодирования блоков) хранятся
+# отдельно от краткой сводки, чтобы проверка свежести кэша не разбирала данные каждого блока
+_VERSION = 3
+_FLAG_COMPRESSED = 1
+
+# Заголовок: сигнатура, версия, флаги, время сохранения, длина сводки, длина раздела дерева, длина словаря сжатия
+_HEADER = struct.Struct('<4sHHdIII')
+
+# Блоки маленькие, поэтому сжимаются общим словарем zlib, собранным из первых записей
+_ZDICT_MAX_BYTES = 32 * 1024
+# Запись индекса блоков: смещение от начала данных, длина
+_INDEX_ENTRY = struct.Struct('<QI')
+
+# Поля блока, которые используются при скачивании, навигации и синхронизации
+_CACHED_BLOCK_FIELDS = ('id', 'type', 'display_name', 'children', 'lms_web_url', 'edited_on')
+# Сколько последних декодированных блоков держать в памяти
+_DECODED_CACHE_SIZE = 1024
+
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data).decode('utf-8'))
+
+
+def _compact_block(block_data):
+    """
+    Оставляет только нужные поля блока, отпечаток полного содержимого для --sync
+    и очищенное имя файла (sanitize_filename - самая дорогая часть построения CourseIndex).
+    """
+    compact = {field: block_data[field] for field in _CACHED_BLOCK_FIELDS if field in block_data}
+    compact['fingerprint'] = _block_fingerprint(block_data)
+    compact['sanitized_name'] = sanitize_filename(block_data.get('display_name', 'Без названия'))
+    return compact
+
+
+def _outline_entry(compact):
+    """Схема блока для метаданных: тип, название, очищенное имя и дети"""
+    return [compact.get('type'), compact.get('display_name', 'Без названия'), compact['sanitized_name'], compact.get('children', [])]
+
+
+class LazyBlocks(Mapping):
+    """
+    Словарь блоков, читаемый из кэша по требованию: блок декодируется
+    при обращении по индексу смещений, остальные остаются в файле.
+    Дерево курса (outline) хранится в метаданных, поэтому CourseIndex строится без декодирования блоков.
+    """
+
+    def __init__(self, buffer, ids, index_start, data_start, zdict, outline):
+        self._buffer = buffer
+        self._ids = ids
+        self._positions = {block_id: position for position, block_id in enumerate(ids)}
+        self._index_start = index_start
+        self._data_start = data_start
+        self._zdict = zdict
+        self._outline = outline
+        # Недавние блоки держим декодированными, но не все: иначе обход курса загрузит в память весь кэш
+        self._decode = functools.lru_cache(maxsize=_DECODED_CACHE_SIZE)(self._decode_record)
+
+    def _decode_record(self, position):
+        offset, length = _INDEX_ENTRY.unpack_from(self._buffer, self._index_start + position * _INDEX_ENTRY.size)
+        start = self._data_start + offset
+        record = self._buffer[start:start + length]
+        if self._zdict is not None:
+            decompressor = zlib.decompressobj(zdict=self._zdict)
+            record = decompressor.decompress(record) + decompressor.flush()
+        return _loads(record)
+
+    def outline(self):
+        """Итератор (ID, тип, название, очищенное имя, дети) по всем блокам без их декодирования"""
+        for block_id, (block_type, display_name, sanitized_name, children) in zip(self._ids, self._outline):
+            yield block_id, block_type, display_name, sanitized_name, children
+
+    def __getitem__(self, block_id):
+        return self._decode(self._positions[block_id])
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, block_id):
+        return block_id in self._positions
+
+
+def _read_summary(buffer):
+    """
+    Разбирает заголовок и краткую сводку (название, число блоков, время сохранения).
+    Возвращает (сводка, заголовок) или None, если формат не подходит.
+    """
+    if len(buffer) < _HEADER.size:
+        return None
+    header = _HEADER.unpack_from(buffer, 0)
+    magic, version, flags, saved_at, meta_length, layout_length, zdict_length = header
+    if magic != _MAGIC or version != _VERSION:
+        return None
+    meta = _loads(buffer[_HEADER.size:_HEADER.size + meta_length])
+    meta.update({'version': version, 'saved_at': saved_at})
+    return meta, header
+
+
+def _read_header(buffer):
+    """
+    Разбирает заголовок, сводку, раздел дерева и словарь сжатия.
+    Возвращает (метаданные с ids и outline, словарь сжатия или None, смещение индекса) или None.
+    """
+    parsed = _read_summary(buffer)
+    if not parsed:
+        return None
+    meta, (_, _, flags, _, meta_length, layout_length, zdict_length) = parsed
+    layout_start = _HEADER.size + meta_length
+    meta.update(_loads(buffer[layout_start:layout_start + layout_length]))
+    zdict_start = layout_start + layout_length
+    zdict = bytes(buffer[zdict_start:zdict_start + zdict_length]) if flags & _FLAG_COMPRESSED else None
+    return meta, zdict, zdict_start + zdict_length
+
+
+def save_structure_cache(output_dir, course_structure, compress=True):
+    """
+    Сохраняет структуру курса в компактном бинарном формате:
+    заголовок с версией, метаданные, индекс смещений блоков и сами блоки
+    (каждый отдельно, при compress=True - сжатый zlib с общим словарем).
+    """
+    cache_path = os.path.join(output_dir, CACHE_FILENAME)
+    blocks = course_structure['course_blocks']['blocks']
+    ids = list(blocks)
+    compact_blocks = [_compact_block(blocks[block_id]) for block_id in ids]
+    records = [_dumps(compact) for compact in compact_blocks]
+    zdict = b''
+    if compress:
+        # Последние байты словаря zlib использует охотнее, поэтому берем записи с конца выборки
+        zdict = b''.join(records[:256])[-_ZDICT_MAX_BYTES:]
+        compressed_records = []
+        for record in records:
+            compressor = zlib.compressobj(6, zdict=zdict)
+            compressed_records.append(compressor.compress(record) + compressor.flush())
+        records = compressed_records
+
+    meta = {
+        # Скалярные поля верхнего уровня (name, id и т.п.)
+        'top': {key: value for key, value in course_structure.items() if isinstance(value, (str, int, float, bool)) or value is None},
+        'course_blocks_root': course_structure['course_blocks'].get('root'),
+        'block_count': len(ids)
+    }
+    meta_bytes = _dumps(meta)
+    layout_bytes = _dumps({'ids': ids, 'outline': [_outline_entry(compact) for compact in compact_blocks]})
+
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, _FLAG_COMPRESSED if compress else 0, time.time(), len(meta_bytes), len(layout_bytes), len(zdict)))
+        f.write(meta_bytes)
+        f.write(layout_bytes)
+        f.write(zdict)
+        offset = 0
+        for record in records:
+            f.write(_INDEX_ENTRY.pack(offset, len(record)))
+            offset += len(record)
+        for record in records:
+            f.write(record)
+    os.replace(temp_path, cache_path)
+    logger.info(f"Структура курса сохранена в кэш: {cache_path}")
+    return cache_path
+
+
+def read_cache_info(output_dir):
+    """
+    Читает только заголовок и краткую сводку кэша, не разбирая ID, дерево и блоки.
+    Возвращает словарь (name, block_count, saved_at, ...) или None, если кэша нет.
+    """
+    cache_path = os.path.join(output_dir, CACHE_FILENAME)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                header = f.read(_HEADER.size)
+                if len(header) == _HEADER.size:
+                    meta_length = _HEADER.unpack_from(header, 0)[4]
+                    parsed = _read_summary(header + f.read(meta_length))
+                    if parsed:
+                        meta = parsed[0]
+                        return {'name': meta['top'].get('name'), 'block_count': meta['block_count'], 'saved_at': meta['saved_at'], 'legacy': False}
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать заголовок кэша структуры: {e}")
+    legacy_path = os.path.join(output_dir, LEGACY_CACHE_FILENAME)
+    if os.path.exists(legacy_path):
+        return {'name': None, 'block_count': None, 'saved_at': os.path.getmtime(legacy_path), 'legacy': True}
+    return None
+
+
+def load_structure_cache(output_dir, lazy=True):
+    """
+    Загружает структуру курса из кэша.
+    С lazy=True файл отображается в память (mmap), и блоки декодируются по мере обращения.
+    Поддерживается и старый формат course_structure.json. Возвращает структуру или None.
+    """
+    cache_path = os.path.join(output_dir, CACHE_FILENAME)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                if lazy:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    buffer = f.read()
+            parsed = _read_header(buffer)
+            if parsed:
+                meta, zdict, index_start = parsed
+                data_start = index_start + meta['block_count'] * _INDEX_ENTRY.size
+                blocks = LazyBlocks(buffer, meta['ids'], index_start, data_start, zdict, meta['outline'])
+                course_structure = dict(meta['top'])
+                course_structure['course_blocks'] = {'root': meta['course_blocks_root'], 'blocks': blocks}
+                return course_structure
+            logger.warning("Кэш структуры курса имеет неизвестный формат, он будет пересоздан.")
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить кэш структуры курса: {e}")
+
+    legacy_path = os.path.join(output_dir, LEGACY_CACHE_FILENAME)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return None
@@ -0,0 +1,148 @@
+# tracing.py
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Трассировка в формате Chrome Trace Event (открывается в chrome://tracing и https://ui.perfetto.dev).
+# События пишутся в файл сразу (формат массива JSON допускает отсутствие закрывающей скобки),
+# поэтому память не растет, а трасса сохраняется даже при аварийном завершении.
+# Пока трассировка выключена, span() возвращает общий пустой объект и ничего не записывает.
+
+_enabled = False
+_file = None
+_lock = threading.Lock()
+_named_threads = set()
+_async_ids = iter(range(1, 1 << 62))
+_origin = time.perf_counter()
+_pid = os.getpid()
+
+
+def is_enabled():
+    return _enabled
+
+
+def start(path):
+    """Включает трассировку с записью в файл path"""
+    global _enabled, _file
+    stop()
+    with _lock:
+        _file = open(path, 'w', encoding='utf-8', buffering=1024 * 1024)
+        _file.write('[\n')
+        _named_threads.clear()
+        _enabled = True
+    atexit.register(stop)
+    logger.info(f"Трассировка включена, файл: {path}")
+
+
+def stop():
+    """Выключает трассировку и закрывает файл"""
+    global _enabled, _file
+    with _lock:
+        if _file is None:
+            return
+        _enabled = False
+        # Пустой объект в конце, чтобы не возиться с запятой после последнего события
+        _file.write('{}]\n')
+        path = _file.name
+        _file.close()
+        _file = None
+    logger.info(f"✔ Трасса сохранена: {path}")
+
+
+def _write(event):
+    thread = threading.current_thread()
+    with _lock:
+        if _file is None:
+            return
+        if event['tid'] not in _named_threads:
+            _named_threads.add(event['tid'])
+            _file.write(json.dumps({
+                'name': 'thread_name', 'ph': 'M', 'pid': _pid, 'tid': event['tid'], 'args': {'name': thread.name}
+            }, ensure_ascii=False) + ',\n')
+        _file.write(json.dumps(event, ensure_ascii=False, default=str) + ',\n')
+
+
+def add_span(name, category, started_at, finished_at, args=None):
+    """Записывает завершенный отрезок времени (значения time.perf_counter) текущего потока"""
+    if not _enabled:
+        return
+    event = {
+        'name': name, 'cat': category, 'ph': 'X', 'pid': _pid, 'tid': threading.get_ident(),
+        'ts': round((started_at - _origin) * 1e6, 1), 'dur': round((finished_at - started_at) * 1e6, 1)
+    }
+    if args:
+        event['args'] = args
+    _write(event)
+
+
+def add_async_span(name, category, started_at, finished_at, args=None):
+    """
+    Отрезок, который пересекается с другими в том же потоке (запросы цикла событий asyncio).
+    Записывается парой асинхронных событий, чтобы просмотрщик показал их отдельными дорожками.
+    """
+    if not _enabled:
+        return
+    span_id = next(_async_ids)
+    tid = threading.get_ident()
+    begin = {'name': name, 'cat': category, 'ph': 'b', 'id': span_id, 'pid': _pid, 'tid': tid, 'ts': round((started_at - _origin) * 1e6, 1)}
+    if args:
+        begin['args'] = args
+    _write(begin)
+    _write({'name': name, 'cat': category, 'ph': 'e', 'id': span_id, 'pid': _pid, 'tid': tid, 'ts': round((finished_at - _origin) * 1e6, 1)})
+
+
+class _Span:
+    __slots__ = ('name', 'category', 'args', 'started_at')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def set(self, **args):
+        """Добавляет аргументы к отрезку (например, статус ответа и размер)"""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        add_span(self.name, self.category, self.started_at, time.perf_counter(), self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, category, **args):
+    """
+    Контекстный менеджер отрезка трассы:
+        with tracing.span('ffmpeg', 'video', file=name) as span:
+            ...
+            span.set(returncode=0)
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, category, args)
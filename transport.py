@@ -0,0 +1,171 @@
+# transport.py
+
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx  # Необязательная зависимость: HTTP/2 для видеопотоков Kinescope (pip install "httpx[http2]")
+except ImportError:
+    httpx = None
+
+from config import HTTP_POOL_HOSTS, HTTP_POOL_MAXSIZE, HTTP_RETRIES, HTTP_BACKOFF_FACTOR
+import tracing
+from request_stats import record_request
+
+logger = logging.getLogger(__name__)
+
+# Ответы, при которых запрос повторяется с паузой (учитывая Retry-After)
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_media_client = None
+_media_client_unavailable = False
+_media_client_lock = threading.Lock()
+
+
+def _build_retry():
+    return Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=_RETRY_STATUSES,
+        # POST (вход в систему) не повторяем автоматически
+        allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+        respect_retry_after_header=True,
+        # После исчерпания попыток возвращаем последний ответ: ошибку обработает raise_for_status
+        raise_on_status=False
+    )
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, который учитывает каждый запрос в статистике запуска (request_stats.py)
+    и при включенной трассировке записывает его в трассу (хост, статус, размер).
+    Время считается до получения заголовков ответа, включая повторы; тело читается позже,
+    поэтому размер берется из Content-Length.
+    """
+
+    def send(self, request, **kwargs):
+        started_at = time.perf_counter()
+        args = {'url': request.url}
+        try:
+            response = super().send(request, **kwargs)
+            args['status'] = response.status_code
+            content_length = response.headers.get('Content-Length', '')
+            args['bytes'] = int(content_length) if content_length.isdigit() else None
+            return response
+        except Exception as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            finished_at = time.perf_counter()
+            record_request(request.method, request.url, args.get('status'), args.get('bytes'),
+                           finished_at - started_at, request.headers.get('Range'))
+            tracing.add_span(f"{request.method} {urlparse(request.url).netloc}", 'http', started_at, finished_at, args)
+
+
+def configure_session(session, pool_maxsize=HTTP_POOL_MAXSIZE):
+    """
+    Подключает к сессии адаптеры с пулом соединений под число потоков скачивания
+    и повторами с паузой при 429/5xx и сетевых ошибках.
+    Пулы хранятся для HTTP_POOL_HOSTS хостов, поэтому соединения (DNS, TLS)
+    к LMS, CDN и Kinescope переиспользуются, а не вытесняют друг друга.
+    """
+    adapter = InstrumentedHTTPAdapter(
+        pool_connections=HTTP_POOL_HOSTS,
+        pool_maxsize=pool_maxsize,
+        max_retries=_build_retry()
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def create_session(pool_maxsize=HTTP_POOL_MAXSIZE):
+    """Создает requests.Session с настроенным транспортом"""
+    return configure_session(requests.Session(), pool_maxsize)
+
+
+def get_media_client():
+    """
+    Возвращает общий HTTP/2 клиент httpx для запросов диапазонов видеопотоков
+    или None, если httpx (с поддержкой HTTP/2) не установлен.
+    """
+    global _media_client, _media_client_unavailable
+    if httpx is None or _media_client_unavailable:
+        return None
+    with _media_client_lock:
+        if _media_client is None and not _media_client_unavailable:
+            try:
+                # Повторы при сетевых ошибках выполняет транспорт, при 429/5xx - fetch_range
+                _media_client = httpx.Client(
+                    timeout=60,
+                    transport=httpx.HTTPTransport(
+                        http2=True,
+                        retries=HTTP_RETRIES,
+                        limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_MAXSIZE)
+                    )
+                )
+                logger.debug("Для видеопотоков используется HTTP/2 клиент httpx.")
+            except ImportError:
+                # httpx установлен без пакета h2
+                logger.debug("Пакет h2 не установлен, видеопотоки скачиваются через requests.")
+                _media_client_unavailable = True
+        return _media_client
+
+
+def _retry_delay(response, attempt):
+    """Пауза перед повтором: Retry-After из ответа или экспоненциальная задержка"""
+    retry_after = response.headers.get('retry-after', '')
+    if retry_after.isdigit():
+        return int(retry_after)
+    return HTTP_BACKOFF_FACTOR * (2 ** attempt)
+
+
+def _request_headers(session, url):
+    """Заголовки и cookies сессии requests, которые она отправила бы на этот URL"""
+    return dict(session.prepare_request(requests.Request('GET', url)).headers)
+
+
+def fetch_range(session, url, byte_range, timeout=60, referer=None):
+    """
+    Скачивает диапазон байт (Range) и возвращает содержимое.
+    Использует HTTP/2 клиент, если он доступен, иначе сессию requests.
+    При ошибке выбрасывает requests.RequestException.
+    """
+    headers = {'Range': f"bytes={byte_range}"}
+    if referer:
+        headers['Referer'] = referer
+    media_client = get_media_client()
+    if media_client is None:
+        response = session.get(url, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+
+    # Клиент HTTP/2 не знает о сессии: передаем ее заголовки и cookies явно
+    headers = {**_request_headers(session, url), **headers}
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            with tracing.span(f"GET {urlparse(url).netloc}", 'http', url=url, range=byte_range) as span:
+                response = media_client.get(url, headers=headers, timeout=timeout)
+                span.set(status=response.status_code, bytes=len(response.content), http_version=response.http_version)
+            record_request('GET', url, response.status_code, len(response.content), response.elapsed.total_seconds(), headers['Range'])
+            if response.status_code in _RETRY_STATUSES and attempt < HTTP_RETRIES:
+                time.sleep(_retry_delay(response, attempt))
+                continue
+            response.raise_for_status()
+            return response.content
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e))
+
+
+def close_media_client():
+    global _media_client
+    with _media_client_lock:
+        if _media_client is not None:
+            _media_client.close()
+            _media_client = None
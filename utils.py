@@ -1,35 +1,461 @@
 import logging
 import os
+import json
+import re
+import tempfile
+import threading
 import requests
+import urllib3
 from tqdm import tqdm
 
+import metrics
+from config import DOWNLOAD_CHUNK_MIN_BYTES, DOWNLOAD_CHUNK_MAX_BYTES, DOWNLOAD_RESUME_ATTEMPTS
+
 logger = logging.getLogger(__name__)
 
-def download_file(url, filepath, session):
+# Сигнатуры форматов для определения типа файла по первым байтам содержимого
+_MAGIC_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'%PDF-', 'pdf'),
+    (b'PK\x03\x04', 'zip'),
+]
+
+# Соответствие Content-Type -> расширение (порядок важен: pptx/xlsx содержат 'document' в типе)
+_CONTENT_TYPE_EXTENSIONS = [
+    ('image/png', 'png'),
+    ('image/jpeg', 'jpg'),
+    ('image/jpg', 'jpg'),
+    ('image/gif', 'gif'),
+    ('image/webp', 'webp'),
+    ('image/svg', 'svg'),
+    ('image/avif', 'avif'),
+    ('image/bmp', 'bmp'),
+    ('icon', 'ico'),
+    ('pdf', 'pdf'),
+    ('powerpoint', 'pptx'),
+    ('presentation', 'pptx'),
+    ('excel', 'xlsx'),
+    ('spreadsheet', 'xlsx'),
+    ('word', 'docx'),
+    ('document', 'docx'),
+    ('zip', 'zip'),
+    ('rar', 'rar'),
+]
+
+
+def sniff_extension(content_type, head_bytes, content_disposition=None):
     """
-    Скачивает файл по URL и сохраняет его по указанному пути, используя сессию.
-    Показывает прогресс-бар с помощью tqdm.
+    Определяет расширение файла по заголовкам ответа или по сигнатуре первых байт.
+    Возвращает расширение без точки или None, если тип определить не удалось.
     """
+    # 1. Имя файла из Content-Disposition
+    if content_disposition:
+        filename_match = re.search(r'filename\*?=(?:UTF-8\'\')?["\']?([^"\';]+)', content_disposition, re.IGNORECASE)
+        if filename_match:
+            extension = os.path.splitext(filename_match.group(1).strip())[1].lstrip('.').lower()
+            if extension:
+                return 'jpg' if extension == 'jpeg' else extension
+
+    # 2. Content-Type (общие типы вроде application/octet-stream пропускаем)
+    content_type = (content_type or '').lower()
+    for marker, extension in _CONTENT_TYPE_EXTENSIONS:
+        if marker in content_type:
+            return extension
+
+    # 3. Сигнатура содержимого
+    if head_bytes:
+        for signature, extension in _MAGIC_SIGNATURES:
+            if head_bytes.startswith(signature):
+                return extension
+        if head_bytes[:4] == b'RIFF' and head_bytes[8:12] == b'WEBP':
+            return 'webp'
+        text_head = head_bytes[:512].lstrip().lower()
+        if text_head.startswith(b'<svg') or (text_head.startswith(b'<?xml') and b'<svg' in text_head):
+            return 'svg'
+
+    return None
+
+
+def _is_unexpected_content(response, url):
+    """Проверяет, не вернул ли сервер HTML/JSON вместо файла"""
+    content_type = response.headers.get('content-type', '').lower()
+    if 'html' in content_type or 'json' in content_type:
+        logger.warning(f"Сервер вернул {content_type} вместо файла для URL: {url}")
+        return True
+    return False
+
+
+class _TransferProgress:
+    """
+    Общий прогресс-бар для всех скачиваемых файлов запуска.
+    Вместо отдельного tqdm на каждый файл показывает суммарные байты и число файлов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bar = None
+        self._active_files = 0
+        self._finished_files = 0
+        self.enabled = True
+
+    def start_file(self, expected_size):
+        with self._lock:
+            if self._bar is None:
+                self._bar = tqdm(total=0, unit='iB', unit_scale=True, desc="Файлы", leave=False, disable=not self.enabled)
+            self._active_files += 1
+            if expected_size:
+                self._bar.total += expected_size
+                self._bar.refresh()
+
+    def update(self, size):
+        with self._lock:
+            if self._bar is not None:
+                self._bar.update(size)
+
+    def finish_file(self, expected_size, written_size):
+        with self._lock:
+            self._active_files -= 1
+            self._finished_files += 1
+            if self._bar is None:
+                return
+            # Корректируем общий объем, если размер файла был неизвестен или не совпал
+            self._bar.total += written_size - (expected_size or 0)
+            self._bar.set_postfix(files=self._finished_files, refresh=False)
+            if self._active_files == 0:
+                self._bar.refresh()
+
+    def close(self):
+        with self._lock:
+            if self._bar is not None:
+                self._bar.close()
+                self._bar = None
+
+
+_transfer_progress = _TransferProgress()
+_buffers = threading.local()  # Переиспользуемый буфер чтения для каждого потока
+
+
+def close_transfer_progress():
+    """Закрывает общий прогресс-бар скачивания файлов"""
+    _transfer_progress.close()
+
+
+def set_transfer_progress_enabled(enabled):
+    """Включает или отключает вывод общего прогресс-бара (замерам он только мешает)"""
+    close_transfer_progress()
+    _transfer_progress.enabled = enabled
+
+
+def _get_read_buffer():
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _buffers.buffer = memoryview(bytearray(DOWNLOAD_CHUNK_MAX_BYTES))
+    return buffer
+
+
+def _iter_body(response, expected_size):
+    """
+    Итерирует тело ответа блоками.
+    Без сжатия данные читаются через readinto в переиспользуемый буфер потока,
+    размер блока подбирается по Content-Length. Возвращаемые memoryview
+    действительны только до следующего шага итерации.
+    """
+    chunk_size = min(max((expected_size or 0) // 8, DOWNLOAD_CHUNK_MIN_BYTES), DOWNLOAD_CHUNK_MAX_BYTES)
+    raw = getattr(response, 'raw', None)
+    if response.headers.get('content-encoding') or not hasattr(raw, 'readinto'):
+        # Сжатый ответ должен пройти через декодер requests
+        yield from response.iter_content(chunk_size=chunk_size)
+        return
+    buffer = _get_read_buffer()[:chunk_size]
+    while True:
+        try:
+            size = raw.readinto(buffer)
+        except urllib3.exceptions.HTTPError as e:
+            # Приводим ошибки urllib3 к исключениям requests, как это делает iter_content
+            raise requests.exceptions.ConnectionError(e)
+        if not size:
+            break
+        yield buffer[:size]
+
+
+def _expected_size(response):
+    """Ожидаемый размер тела по Content-Length (None для сжатых ответов и без заголовка)"""
+    if response.headers.get('content-encoding'):
+        return None
     try:
-        response = session.get(url, stream=True, timeout=30)
-        response.raise_for_status()
+        return int(response.headers.get('content-length')) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def _resume_meta_path(filepath):
+    return f"{filepath}.part.json"
+
+
+def _discard_partial(filepath):
+    """Удаляет недокачанный файл и его метаданные"""
+    for path in (f"{filepath}.part", _resume_meta_path(filepath)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _create_temp_file(filepath):
+    """
+    Создает уникальный временный файл рядом с filepath и возвращает (файл, путь).
+    Курсы в пакетном режиме делят папку _assets, поэтому один ресурс могут одновременно писать несколько потоков.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.', prefix=f"{os.path.basename(filepath)}.", suffix='.tmp')
+    return os.fdopen(fd, 'wb'), temp_path
+
+
+def _remove_temp_file(temp_path):
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
 
-        content_type = response.headers.get('content-type', '').lower()
-        if 'html' in content_type or 'json' in content_type:
-             logger.warning(f"Сервер вернул {content_type} вместо файла для URL: {url}")
-             return False
-
-        total_size = int(response.headers.get('content-length', 0))
-        with open(filepath, 'wb') as f, tqdm(
-            total=total_size, unit='iB', unit_scale=True,
-            desc=os.path.basename(filepath), leave=False
-        ) as pbar:
-            for data in response.iter_content(chunk_size=8192):
+
+def _path_lock(filepath):
+    """Блокировка итогового пути файла, общая для всех потоков процесса"""
+    with _path_locks_guard:
+        return _path_locks.setdefault(os.path.abspath(filepath), threading.Lock())
+
+
+def _write_file_atomic(filepath, data):
+    """Записывает байты через уникальный временный файл, чтобы по итоговому пути не было видно недописанного файла"""
+    f, temp_path = _create_temp_file(filepath)
+    try:
+        with f:
+            f.write(data)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        _remove_temp_file(temp_path)
+        raise
+
+
+def _load_resume_state(filepath, url):
+    """
+    Возвращает (размер .part файла, валидатор ETag/Last-Modified), если загрузку
+    этого URL можно продолжить, иначе None.
+    """
+    temp_path = f"{filepath}.part"
+    meta_path = _resume_meta_path(filepath)
+    if not os.path.exists(temp_path) or not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except Exception:
+        return None
+    offset = os.path.getsize(temp_path)
+    if meta.get('url') != url or not meta.get('validator') or not offset:
+        return None
+    return offset, meta['validator']
+
+
+def _resume_validator(response):
+    """Валидатор для If-Range, если сервер поддерживает докачку по Range, иначе None"""
+    if response.headers.get('accept-ranges', '').lower() != 'bytes' or response.headers.get('content-encoding'):
+        return None
+    etag = response.headers.get('etag')
+    # Слабый ETag нельзя использовать в If-Range
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('last-modified')
+
+
+def _write_response(response, filepath, chunks, first_chunk=b'', offset=0, resume_meta=None):
+    """
+    Записывает тело ответа во временный файл и атомарно переименовывает его.
+    При обрыве или несовпадении с Content-Length файл по итоговому пути не появляется.
+    offset - размер уже скачанной части (данные дописываются в .part файл).
+    С resume_meta недокачанный .part файл сохраняется вместе с метаданными для докачки
+    (такие загрузки download_file выполняет под блокировкой пути). Остальные пишутся
+    в уникальный временный файл, поэтому одновременные загрузки одного ресурса не мешают друг другу.
+    Возвращает True при успехе.
+    """
+    expected_size = _expected_size(response)
+    resumable_part = bool(resume_meta or offset)
+    written_size = 0
+    if resume_meta:
+        with open(_resume_meta_path(filepath), 'w', encoding='utf-8') as f:
+            json.dump(resume_meta, f, ensure_ascii=False)
+    elif os.path.exists(_resume_meta_path(filepath)):
+        os.remove(_resume_meta_path(filepath))
+    if resumable_part:
+        temp_path = f"{filepath}.part"
+        temp_file = open(temp_path, 'ab' if offset else 'wb')
+    else:
+        temp_file, temp_path = _create_temp_file(filepath)
+    _transfer_progress.start_file(expected_size)
+    try:
+        with temp_file as f:
+            if first_chunk:
+                f.write(first_chunk)
+                written_size += len(first_chunk)
+                _transfer_progress.update(len(first_chunk))
+            for data in chunks:
                 f.write(data)
-                pbar.update(len(data))
+                written_size += len(data)
+                _transfer_progress.update(len(data))
+        if expected_size is not None and written_size != expected_size:
+            logger.warning(f"Файл '{os.path.basename(filepath)}' скачан не полностью: {offset + written_size} из {offset + expected_size} байт")
+            if not resumable_part:
+                _remove_temp_file(temp_path)
+            elif not resume_meta or written_size > expected_size:
+                _discard_partial(filepath)
+            return False
+        os.replace(temp_path, filepath)
+        if resume_meta:
+            os.remove(_resume_meta_path(filepath))
+        return True
+    except BaseException:
+        if not resumable_part:
+            _remove_temp_file(temp_path)
+        elif not resume_meta:
+            _discard_partial(filepath)
+        raise
+    finally:
+        _transfer_progress.finish_file(expected_size, written_size)
+        metrics.add_bytes(written_size)
+
 
-        logger.debug(f"Файл '{os.path.basename(filepath)}' успешно скачан.")
+def download_file(url, filepath, session, skip_existing=False, resumable=False):
+    """
+    Скачивает файл по URL и сохраняет его по указанному пути, используя сессию.
+    Файл записывается атомарно, поэтому существующий файл всегда скачан целиком:
+    с skip_existing=True он не скачивается повторно.
+    С resumable=True при обрыве .part файл сохраняется и загрузка продолжается
+    запросом Range (в том числе при следующем запуске), если сервер это поддерживает.
+    """
+    if not resumable:
+        return _download_file(url, filepath, session, skip_existing, resumable)
+    # Докачка идет через общий .part файл, поэтому один и тот же путь скачивает только один поток
+    with _path_lock(filepath):
+        return _download_file(url, filepath, session, skip_existing, resumable)
+
+
+def _download_file(url, filepath, session, skip_existing, resumable):
+    if skip_existing and os.path.exists(filepath):
+        logger.debug(f"Файл '{os.path.basename(filepath)}' уже существует, пропускаю.")
         return True
+
+    attempts = DOWNLOAD_RESUME_ATTEMPTS if resumable else 1
+    for attempt in range(1, attempts + 1):
+        offset = 0
+        headers = None
+        resume_state = _load_resume_state(filepath, url) if resumable else None
+        if resume_state:
+            offset, validator = resume_state
+            headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+            logger.info(f"Продолжаю скачивание '{os.path.basename(filepath)}' с {offset / (1024 * 1024):.1f} МБ")
+
+        try:
+            response = session.get(url, stream=True, timeout=30, headers=headers)
+            if response.status_code == 416 and offset:
+                # Сохраненная часть не соответствует файлу на сервере - начинаем заново
+                response.close()
+                _discard_partial(filepath)
+                continue
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.error(f"Ошибка при скачивании файла {url}: {e}")
+            return False
+
+        resume_meta = None
+        try:
+            if _is_unexpected_content(response, url):
+                return False
+
+            if offset and response.status_code != 206:
+                # Сервер проигнорировал Range или файл изменился (If-Range) - пишем с начала
+                logger.debug(f"Сервер не продолжил загрузку '{os.path.basename(filepath)}', скачиваю заново.")
+                offset = 0
+            elif offset and not response.headers.get('content-range', '').startswith(f'bytes {offset}-'):
+                logger.warning(f"Неожиданный Content-Range для {url}, скачиваю заново.")
+                _discard_partial(filepath)
+                continue
+
+            if resumable:
+                validator = _resume_validator(response) or (resume_state[1] if offset else None)
+                if validator:
+                    resume_meta = {'url': url, 'validator': validator}
+
+            if _write_response(response, filepath, _iter_body(response, _expected_size(response)), offset=offset, resume_meta=resume_meta):
+                logger.debug(f"Файл '{os.path.basename(filepath)}' успешно скачан.")
+                return True
+            if not resume_meta:
+                return False
+        except (requests.RequestException, OSError) as e:
+            if not resume_meta or attempt == attempts:
+                logger.error(f"Ошибка при скачивании файла {url}: {e}")
+                return False
+            logger.warning(f"Соединение прервано при скачивании '{os.path.basename(filepath)}' ({e}), пробую докачать...")
+        finally:
+            response.close()
+    return False
+
+
+def download_file_sniffed(url, session, build_path, allowed_extensions=None, default_extension=None):
+    """
+    Скачивает файл одним GET-запросом, определяя расширение по заголовкам ответа
+    или по первым байтам содержимого (вместо отдельного HEAD-запроса).
+
+    build_path(extension) должна вернуть путь, по которому сохраняется файл.
+    Если тип не определен или не входит в allowed_extensions, используется
+    default_extension; без него файл отклоняется.
+    Возвращает путь к сохраненному файлу или None.
+    """
+    try:
+        response = session.get(url, stream=True, timeout=30)
+        response.raise_for_status()
     except requests.RequestException as e:
+        logger.debug(f"Ошибка при запросе {url}: {e}")
+        return None
+
+    try:
+        if _is_unexpected_content(response, url):
+            return None
+
+        chunks = _iter_body(response, _expected_size(response))
+        first_chunk = bytes(next(chunks, b''))
+        extension = sniff_extension(
+            response.headers.get('content-type'),
+            first_chunk,
+            response.headers.get('content-disposition')
+        )
+        if not extension or (allowed_extensions and extension not in allowed_extensions):
+            if not default_extension:
+                logger.debug(f"Не удалось определить подходящий тип файла ({extension}) для URL: {url}")
+                return None
+            extension = default_extension
+
+        filepath = build_path(extension)
+        if not _write_response(response, filepath, chunks, first_chunk):
+            return None
+
+        logger.debug(f"Файл '{os.path.basename(filepath)}' успешно скачан (тип: {extension}).")
+        return filepath
+    except (requests.RequestException, OSError) as e:
         logger.error(f"Ошибка при скачивании файла {url}: {e}")
-        return False
\ No newline at end of file
+        return None
+    finally:
+        response.close()
+
+
+_download_budget = threading.local()
+
+
+def set_download_budget(max_workers):
+    """
+    Задает число потоков скачивания ресурсов (download_assets без httpx) для текущего потока.
+    В пакетном режиме так делится общий бюджет между курсами, скачиваемыми параллельно.
+    """
+    _download_budget.max_workers = max_workers